@@ -12,128 +12,123 @@ Logic:
 """
 
 import sqlite3
-from datetime import datetime, timedelta
 
-def backfill_plant_depot(db_path='webapp_sales_collections.db'):
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    
-    # Get all unloading records with NULL plant_depot
-    cursor.execute('''
-        SELECT id, truck_number, unloading_date, dealer_code
+from sqlite_tuning import CACHED_STATEMENTS, tune
+
+# Covering index so the billing lookups by (truck_number, sale_date) are index-only
+INDEX_SQL = '''
+    CREATE INDEX IF NOT EXISTS idx_sales_truck_date
+        ON sales_data(truck_number, sale_date, plant_depot, dealer_code);
+    ANALYZE;
+'''
+
+CHANGES_SQL = 'SELECT changes()'
+
+COUNT_PENDING_SQL = '''
+    SELECT COUNT(*) FROM vehicle_unloading WHERE plant_depot IS NULL
+'''
+
+# Fast path for the common case: every same-date billing of the vehicle comes
+# from one plant_depot, so that plant_depot wins whatever the dealer_code
+SAME_DAY_SQL = '''
+    UPDATE vehicle_unloading
+    SET plant_depot = same_day.plant_depot
+    FROM (
+        SELECT truck_number, sale_date, MIN(plant_depot) AS plant_depot
+        FROM sales_data
+        GROUP BY truck_number, sale_date
+        HAVING COUNT(DISTINCT plant_depot) = 1
+    ) AS same_day
+    WHERE vehicle_unloading.plant_depot IS NULL
+      AND same_day.truck_number = vehicle_unloading.truck_number
+      AND same_day.sale_date = vehicle_unloading.unloading_date
+'''
+
+# The rest of the strategy ladder as one statement, run on the residue left by
+# the fast path. Each CTE resolves one rung, and the first non-NULL rung wins:
+#   same_day_match  - same-date billing whose dealer_code matches (first by sale id)
+#   nearby_match    - closest billing within +/- 3 days whose dealer_code matches
+#   closest         - closest billing within +/- 3 days
+#   historical      - vehicles that only ever billed from one plant_depot,
+#                     falling back to PLANT (only when the unloading has no dealer_code)
+BACKFILL_SQL = '''
+    WITH pending AS (
+        SELECT id, truck_number, unloading_date,
+               COALESCE(CAST(dealer_code AS TEXT), '') AS dealer_code
         FROM vehicle_unloading
         WHERE plant_depot IS NULL
-        ORDER BY unloading_date, truck_number
-    ''')
+    ),
+    nearby AS (
+        SELECT p.id, s.id AS sale_id, s.plant_depot,
+               s.sale_date = p.unloading_date AS same_day,
+               p.dealer_code <> '' AND CAST(s.dealer_code AS TEXT) = p.dealer_code AS dealer_match,
+               ROW_NUMBER() OVER (
+                   PARTITION BY p.id
+                   ORDER BY ABS(julianday(s.sale_date) - julianday(p.unloading_date)), s.id
+               ) AS closeness
+        FROM pending p
+        JOIN sales_data s
+          ON s.truck_number = p.truck_number
+         AND s.sale_date >= date(p.unloading_date, '-3 day')
+         AND s.sale_date <= date(p.unloading_date, '+3 day')
+    ),
+    same_day_match AS (
+        SELECT id, plant_depot, MIN(sale_id)
+        FROM nearby WHERE same_day AND dealer_match
+        GROUP BY id
+    ),
+    nearby_match AS (
+        SELECT id, plant_depot, MIN(closeness)
+        FROM nearby WHERE dealer_match
+        GROUP BY id
+    ),
+    closest AS (
+        SELECT id, plant_depot FROM nearby WHERE closeness = 1
+    ),
+    historical AS (
+        SELECT truck_number, MIN(plant_depot) AS plant_depot
+        FROM sales_data
+        WHERE truck_number IN (SELECT truck_number FROM pending)
+        GROUP BY truck_number
+        HAVING COUNT(DISTINCT plant_depot) = 1
+    ),
+    resolved AS (
+        SELECT p.id, COALESCE(
+                   sm.plant_depot, nm.plant_depot, c.plant_depot,
+                   CASE WHEN p.dealer_code = '' THEN COALESCE(h.plant_depot, 'PLANT') END
+               ) AS plant_depot
+        FROM pending p
+        LEFT JOIN same_day_match sm ON sm.id = p.id
+        LEFT JOIN nearby_match nm ON nm.id = p.id
+        LEFT JOIN closest c ON c.id = p.id
+        LEFT JOIN historical h ON h.truck_number = p.truck_number
+    )
+    UPDATE vehicle_unloading
+    SET plant_depot = resolved.plant_depot
+    FROM resolved
+    WHERE resolved.id = vehicle_unloading.id
+      AND resolved.plant_depot IS NOT NULL
+'''
+
+def backfill_plant_depot(db_path='webapp_sales_collections.db'):
+    conn = tune(sqlite3.connect(db_path, cached_statements=CACHED_STATEMENTS))
+    cursor = conn.cursor()
+    cursor.executescript(INDEX_SQL)
     
-    null_records = cursor.fetchall()
-    print(f"Found {len(null_records)} unloading records with NULL plant_depot")
+    # Count unloading records with NULL plant_depot
+    cursor.execute(COUNT_PENDING_SQL)
+    total_count = cursor.fetchone()[0]
+    print(f"Found {total_count} unloading records with NULL plant_depot")
     
+    # Resolve the single-depot same-date records first, then run the full ladder
+    # on what is left; records with a dealer_code but no billing within
+    # +/- 3 days are left NULL
     updated_count = 0
-    skipped_count = 0
-    
-    for record_id, truck_number, unloading_date, unloading_dealer_code in null_records:
-        unloading_dealer_code = str(unloading_dealer_code) if unloading_dealer_code else ''
-        
-        # Strategy 1: Check billing on the same date
-        cursor.execute('''
-            SELECT DISTINCT plant_depot, dealer_code
-            FROM sales_data
-            WHERE truck_number = ? AND sale_date = ?
-        ''', (truck_number, unloading_date))
-        
-        same_date_billings = cursor.fetchall()
-        
-        if len(same_date_billings) == 1:
-            # Single billing on same date - use its plant_depot
-            plant_depot = same_date_billings[0][0]
-            cursor.execute('UPDATE vehicle_unloading SET plant_depot = ? WHERE id = ?', 
-                         (plant_depot, record_id))
-            updated_count += 1
-            continue
-        
-        elif len(same_date_billings) > 1:
-            # Multiple billings on same date - match by dealer_code
-            matched = False
-            for billing_plant_depot, billing_dealer_code in same_date_billings:
-                if str(billing_dealer_code) == unloading_dealer_code:
-                    cursor.execute('UPDATE vehicle_unloading SET plant_depot = ? WHERE id = ?', 
-                                 (billing_plant_depot, record_id))
-                    updated_count += 1
-                    matched = True
-                    break
-            
-            if matched:
-                continue
-            
-            # If no dealer_code match, check if all billings are same plant_depot
-            unique_plant_depots = set(b[0] for b in same_date_billings)
-            if len(unique_plant_depots) == 1:
-                plant_depot = list(unique_plant_depots)[0]
-                cursor.execute('UPDATE vehicle_unloading SET plant_depot = ? WHERE id = ?', 
-                             (plant_depot, record_id))
-                updated_count += 1
-                continue
-        
-        # Strategy 2: Check billing within +/- 3 days and match by dealer_code
-        unloading_dt = datetime.strptime(unloading_date, '%Y-%m-%d')
-        date_from = (unloading_dt - timedelta(days=3)).strftime('%Y-%m-%d')
-        date_to = (unloading_dt + timedelta(days=3)).strftime('%Y-%m-%d')
-        
-        cursor.execute('''
-            SELECT plant_depot, dealer_code, sale_date
-            FROM sales_data
-            WHERE truck_number = ? AND sale_date >= ? AND sale_date <= ?
-            ORDER BY ABS(julianday(sale_date) - julianday(?))
-        ''', (truck_number, date_from, date_to, unloading_date))
-        
-        nearby_billings = cursor.fetchall()
-        
-        if unloading_dealer_code:
-            for billing_plant_depot, billing_dealer_code, _ in nearby_billings:
-                if str(billing_dealer_code) == unloading_dealer_code:
-                    cursor.execute('UPDATE vehicle_unloading SET plant_depot = ? WHERE id = ?', 
-                                 (billing_plant_depot, record_id))
-                    updated_count += 1
-                    break
-            else:
-                # No dealer_code match in nearby dates
-                if nearby_billings:
-                    # Use the closest billing's plant_depot
-                    plant_depot = nearby_billings[0][0]
-                    cursor.execute('UPDATE vehicle_unloading SET plant_depot = ? WHERE id = ?', 
-                                 (plant_depot, record_id))
-                    updated_count += 1
-                else:
-                    skipped_count += 1
-        else:
-            # No dealer_code in unloading - use closest billing
-            if nearby_billings:
-                plant_depot = nearby_billings[0][0]
-                cursor.execute('UPDATE vehicle_unloading SET plant_depot = ? WHERE id = ?', 
-                             (plant_depot, record_id))
-                updated_count += 1
-            else:
-                # Strategy 3: Check vehicle's historical billing pattern
-                cursor.execute('''
-                    SELECT DISTINCT plant_depot
-                    FROM sales_data
-                    WHERE truck_number = ?
-                ''', (truck_number,))
-                
-                historical_plant_depots = [row[0] for row in cursor.fetchall()]
-                
-                if len(historical_plant_depots) == 1:
-                    # Vehicle only has one type of billing historically
-                    plant_depot = historical_plant_depots[0]
-                    cursor.execute('UPDATE vehicle_unloading SET plant_depot = ? WHERE id = ?', 
-                                 (plant_depot, record_id))
-                    updated_count += 1
-                else:
-                    # Can't determine - default to PLANT (most common)
-                    cursor.execute('UPDATE vehicle_unloading SET plant_depot = ? WHERE id = ?', 
-                                 ('PLANT', record_id))
-                    updated_count += 1
+    for sql in (SAME_DAY_SQL, BACKFILL_SQL):
+        cursor.execute(sql)
+        cursor.execute(CHANGES_SQL)
+        updated_count += cursor.fetchone()[0]
+    skipped_count = total_count - updated_count
     
     conn.commit()
     conn.close()
@@ -141,7 +136,7 @@ def backfill_plant_depot(db_path='webapp_sales_collections.db'):
     print(f"\nBackfill complete:")
     print(f"  Updated: {updated_count} records")
     print(f"  Skipped: {skipped_count} records")
-    print(f"  Total: {len(null_records)} records")
+    print(f"  Total: {total_count} records")
 
 if __name__ == '__main__':
     backfill_plant_depot()
@@ -9,52 +9,119 @@ import sqlite3
 from datetime import datetime, timedelta
 from collections import defaultdict
 
+from sqlite_tuning import CACHED_STATEMENTS, tune
+
+# Indexes for the per-date billing/unloading lookups
+INDEX_SQL = '''
+    CREATE INDEX IF NOT EXISTS idx_sale_date
+        ON sales_data(sale_date);
+    CREATE INDEX IF NOT EXISTS idx_sales_truck_date
+        ON sales_data(truck_number, sale_date, plant_depot, dealer_code);
+    CREATE INDEX IF NOT EXISTS idx_odb_date_truck
+        ON other_dealers_billing(sale_date, truck_number);
+    CREATE INDEX IF NOT EXISTS idx_vu_date
+        ON vehicle_unloading(unloading_date, truck_number);
+    ANALYZE;
+'''
+
+# Distinct transaction dates on or after the bound start date (once per table)
+TRANSACTION_DATES_SQL = """
+    SELECT txn_date
+    FROM (
+        SELECT sale_date AS txn_date FROM sales_data WHERE sale_date >= ?
+        UNION ALL
+        SELECT sale_date FROM other_dealers_billing WHERE sale_date >= ?
+        UNION ALL
+        SELECT unloading_date FROM vehicle_unloading WHERE unloading_date >= ?
+    )
+    GROUP BY txn_date
+    ORDER BY txn_date
+"""
+
+OPENING_BALANCES_SQL = """
+    SELECT vehicle_number, billing_date, dealer_code, ppc_qty, premium_qty, opc_qty
+    FROM pending_vehicle_unloading
+    WHERE month_year = '2025-11'
+"""
+
+# Per-date, per-vehicle billing and unloading totals
+DELTAS_SQL = """
+    WITH deltas AS (
+        SELECT sale_date AS txn_date, truck_number, dealer_code, 1 AS is_billing,
+               ppc_quantity AS ppc, premium_quantity AS premium, opc_quantity AS opc
+        FROM sales_data WHERE sale_date >= '2025-11-01'
+        UNION ALL
+        SELECT sale_date, truck_number, NULL, 1,
+               ppc_quantity, premium_quantity, opc_quantity
+        FROM other_dealers_billing WHERE sale_date >= '2025-11-01'
+        UNION ALL
+        SELECT unloading_date, truck_number, NULL, 0,
+               ppc_unloaded, premium_unloaded, opc_unloaded
+        FROM vehicle_unloading WHERE unloading_date >= '2025-11-01'
+    )
+    SELECT txn_date, truck_number, MIN(dealer_code),
+           MAX(is_billing), MIN(is_billing) = 0,
+           SUM(CASE WHEN is_billing = 1 THEN ppc END),
+           SUM(CASE WHEN is_billing = 1 THEN premium END),
+           SUM(CASE WHEN is_billing = 1 THEN opc END),
+           SUM(CASE WHEN is_billing = 0 THEN ppc END),
+           SUM(CASE WHEN is_billing = 0 THEN premium END),
+           SUM(CASE WHEN is_billing = 0 THEN opc END)
+    FROM deltas
+    GROUP BY txn_date, truck_number
+"""
+
+INSERT_PENDING_SQL = """
+    INSERT OR REPLACE INTO daily_vehicle_pending 
+    (date, vehicle_number, ppc_qty, premium_qty, opc_qty, dealer_code, last_billing_date, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# Rows per executemany call when saving a day's pending vehicles
+INSERT_BATCH_SIZE = 500
+
+# Rows per fetchmany call when loading the daily deltas
+FETCH_CHUNK_SIZE = 5000
+
 def build_daily_map():
-    conn = sqlite3.connect('webapp_sales_collections.db')
+    conn = tune(sqlite3.connect('webapp_sales_collections.db', cached_statements=CACHED_STATEMENTS))
     cursor = conn.cursor()
+    cursor.executescript(INDEX_SQL)
     
-    # Get all transaction dates from Nov 1, 2025 onwards
-    cursor.execute("""
-        SELECT DISTINCT sale_date as txn_date
-        FROM (
-            SELECT sale_date FROM sales_data WHERE sale_date >= '2025-11-01'
-            UNION
-            SELECT sale_date FROM other_dealers_billing WHERE sale_date >= '2025-11-01'
-            UNION
-            SELECT unloading_date as sale_date FROM vehicle_unloading WHERE unloading_date >= '2025-11-01'
-        )
-        ORDER BY txn_date
-    """)
+    # Get all transaction dates from Nov 1, 2025 onwards. UNION ALL + GROUP BY
+    # lets each branch be an index range scan instead of a sort-distinct UNION
+    cursor.execute(TRANSACTION_DATES_SQL, ('2025-11-01',) * 3)
     
     transaction_dates = [row[0] for row in cursor.fetchall()]
     
-    # Generate all dates from Nov 1, 2025 to today (or latest transaction date + 1 day)
-    start_date = datetime.strptime('2025-11-01', '%Y-%m-%d')
+    # Generate all dates from Nov 1, 2025 to today (or latest transaction date + 1 day).
+    # ISO dates are parsed with fromisoformat and rendered with isoformat(),
+    # avoiding strptime/strftime's format-string interpreter
+    start_date = datetime(2025, 11, 1).date()
     if transaction_dates:
-        last_txn_date = datetime.strptime(transaction_dates[-1], '%Y-%m-%d')
-        end_date = max(datetime.now(), last_txn_date + timedelta(days=1))
+        last_txn_date = datetime.fromisoformat(transaction_dates[-1]).date()
+        end_date = max(datetime.now().date(), last_txn_date + timedelta(days=1))
     else:
-        end_date = datetime.now()
+        end_date = datetime.now().date()
     
     # Generate all dates in range
-    dates = []
-    current = start_date
-    while current <= end_date:
-        dates.append(current.strftime('%Y-%m-%d'))
-        current += timedelta(days=1)
+    dates = [
+        (start_date + timedelta(days=offset)).isoformat()
+        for offset in range((end_date - start_date).days + 1)
+    ]
     
     print(f"Processing {len(dates)} dates from {dates[0]} to {dates[-1]}")
     
     # Initialize Nov 1 opening balances from pending_vehicle_unloading
     # Store in memory first, will be used as "previous day" for Nov 1 processing
     print("Loading Nov 1, 2025 opening balances...")
-    cursor.execute("""
-        SELECT vehicle_number, billing_date, dealer_code, ppc_qty, premium_qty, opc_qty
-        FROM pending_vehicle_unloading
-        WHERE month_year = '2025-11'
-    """)
+    cursor.execute(OPENING_BALANCES_SQL)
     
-    nov1_opening = {}
+    # Balances are kept structure-of-arrays: one flat dict per product plus a
+    # (dealer_code, last_billing_date) tuple per vehicle, all in the same key order.
+    # They are updated in place, so each day starts from the previous day's
+    # closing balances; Nov 1 starts from the pending_vehicle_unloading seed
+    ppc, premium, opc, meta = {}, {}, {}, {}
     for row in cursor.fetchall():
         vehicle_number = row[0]
         billing_date = row[1] or '2025-10-31'
@@ -65,159 +132,75 @@ def build_daily_map():
         
         # Only include if there's a positive balance
         if ppc_qty + premium_qty + opc_qty > 0.01:
-            nov1_opening[vehicle_number] = {
-                'ppc': ppc_qty,
-                'premium': premium_qty,
-                'opc': opc_qty,
-                'dealer_code': dealer_code,
-                'last_billing_date': billing_date
-            }
+            ppc[vehicle_number] = ppc_qty
+            premium[vehicle_number] = premium_qty
+            opc[vehicle_number] = opc_qty
+            meta[vehicle_number] = (dealer_code, billing_date)
+    
+    print(f"Loaded {len(meta)} vehicles with Nov 1 opening balances")
+    
+    # Load every date's billing and unloading per vehicle in one UNION ALL query.
+    # The running balance itself stays in Python: it is clamped at zero and
+    # cleared vehicles drop out day by day, which a windowed SUM can't express.
+    cursor.execute(DELTAS_SQL)
+    
+    # Stream the result in chunks rather than materializing it with fetchall()
+    deltas_by_date = defaultdict(list)
+    for chunk in iter(lambda: cursor.fetchmany(FETCH_CHUNK_SIZE), []):
+        for row in chunk:
+            deltas_by_date[row[0]].append(row[1:])
     
-    print(f"Loaded {len(nov1_opening)} vehicles with Nov 1 opening balances")
+    # Write every date's balances in a single transaction
+    cursor.execute('BEGIN IMMEDIATE')
     
     # Process each date
     for date in dates:
         
-        # Get previous date's balances
-        if date == '2025-11-01':
-            # For Nov 1, use the opening balances loaded from pending_vehicle_unloading
-            prev_balances = nov1_opening
-        else:
-            # For other dates, query from daily_vehicle_pending
-            cursor.execute("""
-                SELECT vehicle_number, ppc_qty, premium_qty, opc_qty, dealer_code, last_billing_date
-                FROM daily_vehicle_pending
-                WHERE date = (
-                    SELECT MAX(date) FROM daily_vehicle_pending WHERE date < ?
-                )
-            """, (date,))
+        # Apply today's billing (sales_data + other_dealers_billing), then unloading
+        for vehicle, dealer_code, has_billing, has_unloading, \
+                billed_ppc, billed_premium, billed_opc, \
+                unloaded_ppc, unloaded_premium, unloaded_opc in deltas_by_date.get(date, ()):
             
-            prev_balances = {}
-            for row in cursor.fetchall():
-                vehicle = row[0]
-                prev_balances[vehicle] = {
-                    'ppc': row[1],
-                    'premium': row[2],
-                    'opc': row[3],
-                    'dealer_code': row[4],
-                    'last_billing_date': row[5]
-                }
-        
-        # Get today's billing (sales_data)
-        cursor.execute("""
-            SELECT truck_number, dealer_code, 
-                   SUM(ppc_quantity), SUM(premium_quantity), SUM(opc_quantity)
-            FROM sales_data
-            WHERE sale_date = ?
-            GROUP BY truck_number, dealer_code
-        """, (date,))
-        
-        billing_today = {}
-        for row in cursor.fetchall():
-            vehicle = row[0]  # Use full vehicle number from sales_data directly
-            
-            if vehicle not in billing_today:
-                billing_today[vehicle] = {'ppc': 0, 'premium': 0, 'opc': 0, 'dealer_code': row[1]}
+            if has_billing:
+                if vehicle in meta:
+                    if not dealer_code:
+                        dealer_code = meta[vehicle][0]
+                else:
+                    ppc[vehicle] = premium[vehicle] = opc[vehicle] = 0
+                
+                ppc[vehicle] += billed_ppc or 0
+                premium[vehicle] += billed_premium or 0
+                opc[vehicle] += billed_opc or 0
+                meta[vehicle] = (dealer_code, date)
             
-            billing_today[vehicle]['ppc'] += row[2] or 0
-            billing_today[vehicle]['premium'] += row[3] or 0
-            billing_today[vehicle]['opc'] += row[4] or 0
-        
-        # Get today's billing (other_dealers_billing)
-        cursor.execute("""
-            SELECT truck_number, 
-                   SUM(ppc_quantity), SUM(premium_quantity), SUM(opc_quantity)
-            FROM other_dealers_billing
-            WHERE sale_date = ?
-            GROUP BY truck_number
-        """, (date,))
-        
-        for row in cursor.fetchall():
-            vehicle = row[0]  # Use full vehicle number directly
+            if vehicle not in meta:
+                continue
             
-            if vehicle not in billing_today:
-                billing_today[vehicle] = {'ppc': 0, 'premium': 0, 'opc': 0, 'dealer_code': None}
+            # Subtract today's unloading, never going below zero
+            if has_unloading:
+                ppc[vehicle] = max(0, ppc[vehicle] - (unloaded_ppc or 0))
+                premium[vehicle] = max(0, premium[vehicle] - (unloaded_premium or 0))
+                opc[vehicle] = max(0, opc[vehicle] - (unloaded_opc or 0))
             
-            billing_today[vehicle]['ppc'] += row[1] or 0
-            billing_today[vehicle]['premium'] += row[2] or 0
-            billing_today[vehicle]['opc'] += row[3] or 0
-        
-        # Get today's unloading
-        cursor.execute("""
-            SELECT truck_number, 
-                   SUM(ppc_unloaded), SUM(premium_unloaded), SUM(opc_unloaded)
-            FROM vehicle_unloading
-            WHERE unloading_date = ?
-            GROUP BY truck_number
-        """, (date,))
-        
-        unloading_today = {}
-        for row in cursor.fetchall():
-            vehicle = row[0]  # Use full vehicle number directly
-            
-            unloading_today[vehicle] = {
-                'ppc': row[1] or 0,
-                'premium': row[2] or 0,
-                'opc': row[3] or 0
-            }
-        
-        # Calculate new balances for today
-        new_balances = {}
-        
-        # Start with all vehicles from previous day
-        for vehicle, prev in prev_balances.items():
-            new_balances[vehicle] = {
-                'ppc': prev['ppc'],
-                'premium': prev['premium'],
-                'opc': prev['opc'],
-                'dealer_code': prev['dealer_code'],
-                'last_billing_date': prev['last_billing_date']
-            }
-        
-        # Add today's billing
-        for vehicle, billing in billing_today.items():
-            if vehicle not in new_balances:
-                new_balances[vehicle] = {
-                    'ppc': 0,
-                    'premium': 0,
-                    'opc': 0,
-                    'dealer_code': billing.get('dealer_code'),
-                    'last_billing_date': date
-                }
-            
-            new_balances[vehicle]['ppc'] += billing['ppc']
-            new_balances[vehicle]['premium'] += billing['premium']
-            new_balances[vehicle]['opc'] += billing['opc']
-            new_balances[vehicle]['last_billing_date'] = date
-            if billing.get('dealer_code'):
-                new_balances[vehicle]['dealer_code'] = billing['dealer_code']
-        
-        # Subtract today's unloading
-        for vehicle, unloading in unloading_today.items():
-            if vehicle in new_balances:
-                new_balances[vehicle]['ppc'] -= unloading['ppc']
-                new_balances[vehicle]['premium'] -= unloading['premium']
-                new_balances[vehicle]['opc'] -= unloading['opc']
-                
-                # Ensure non-negative
-                new_balances[vehicle]['ppc'] = max(0, new_balances[vehicle]['ppc'])
-                new_balances[vehicle]['premium'] = max(0, new_balances[vehicle]['premium'])
-                new_balances[vehicle]['opc'] = max(0, new_balances[vehicle]['opc'])
+            # Only vehicles with pending > 0 are saved; they become tomorrow's opening
+            # balances. Vehicles without a delta today keep yesterday's positive total,
+            # so only the ones touched here need the check
+            if ppc[vehicle] + premium[vehicle] + opc[vehicle] <= 0.01:
+                del ppc[vehicle], premium[vehicle], opc[vehicle], meta[vehicle]
         
-        # Save today's balances (only vehicles with pending > 0)
-        for vehicle, balance in new_balances.items():
-            total = balance['ppc'] + balance['premium'] + balance['opc']
-            if total > 0.01:
-                cursor.execute("""
-                    INSERT OR REPLACE INTO daily_vehicle_pending 
-                    (date, vehicle_number, ppc_qty, premium_qty, opc_qty, dealer_code, last_billing_date, updated_at)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-                """, (date, vehicle, balance['ppc'], balance['premium'], balance['opc'], 
-                      balance['dealer_code'], balance['last_billing_date']))
+        # Save today's balances in batches with one prepared INSERT; updated_at is
+        # bound once per day in CURRENT_TIMESTAMP's format instead of per row
+        updated_at = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        rows = [
+            (date, vehicle, ppc[vehicle], premium[vehicle], opc[vehicle], *meta[vehicle], updated_at)
+            for vehicle in meta
+        ]
+        for i in range(0, len(rows), INSERT_BATCH_SIZE):
+            cursor.executemany(INSERT_PENDING_SQL, rows[i:i + INSERT_BATCH_SIZE])
         
-        conn.commit()
-        print(f"Processed {date}: {len([v for v in new_balances.values() if v['ppc'] + v['premium'] + v['opc'] > 0.01])} vehicles pending")
+        print(f"Processed {date}: {len(meta)} vehicles pending")
     
+    conn.commit()
     conn.close()
     print("Daily vehicle map built successfully!")
 
@@ -6,19 +6,53 @@ Clear all data from the sales database
 import sqlite3
 import sys
 
-def clear_database(db_path):
-    """Clear all data from the database"""
+from sqlite_tuning import CACHED_STATEMENTS, tune
+
+EXISTING_TABLES_SQL = "SELECT name FROM sqlite_master WHERE type='table'"
+
+# A table's stored DDL, the CREATE TABLE first and then its indexes/triggers
+TABLE_DDL_SQL = """
+    SELECT sql FROM sqlite_master
+    WHERE tbl_name = ? AND sql IS NOT NULL
+    ORDER BY type = 'table' DESC
+"""
+
+def count_records(cursor, tables):
+    """Return [(table, count)] for the existing tables in one UNION ALL query"""
+    cursor.execute(EXISTING_TABLES_SQL)
+    existing = {row[0] for row in cursor.fetchall()}
+    tables = [table for table in tables if table in existing]
+    if not tables:
+        return []
+    
+    cursor.execute(" UNION ALL ".join(
+        f"SELECT {i}, '{table}', COUNT(*) FROM {table}" for i, table in enumerate(tables)
+    ) + " ORDER BY 1")
+    return [(table, count) for _, table, count in cursor.fetchall()]
+
+def clear_database(db_path, recreate=False):
+    """Clear all data from the database
+    
+    With recreate=True each table is dropped and rebuilt from its stored
+    schema (table, indexes and triggers) instead of deleting its rows.
+    """
     print(f"Clearing database: {db_path}")
     
     try:
-        conn = sqlite3.connect(db_path)
+        conn = tune(sqlite3.connect(db_path, cached_statements=CACHED_STATEMENTS))
         cursor = conn.cursor()
         
+        # Let unconditional DELETEs use SQLite's truncate optimization and skip
+        # zero-filling freed pages
+        cursor.execute("PRAGMA foreign_keys=OFF")
+        cursor.execute("PRAGMA secure_delete=OFF")
+        
         # List of all tables to clear
         tables_to_clear = [
             'sales_data',
             'collections_data', 
             'opening_balances',
+            'monthly_dealer_balances',
             'dealers',
             'credit_discounts',
             'vehicle_tracking',
@@ -31,16 +65,10 @@ def clear_database(db_path):
         # Check current record counts
         print("Current records:")
         total_records = 0
-        for table in tables_to_clear:
-            try:
-                cursor.execute(f"SELECT COUNT(*) FROM {table}")
-                count = cursor.fetchone()[0]
-                if count > 0:
-                    print(f"  {table}: {count}")
-                    total_records += count
-            except sqlite3.OperationalError:
-                # Table doesn't exist, skip it
-                pass
+        for table, count in count_records(cursor, tables_to_clear):
+            if count > 0:
+                print(f"  {table}: {count}")
+                total_records += count
         
         if total_records == 0:
             print("  Database is already empty")
@@ -48,11 +76,23 @@ def clear_database(db_path):
         
         print(f"  Total records: {total_records}")
         
-        # Clear all data from all tables
+        # Clear all data from all tables in a single transaction
         print("\nClearing tables...")
+        cursor.execute("BEGIN IMMEDIATE")
         for table in tables_to_clear:
             try:
-                cursor.execute(f"DELETE FROM {table}")
+                if recreate:
+                    # Cache the table's DDL and replay it after the drop
+                    cursor.execute(TABLE_DDL_SQL, (table,))
+                    ddl = [row[0] for row in cursor.fetchall()]
+                    if not ddl:
+                        # Table doesn't exist, skip it
+                        continue
+                    cursor.execute(f"DROP TABLE {table}")
+                    for statement in ddl:
+                        cursor.execute(statement)
+                else:
+                    cursor.execute(f"DELETE FROM {table}")
                 print(f"  ✓ Cleared {table}")
             except sqlite3.OperationalError:
                 # Table doesn't exist, skip it
@@ -72,16 +112,10 @@ def clear_database(db_path):
         # Verify clearing
         print("\nAfter clearing:")
         total_after = 0
-        for table in tables_to_clear:
-            try:
-                cursor.execute(f"SELECT COUNT(*) FROM {table}")
-                count = cursor.fetchone()[0]
-                if count > 0:
-                    print(f"  {table}: {count}")
-                    total_after += count
-            except sqlite3.OperationalError:
-                # Table doesn't exist, skip it
-                pass
+        for table, count in count_records(cursor, tables_to_clear):
+            if count > 0:
+                print(f"  {table}: {count}")
+                total_after += count
         
         if total_after == 0:
             print("✅ All database tables cleared successfully!")
@@ -98,4 +132,4 @@ if __name__ == "__main__":
     # Use relative path based on script location
     BASE_DIR = os.path.dirname(os.path.abspath(__file__))
     db_path = os.path.join(BASE_DIR, "webapp_sales_collections.db")
-    clear_database(db_path)
+    clear_database(db_path, recreate='--recreate' in sys.argv)
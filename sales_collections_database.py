@@ -5,16 +5,190 @@ Handles both sales data and payment collection data with date-wise and dealer-wi
 """
 
 import sqlite3
+from contextlib import contextmanager
 import pandas as pd
 import numpy as np
 from datetime import datetime, date
 import os
+import sys
+
+# Console display options for display_data, set once at import
+pd.set_option('display.max_columns', None)
+pd.set_option('display.width', None)
+pd.set_option('display.max_colwidth', 25)
+
+# WAL journal with relaxed fsync, in-memory temp tables, 64MB page cache and
+# 256MB of memory-mapped I/O, applied once per connection
+CONNECTION_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-65536',
+    'PRAGMA mmap_size=268435456',
+    'PRAGMA foreign_keys=ON',
+)
 
 class SalesCollectionsDatabase:
+    # Statement texts live on the class so every call hands sqlite3 the same
+    # string and its statement cache reuses the prepared plan
+    INSERT_COLLECTION_SQL = '''
+        INSERT OR IGNORE INTO collections_data 
+        (posting_date, dealer_code, dealer_name, amount, district_name, collection_type, payment_reference)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    '''
+    
+    # Secondary collections_data indexes rebuilt around large loads (the unique
+    # duplicate-key index is kept, INSERT OR IGNORE depends on it)
+    COLLECTIONS_INDEX_SQL = {
+        'idx_posting_date': 'CREATE INDEX IF NOT EXISTS idx_posting_date ON collections_data(posting_date)',
+        'idx_collections_dealer': 'CREATE INDEX IF NOT EXISTS idx_collections_dealer ON collections_data(dealer_code)',
+        'idx_coll_date_dealer_amt': '''
+            CREATE INDEX IF NOT EXISTS idx_coll_date_dealer_amt ON collections_data(
+                posting_date, dealer_code, dealer_name, district_name, collection_type, amount
+            )
+        ''',
+        'idx_collections_month': 'CREATE INDEX IF NOT EXISTS idx_collections_month ON collections_data(posting_month)',
+    }
+    
+    # Database files whose collections hold duplicates, so idx_collections_unique
+    # could not be built; later connections in the process don't rescan for it
+    _collections_unique_failed = set()
+    
+    # Indexes on tables the app reads but doesn't create (made by the unloading
+    # and statement tools), added when the table exists
+    OPTIONAL_TABLE_INDEX_SQL = {
+        'vehicle_unloading': [
+            'CREATE INDEX IF NOT EXISTS idx_unloading_date_dealer ON vehicle_unloading(unloading_date, dealer_code)',
+            # Per-dealer date ranges, by code for regular dealers and by name for "Other"
+            # ones, covering the quantities the material balance sums read
+            '''
+            CREATE INDEX IF NOT EXISTS idx_unloading_code_date_qty ON vehicle_unloading(
+                dealer_code, unloading_date, ppc_unloaded, premium_unloaded, opc_unloaded, unloaded_quantity
+            )
+            ''',
+            '''
+            CREATE INDEX IF NOT EXISTS idx_unloading_name_date_qty ON vehicle_unloading(
+                unloading_dealer, unloading_date, ppc_unloaded, premium_unloaded, opc_unloaded, unloaded_quantity
+            )
+            ''',
+        ],
+        'other_dealers_billing': [
+            'CREATE INDEX IF NOT EXISTS idx_other_billing_name_date ON other_dealers_billing(dealer_name, sale_date)',
+        ],
+        'credit_discounts': [
+            'CREATE INDEX IF NOT EXISTS idx_credits_month ON credit_discounts(month_year, dealer_code)',
+        ],
+        'debit_notes': [
+            'CREATE INDEX IF NOT EXISTS idx_debits_month ON debit_notes(month_year, dealer_code)',
+        ],
+    }
+    
+    # YYYY-MM columns generated from the date columns, so month filters can seek
+    # an index instead of running strftime() over every row. VIRTUAL because
+    # ALTER TABLE can't add STORED generated columns to existing tables.
+    MONTH_COLUMNS = {
+        # table: (month column, date column)
+        'sales_data': ('sale_month', 'sale_date'),
+        'collections_data': ('posting_month', 'posting_date'),
+    }
+    
+    # Batches at least this large drop the secondary indexes and rebuild them
+    # once afterwards instead of updating every B-tree per row
+    INDEX_REBUILD_MIN_ROWS = 1000
+    
+    COLLECTION_KEYS_SQL = '''
+        SELECT posting_date, dealer_code, amount, payment_reference FROM collections_data
+    '''
+    
+    COLLECTIONS_BY_DATE_SQL = '''
+        SELECT dealer_code, dealer_name, SUM(amount) as total_amount,
+               COUNT(*) as transaction_count, district_name, collection_type
+        FROM collections_data 
+        WHERE posting_date = ?
+        GROUP BY dealer_code, dealer_name, district_name, collection_type
+        ORDER BY total_amount DESC
+    '''
+    
+    DEALER_SUMMARY_SQL = '''
+        SELECT dealer_code, dealer_name, 
+               SUM(amount) as total_collections,
+               COUNT(*) as total_transactions,
+               MIN(posting_date) as first_collection,
+               MAX(posting_date) as last_collection,
+               COUNT(DISTINCT posting_date) as collection_days
+        FROM collections_data 
+        GROUP BY dealer_code, dealer_name
+        ORDER BY total_collections DESC
+    '''
+    
+    STATS_COLUMNS_SQL = '''
+            COUNT(DISTINCT dealer_code) as unique_dealers,
+            COUNT(*) as total_transactions,
+            SUM(amount) as total_amount,
+            AVG(amount) as avg_amount,
+            MIN(amount) as min_amount,
+            MAX(amount) as max_amount
+    '''
+    STATS_ALL_SQL = f"SELECT {STATS_COLUMNS_SQL} FROM collections_data"
+    STATS_BY_DATE_SQL = f"SELECT {STATS_COLUMNS_SQL} FROM collections_data WHERE posting_date = ?"
+    STATS_PER_DATE_SQL = f"""
+        SELECT posting_date, {STATS_COLUMNS_SQL}
+        FROM collections_data
+        GROUP BY posting_date
+        ORDER BY posting_date
+    """
+    
+    COLLECTION_DATES_SQL = "SELECT DISTINCT posting_date FROM collections_data ORDER BY posting_date"
+    
+    # FULL OUTER JOIN emulated as a LEFT JOIN plus the collections-only dealers,
+    # with each side aggregated once in a CTE
+    SALES_VS_COLLECTIONS_SQL = '''
+        WITH sales_agg AS (
+            SELECT dealer_code, dealer_name, 
+                   SUM(total_quantity) as total_sales,
+                   COUNT(DISTINCT sale_date) as transaction_days
+            FROM sales_data 
+            GROUP BY dealer_code, dealer_name
+        ),
+        coll_agg AS (
+            SELECT dealer_code, dealer_name, 
+                   SUM(amount) as total_collections,
+                   COUNT(DISTINCT posting_date) as collection_days
+            FROM collections_data 
+            GROUP BY dealer_code, dealer_name
+        )
+        SELECT 
+            s.dealer_code,
+            s.dealer_name,
+            COALESCE(s.total_sales, 0) as total_sales,
+            COALESCE(c.total_collections, 0) as total_collections,
+            COALESCE(s.total_sales, 0) - COALESCE(c.total_collections, 0) as outstanding_balance,
+            s.transaction_days as sales_days,
+            COALESCE(c.collection_days, 0) as collection_days
+        FROM sales_agg s
+        LEFT JOIN coll_agg c ON s.dealer_code = c.dealer_code
+        UNION ALL
+        SELECT 
+            c.dealer_code,
+            c.dealer_name,
+            0 as total_sales,
+            c.total_collections,
+            0 - c.total_collections as outstanding_balance,
+            0 as sales_days,
+            c.collection_days
+        FROM coll_agg c
+        LEFT JOIN sales_agg s ON s.dealer_code = c.dealer_code
+        WHERE s.dealer_code IS NULL
+        ORDER BY total_sales DESC
+    '''
+    
     def __init__(self, db_path="sales_collections_data.db"):
         """Initialize database connection and create tables"""
         self.db_path = db_path
-        self.conn = sqlite3.connect(db_path)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        for pragma in CONNECTION_PRAGMAS:
+            self.conn.execute(pragma)
+        self._in_bulk_load = False
         self.create_tables()
     
     def create_tables(self):
@@ -48,10 +222,45 @@ class SalesCollectionsDatabase:
                 district_name TEXT,
                 collection_type TEXT,
                 payment_reference TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(posting_date, dealer_code, amount, payment_reference)
             )
         ''')
         
+        # Same duplicate key for databases created before the UNIQUE constraint;
+        # skipped if they already hold duplicate collections. Building it scans
+        # the whole table, so it is only attempted when no unique key exists yet
+        # and no earlier connection to this file has already failed
+        self.has_collections_unique_key = self.has_unique_index(
+            'collections_data', ['posting_date', 'dealer_code', 'amount', 'payment_reference'])
+        if not self.has_collections_unique_key and self.db_path not in self._collections_unique_failed:
+            try:
+                cursor.execute('''
+                    CREATE UNIQUE INDEX IF NOT EXISTS idx_collections_unique
+                    ON collections_data(posting_date, dealer_code, amount, payment_reference)
+                ''')
+                self.has_collections_unique_key = True
+            except sqlite3.IntegrityError:
+                print("Warning: duplicate collections found, unique collections index not created")
+                self._collections_unique_failed.add(self.db_path)
+        
+        # Unique invoice key for sales, so uploads can leave stored invoices to
+        # ON CONFLICT DO NOTHING; the table's own UNIQUE(invoice_number) is reused
+        # when it has one. Skipped for databases without invoice numbers or with
+        # duplicate invoices already stored.
+        cursor.execute("PRAGMA table_info(sales_data)")
+        has_invoice_numbers = 'invoice_number' in [row[1] for row in cursor.fetchall()]
+        self.has_sales_invoice_key = self.has_unique_index('sales_data', ['invoice_number'])
+        if has_invoice_numbers and not self.has_sales_invoice_key:
+            try:
+                cursor.execute('''
+                    CREATE UNIQUE INDEX IF NOT EXISTS idx_sales_invoice_unique
+                    ON sales_data(invoice_number)
+                ''')
+                self.has_sales_invoice_key = True
+            except sqlite3.IntegrityError:
+                print("Warning: duplicate sales invoices found, unique sales invoice index not created")
+        
         # Create opening balances table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS opening_balances (
@@ -66,16 +275,41 @@ class SalesCollectionsDatabase:
             )
         ''')
         
-        # Create indexes for faster queries
+        # Month-end balances per dealer, filled in by the web app as months are
+        # calculated and emptied whenever sales, collections or balances change
         cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_sale_date ON sales_data(sale_date)
+            CREATE TABLE IF NOT EXISTS monthly_dealer_balances (
+                month_year TEXT NOT NULL,
+                dealer_code INTEGER NOT NULL,
+                dealer_name TEXT NOT NULL,
+                opening REAL NOT NULL DEFAULT 0,
+                sales REAL NOT NULL DEFAULT 0,
+                collections REAL NOT NULL DEFAULT 0,
+                credits REAL NOT NULL DEFAULT 0,
+                debits REAL NOT NULL DEFAULT 0,
+                closing REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (month_year, dealer_code)
+            )
         ''')
+        
+        # Add the generated month columns to databases created without them
+        for table, (month_column, date_column) in self.MONTH_COLUMNS.items():
+            cursor.execute(f"PRAGMA table_xinfo({table})")
+            if month_column not in [row[1] for row in cursor.fetchall()]:
+                cursor.execute(f'''
+                    ALTER TABLE {table} ADD COLUMN {month_column} TEXT
+                    GENERATED ALWAYS AS (substr({date_column}, 1, 7)) VIRTUAL
+                ''')
+        
+        # Create indexes for faster queries
         cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_posting_date ON collections_data(posting_date)
+            CREATE INDEX IF NOT EXISTS idx_sale_date ON sales_data(sale_date)
         ''')
         cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_collections_dealer ON collections_data(dealer_code)
+            CREATE INDEX IF NOT EXISTS idx_sales_month ON sales_data(sale_month)
         ''')
+        for index_sql in self.COLLECTIONS_INDEX_SQL.values():
+            cursor.execute(index_sql)
         cursor.execute('''
             CREATE INDEX IF NOT EXISTS idx_opening_balance_dealer ON opening_balances(dealer_code)
         ''')
@@ -83,126 +317,200 @@ class SalesCollectionsDatabase:
             CREATE INDEX IF NOT EXISTS idx_opening_balance_month ON opening_balances(month_year)
         ''')
         
+        # Covering index so the per-dealer sales aggregate is answered from the
+        # index without touching the rows (idx_coll_date_dealer_amt does the same
+        # for the per-date collections GROUP BY)
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_sales_dealer ON sales_data(
+                dealer_code, dealer_name, sale_date, total_quantity
+            )
+        ''')
+        
+        # Per-dealer lookups for one date or date range (dealer_code = ? AND sale_date ...),
+        # covering the quantities so the material balance sums are read from the index
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_sales_dealer_date_qty ON sales_data(
+                dealer_code, sale_date, ppc_quantity, premium_quantity, opc_quantity, total_quantity
+            )
+        ''')
+        
+        # The same by name, for lookups of dealers without a code
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_sales_dealer_name_date ON sales_data(dealer_name, sale_date)
+        ''')
+        
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+        existing_tables = {row[0] for row in cursor.fetchall()}
+        for table, index_sqls in self.OPTIONAL_TABLE_INDEX_SQL.items():
+            if table in existing_tables:
+                for index_sql in index_sqls:
+                    cursor.execute(index_sql)
+        
+        # Narrower indexes replaced by the covering ones above
+        for index_name in ('idx_sales_dealer_date', 'idx_unloading_dealer_code_date', 'idx_unloading_dealer_name_date'):
+            cursor.execute(f"DROP INDEX IF EXISTS {index_name}")
+        
+        # Credit and debit notes live in optional tables the app doesn't create
+        self.has_credit_discounts = 'credit_discounts' in existing_tables
+        self.has_debit_notes = 'debit_notes' in existing_tables
+        
         self.conn.commit()
         print(f"Database initialized with sales, collections, and opening balance tables: {self.db_path}")
     
+    def has_unique_index(self, table, columns):
+        """Check whether table has a unique index on exactly these columns"""
+        cursor = self.conn.cursor()
+        cursor.execute(f"PRAGMA index_list({table})")
+        for index in cursor.fetchall():
+            index_name, is_unique = index[1], index[2]
+            if is_unique:
+                cursor.execute(f"PRAGMA index_info('{index_name}')")
+                if [row[2] for row in cursor.fetchall()] == columns:
+                    return True
+        return False
+    
+    def clear_monthly_dealer_balances(self):
+        """Forget the stored month-end balances; the caller commits"""
+        self.conn.execute("DELETE FROM monthly_dealer_balances")
+    
+    @contextmanager
+    def bulk_load(self):
+        """Run a batch of ingestion writes as one BEGIN IMMEDIATE ... COMMIT
+        
+        Nested bulk_load() blocks join the outer transaction. After the outermost
+        commit the planner statistics are refreshed and the WAL is checkpointed.
+        The caller must not have a transaction of its own open: its pending
+        writes would be committed outside the batch, where a failure in the
+        batch could no longer roll them back.
+        """
+        if self._in_bulk_load:
+            yield
+            return
+        
+        if self.conn.in_transaction:
+            raise RuntimeError("bulk_load() started with uncommitted writes pending; commit or roll them back first")
+        self.conn.execute("BEGIN IMMEDIATE")
+        self._in_bulk_load = True
+        try:
+            yield
+        except BaseException:
+            self.conn.rollback()
+            raise
+        else:
+            self.conn.commit()
+            self.conn.execute("ANALYZE")
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        finally:
+            self._in_bulk_load = False
+    
     def insert_collections_data(self, df):
-        """Insert collections data from DataFrame into database"""
+        """Insert new collections data from DataFrame into database
+        
+        Rows already stored (same posting date, dealer, amount and payment
+        reference) are skipped, so re-loading an overlapping file only adds new rows.
+        """
         cursor = self.conn.cursor()
         
-        # Clear existing collections data (optional - remove if you want to append)
-        cursor.execute("DELETE FROM collections_data")
+        # Skip rows with missing customer codes
+        df = df.dropna(subset=['Customer'])
         
-        inserted_count = 0
+        # Blank payment references are stored as '' (like the web upload) so they
+        # take part in the duplicate check instead of comparing as distinct NULLs
+        if 'Payment Reference' in df:
+            payment_references = df['Payment Reference'].fillna('').astype(str).str.strip().tolist()
+        else:
+            payment_references = [''] * len(df)
         
-        # Insert new data
-        for _, row in df.iterrows():
-            # Skip rows with missing customer codes
-            if pd.isna(row['Customer']):
-                continue
-                
-            cursor.execute('''
-                INSERT INTO collections_data 
-                (posting_date, dealer_code, dealer_name, amount, district_name, collection_type)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (
-                row['Posting Date'].strftime('%Y-%m-%d'),
-                int(row['Customer']),
-                row['Name of Customer'],
-                row['Amount'],
-                row['District name'],
-                row['Collection Type']
-            ))
-            inserted_count += 1
+        # Build the rows column by column instead of one Series per row
+        rows = list(zip(
+            pd.to_datetime(df['Posting Date']).dt.strftime('%Y-%m-%d').tolist(),
+            df['Customer'].astype(int).tolist(),
+            df['Name of Customer'].tolist(),
+            df['Amount'].tolist(),
+            df['District name'].tolist(),
+            df['Collection Type'].tolist(),
+            payment_references
+        ))
+        
+        if not self.has_collections_unique_key:
+            # No unique index for INSERT OR IGNORE to lean on: drop stored and
+            # repeated keys in Python instead
+            cursor.execute(self.COLLECTION_KEYS_SQL)
+            known_keys = set(cursor.fetchall())
+            new_rows = []
+            for row in rows:
+                key = (row[0], row[1], row[3], row[6])
+                if key not in known_keys:
+                    known_keys.add(key)
+                    new_rows.append(row)
+        else:
+            new_rows = rows
+        
+        # Insert new data in a single batch, counting only the inserted rows
+        # (not the stored month balances cleared alongside them)
+        with self.bulk_load():
+            rebuild_indexes = len(new_rows) >= self.INDEX_REBUILD_MIN_ROWS
+            if rebuild_indexes:
+                for index_name in self.COLLECTIONS_INDEX_SQL:
+                    cursor.execute(f"DROP INDEX IF EXISTS {index_name}")
+            
+            changes_before = self.conn.total_changes
+            cursor.executemany(self.INSERT_COLLECTION_SQL, new_rows)
+            inserted_count = self.conn.total_changes - changes_before
+            self.clear_monthly_dealer_balances()
+            
+            if rebuild_indexes:
+                for index_sql in self.COLLECTIONS_INDEX_SQL.values():
+                    cursor.execute(index_sql)
         
-        self.conn.commit()
         print(f"Inserted {inserted_count} collection records into database")
+        if inserted_count < len(rows):
+            print(f"Skipped {len(rows) - inserted_count} collection records already in database")
         return inserted_count
     
-    def get_collections_by_date(self, target_date):
-        """Get collections for a specific date"""
-        cursor = self.conn.cursor()
-        
-        cursor.execute('''
-            SELECT dealer_code, dealer_name, SUM(amount) as total_amount,
-                   COUNT(*) as transaction_count, district_name, collection_type
-            FROM collections_data 
-            WHERE posting_date = ?
-            GROUP BY dealer_code, dealer_name, district_name, collection_type
-            ORDER BY total_amount DESC
-        ''', (target_date,))
-        
-        results = cursor.fetchall()
+    @staticmethod
+    def _top_k(sql, limit, params=()):
+        """Append a bound LIMIT to an ORDER BY query when a limit is given, so
+        SQLite keeps only the top rows while sorting"""
+        if limit is None:
+            return sql, params
+        return sql + ' LIMIT ?', params + (limit,)
+    
+    def get_collections_by_date(self, target_date, limit=None):
+        """Get collections for a specific date (top `limit` rows by amount if given)"""
+        sql, params = self._top_k(self.COLLECTIONS_BY_DATE_SQL, limit, (target_date,))
+        df = pd.read_sql_query(sql, self.conn, params=params)
         
-        if results:
-            df = pd.DataFrame(results, columns=[
+        if not df.empty:
+            df.columns = [
                 'Dealer_Code', 'Dealer_Name', 'Collection_Amount', 
                 'Transaction_Count', 'District', 'Collection_Type'
-            ])
-            # Add serial number
-            df.insert(0, 'Serial_No', range(1, len(df) + 1))
+            ]
+            # Serial number as a RangeIndex (start/stop only, no extra column)
+            df.index = pd.RangeIndex(1, len(df) + 1, name='Serial_No')
             return df
         else:
             return pd.DataFrame()
     
-    def get_collections_summary_by_dealer(self):
-        """Get consolidated collections summary by dealer"""
-        cursor = self.conn.cursor()
+    def get_collections_summary_by_dealer(self, limit=None):
+        """Get consolidated collections summary by dealer (top `limit` dealers if given)"""
+        sql, params = self._top_k(self.DEALER_SUMMARY_SQL, limit)
+        df = pd.read_sql_query(sql, self.conn, params=params)
         
-        cursor.execute('''
-            SELECT dealer_code, dealer_name, 
-                   SUM(amount) as total_collections,
-                   COUNT(*) as total_transactions,
-                   MIN(posting_date) as first_collection,
-                   MAX(posting_date) as last_collection,
-                   COUNT(DISTINCT posting_date) as collection_days
-            FROM collections_data 
-            GROUP BY dealer_code, dealer_name
-            ORDER BY total_collections DESC
-        ''')
-        
-        results = cursor.fetchall()
-        
-        if results:
-            df = pd.DataFrame(results, columns=[
+        if not df.empty:
+            df.columns = [
                 'Dealer_Code', 'Dealer_Name', 'Total_Collections', 
                 'Total_Transactions', 'First_Collection', 'Last_Collection', 'Collection_Days'
-            ])
-            # Add serial number
-            df.insert(0, 'Serial_No', range(1, len(df) + 1))
+            ]
+            # Serial number as a RangeIndex (start/stop only, no extra column)
+            df.index = pd.RangeIndex(1, len(df) + 1, name='Serial_No')
             return df
         else:
             return pd.DataFrame()
     
-    def get_collections_stats(self, target_date=None):
-        """Get collections statistics for a specific date or all data"""
-        cursor = self.conn.cursor()
-        
-        if target_date:
-            cursor.execute('''
-                SELECT 
-                    COUNT(DISTINCT dealer_code) as unique_dealers,
-                    COUNT(*) as total_transactions,
-                    SUM(amount) as total_amount,
-                    AVG(amount) as avg_amount,
-                    MIN(amount) as min_amount,
-                    MAX(amount) as max_amount
-                FROM collections_data 
-                WHERE posting_date = ?
-            ''', (target_date,))
-        else:
-            cursor.execute('''
-                SELECT 
-                    COUNT(DISTINCT dealer_code) as unique_dealers,
-                    COUNT(*) as total_transactions,
-                    SUM(amount) as total_amount,
-                    AVG(amount) as avg_amount,
-                    MIN(amount) as min_amount,
-                    MAX(amount) as max_amount
-                FROM collections_data
-            ''')
-        
-        result = cursor.fetchone()
+    @staticmethod
+    def _stats_from_row(result):
+        """Build the stats dict from the six aggregate columns"""
         return {
             'unique_dealers': result[0] or 0,
             'total_transactions': result[1] or 0,
@@ -212,51 +520,55 @@ class SalesCollectionsDatabase:
             'max_amount': result[5] or 0
         }
     
+    def get_collections_stats(self, target_date=None):
+        """Get collections statistics for a specific date or all data"""
+        cursor = self.conn.cursor()
+        
+        if target_date:
+            cursor.execute(self.STATS_BY_DATE_SQL, (target_date,))
+        else:
+            cursor.execute(self.STATS_ALL_SQL)
+        
+        return self._stats_from_row(cursor.fetchone())
+    
+    def get_collections_stats_all_dates(self):
+        """Get collections statistics for every posting date in one grouped scan
+        
+        Returns a dict of posting_date -> stats dict (same keys as get_collections_stats)
+        """
+        cursor = self.conn.cursor()
+        cursor.execute(self.STATS_PER_DATE_SQL)
+        return {row[0]: self._stats_from_row(row[1:]) for row in cursor.fetchall()}
+    
+    def get_daily_stats(self):
+        """Get collections statistics for every posting date as a DataFrame, one
+        row per date of get_collections_stats_all_dates()"""
+        stats = self.get_collections_stats_all_dates()
+        return pd.DataFrame(
+            [(posting_date, *date_stats.values()) for posting_date, date_stats in stats.items()],
+            columns=['Posting_Date', 'Unique_Dealers', 'Total_Transactions', 'Total_Amount',
+                     'Avg_Amount', 'Min_Amount', 'Max_Amount']
+        )
+    
     def get_available_collection_dates(self):
         """Get all available collection dates in the database"""
         cursor = self.conn.cursor()
-        cursor.execute("SELECT DISTINCT posting_date FROM collections_data ORDER BY posting_date")
+        cursor.execute(self.COLLECTION_DATES_SQL)
         dates = [row[0] for row in cursor.fetchall()]
         return dates
     
-    def get_sales_vs_collections_summary(self):
-        """Get combined sales vs collections summary by dealer"""
-        cursor = self.conn.cursor()
+    def get_sales_vs_collections_summary(self, limit=None):
+        """Get combined sales vs collections summary by dealer (top `limit` dealers if given)"""
+        sql, params = self._top_k(self.SALES_VS_COLLECTIONS_SQL, limit)
+        df = pd.read_sql_query(sql, self.conn, params=params)
         
-        cursor.execute('''
-            SELECT 
-                COALESCE(s.dealer_code, c.dealer_code) as dealer_code,
-                COALESCE(s.dealer_name, c.dealer_name) as dealer_name,
-                COALESCE(s.total_sales, 0) as total_sales,
-                COALESCE(c.total_collections, 0) as total_collections,
-                COALESCE(s.total_sales, 0) - COALESCE(c.total_collections, 0) as outstanding_balance,
-                COALESCE(s.transaction_days, 0) as sales_days,
-                COALESCE(c.collection_days, 0) as collection_days
-            FROM 
-                (SELECT dealer_code, dealer_name, 
-                        SUM(total_quantity) as total_sales,
-                        COUNT(DISTINCT sale_date) as transaction_days
-                 FROM sales_data 
-                 GROUP BY dealer_code, dealer_name) s
-            FULL OUTER JOIN 
-                (SELECT dealer_code, dealer_name, 
-                        SUM(amount) as total_collections,
-                        COUNT(DISTINCT posting_date) as collection_days
-                 FROM collections_data 
-                 GROUP BY dealer_code, dealer_name) c
-            ON s.dealer_code = c.dealer_code
-            ORDER BY total_sales DESC
-        ''')
-        
-        results = cursor.fetchall()
-        
-        if results:
-            df = pd.DataFrame(results, columns=[
+        if not df.empty:
+            df.columns = [
                 'Dealer_Code', 'Dealer_Name', 'Total_Sales', 'Total_Collections',
                 'Outstanding_Balance', 'Sales_Days', 'Collection_Days'
-            ])
-            # Add serial number
-            df.insert(0, 'Serial_No', range(1, len(df) + 1))
+            ]
+            # Serial number as a RangeIndex (start/stop only, no extra column)
+            df.index = pd.RangeIndex(1, len(df) + 1, name='Serial_No')
             return df
         else:
             return pd.DataFrame()
@@ -265,22 +577,60 @@ class SalesCollectionsDatabase:
         """Close database connection"""
         self.conn.close()
 
+# pandas only has the calamine engine from 2.2 on (requirements.txt pins 2.0.3),
+# so python-calamine alone is not enough to switch engines
+try:
+    import python_calamine  # noqa: F401
+    HAS_CALAMINE_ENGINE = tuple(int(part) for part in pd.__version__.split('.')[:2]) >= (2, 2)
+except ImportError:
+    HAS_CALAMINE_ENGINE = False
+
+def read_excel_fast(excel_file, **kwargs):
+    """Read an Excel file with the Rust calamine engine when the installed pandas
+    and python-calamine support it, falling back to pandas' default engine otherwise"""
+    if HAS_CALAMINE_ENGINE:
+        return pd.read_excel(excel_file, engine='calamine', **kwargs)
+    return pd.read_excel(excel_file, **kwargs)
+
 def process_collections_file(excel_file_path):
-    """Process collections Excel file and return formatted DataFrame"""
+    """Process collections Excel file and return formatted DataFrame
+    
+    The parsed sheet is cached as a Parquet file next to the workbook and reused
+    until the workbook is modified again. The cache needs pyarrow, which is not in
+    requirements.txt; without it the workbook is simply read every time.
+    """
+    parquet_path = os.path.splitext(excel_file_path)[0] + '.parquet'
     
+    df = None
     try:
-        df = pd.read_excel(excel_file_path)
-        print(f"Successfully loaded {len(df)} collection records from {excel_file_path}")
+        if (os.path.exists(parquet_path)
+                and os.path.getmtime(parquet_path) >= os.path.getmtime(excel_file_path)):
+            df = pd.read_parquet(parquet_path)
+            print(f"Successfully loaded {len(df)} collection records from {parquet_path}")
+    except Exception as e:
+        print(f"Warning: could not use Parquet cache {parquet_path}, reading the workbook instead: {e}")
+    
+    try:
+        if df is None:
+            # Parse types while reading: nullable Int64 customer codes (blanks
+            # survive as <NA>), float amounts and datetime posting dates
+            df = read_excel_fast(
+                excel_file_path,
+                dtype={'Customer': 'Int64', 'Amount': 'float64'},
+                parse_dates=['Posting Date']
+            )
+            print(f"Successfully loaded {len(df)} collection records from {excel_file_path}")
+            try:
+                df.to_parquet(parquet_path, index=False)
+            except Exception as e:
+                print(f"Warning: collections Parquet cache not written (is pyarrow installed?): {e}")
     except Exception as e:
         print(f"Error reading Excel file: {e}")
         return None
     
-    # Convert Posting Date to datetime if not already
-    df['Posting Date'] = pd.to_datetime(df['Posting Date'])
-    
     # Clean and validate data
     df = df.dropna(subset=['Customer'])  # Remove rows with missing customer codes
-    df['Customer'] = df['Customer'].astype(int)  # Ensure customer codes are integers
+    df['Customer'] = df['Customer'].astype('int64')  # Ensure customer codes are plain integers
     
     return df
 
@@ -294,19 +644,16 @@ def display_data(df, title="Data"):
     print(f"{title.upper()}")
     print(f"{'='*120}")
     
-    pd.set_option('display.max_columns', None)
-    pd.set_option('display.width', None)
-    pd.set_option('display.max_colwidth', 25)
-    
-    print(df.to_string(index=False))
+    # Render straight to stdout instead of building the whole table string first;
+    # show the index only when it carries the Serial_No numbering
+    df.to_string(sys.stdout, index=df.index.name is not None)
+    sys.stdout.write('\n')
 
 def main():
     """Main function to process collections data and add to database
     
     Usage: python sales_collections_database.py <collections_file.xlsx>
     """
-    import sys
-    
     # Get base directory
     BASE_DIR = os.path.dirname(os.path.abspath(__file__))
     db_path = os.path.join(BASE_DIR, "webapp_sales_collections.db")
@@ -4,11 +4,16 @@ Sales and Collections Web Application - Simplified Version
 Flask web app for uploading files and generating reports
 """
 
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, g
 import pandas as pd
+import numpy as np
 import sqlite3
 import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from functools import lru_cache
 from werkzeug.utils import secure_filename
 
 # Get the base directory of the application
@@ -17,7 +22,7 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 # Import our database functions
 import sys
 sys.path.insert(0, BASE_DIR)
-from sales_collections_database import SalesCollectionsDatabase
+from sales_collections_database import SalesCollectionsDatabase, read_excel_fast
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-here'
@@ -25,56 +30,148 @@ app.secret_key = 'your-secret-key-here'
 # Database configuration - use relative path
 DB_PATH = os.path.join(BASE_DIR, "webapp_sales_collections.db")
 
+# One database per worker thread, opened (and its schema checked) once and then
+# reused by every request the thread serves
+_thread_db = threading.local()
+
+def thread_db():
+    """Return the calling thread's database, opening it on first use"""
+    db = getattr(_thread_db, 'db', None)
+    if db is None:
+        db = _thread_db.db = SalesCollectionsDatabase(DB_PATH)
+    return db
+
+def get_db():
+    """Return this worker thread's database for the current request"""
+    if 'db' not in g:
+        g.db = thread_db()
+    return g.db
+
+# Small pool for running a request's independent read queries side by side; WAL
+# lets each pool thread read through its own connection concurrently
+query_pool = ThreadPoolExecutor(max_workers=4)
+
+def fetch_all(sql, params=()):
+    """Run a read query on the calling thread's connection (used from query_pool)"""
+    return thread_db().conn.execute(sql, params).fetchall()
+
+@app.teardown_appcontext
+def release_db(exception):
+    """Roll back anything a failed request left uncommitted; the connection
+    itself stays open for the thread's next request"""
+    db = g.pop('db', None)
+    if db is not None and db.conn.in_transaction:
+        db.conn.rollback()
+
 # Configure upload settings - use relative path
 UPLOAD_FOLDER = os.path.join(BASE_DIR, 'uploads')
 ALLOWED_EXTENSIONS = {'xlsx', 'xls', 'pdf'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 
+# Accepted header names per field of the original sales / collections upload
+# formats (first one present wins)
+SALES_COLUMN_ALIASES = {
+    'sale_date': ['Sale Date', 'sale_date'],
+    'dealer_code': ['Dealer Code', 'dealer_code'],
+    'dealer_name': ['Dealer Name', 'dealer_name'],
+    'truck_number': ['Truck Number', 'truck_number', 'Vehicle Number'],
+    'invoice_number': ['Invoice Number', 'invoice_number', 'Invoice No'],
+    'ppc_quantity': ['PPC Quantity', 'ppc_quantity'],
+    'premium_quantity': ['Premium Quantity', 'premium_quantity'],
+    'opc_quantity': ['OPC Quantity', 'opc_quantity'],
+    'ppc_purchase_value': ['PPC Purchase Value', 'ppc_purchase_value'],
+    'premium_purchase_value': ['Premium Purchase Value', 'premium_purchase_value'],
+    'opc_purchase_value': ['OPC Purchase Value', 'opc_purchase_value'],
+    'plant_depot': ['Plant/Depot', 'plant_depot', 'Source'],
+}
+
+COLLECTIONS_COLUMN_ALIASES = {
+    'posting_date': ['Posting Date', 'posting_date', 'Date'],
+    'dealer_code': ['Customer', 'customer', 'Dealer Code', 'dealer_code'],
+    'dealer_name': ['Name of Customer', 'Name of customer', 'Dealer Name', 'dealer_name'],
+    'amount': ['Amount', 'amount'],
+    'district_name': ['District Name', 'district_name'],
+    'collection_type': ['Collection Type', 'collection_type'],
+    'payment_reference': ['Payment Reference', 'payment_reference'],
+}
+
+# Columns of the new sales format (one row per invoice product line)
+NEW_SALES_COLUMNS = ['Invoice Number', 'Invoice Date', 'Customer Code', 'Customer Name/Sold To', 'Truck Number',
+                     'Plant/Depot', 'Plant Description', 'Product Desc.', 'Invoice Quantity', 'Total Amount']
+
+# Only these columns are parsed out of uploaded workbooks; anything else in the sheet is skipped
+SALES_COLUMNS = set(NEW_SALES_COLUMNS).union(*SALES_COLUMN_ALIASES.values())
+COLLECTIONS_COLUMNS = set().union(*COLLECTIONS_COLUMN_ALIASES.values())
+
+# Quantity and value columns summed per dealer in the daily report
+REPORT_SALES_COLUMNS = ['ppc_quantity', 'premium_quantity', 'opc_quantity', 'total_quantity',
+                        'ppc_purchase_value', 'premium_purchase_value', 'opc_purchase_value', 'total_purchase_value']
+
+# Uploaded sheets are parsed and inserted this many rows at a time
+UPLOAD_CHUNK_ROWS = 10000
+
+# Sales insert shared by both upload formats (the original format has no plant
+# description); stored invoices are skipped by the unique invoice key
+INSERT_SALES_SQL = '''
+    INSERT INTO sales_data 
+    (sale_date, dealer_code, dealer_name, invoice_number, 
+     ppc_quantity, premium_quantity, opc_quantity, total_quantity, 
+     ppc_purchase_value, premium_purchase_value, opc_purchase_value, total_purchase_value, 
+     truck_number, plant_depot, plant_description)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT DO NOTHING
+'''
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+# Common depot abbreviations mapping
+DEPOT_ABBREVIATIONS = {
+    'DL NASIRPUR TR': 'NASR',
+    'DL OKHLA': 'OKHL',
+    'DL NARELA': 'NARE',
+    'DL MUNDKA': 'MUND',
+    'DL PATPARGANJ': 'PATP',
+    'DL SHAHDARA': 'SHAH',
+    'GGN MANESAR': 'MANE',
+    'GGN SOHNA': 'SOHN',
+    'FBD BALLABGARH': 'BALL',
+    'FBD FARIDABAD': 'FARI',
+    'NDA NOIDA': 'NOID',
+    'NDA GREATER NOIDA': 'GNOI',
+    'GZB GHAZIABAD': 'GHAZ',
+    'DADRI': 'DADR',
+    'PALWAL': 'PALW',
+    'REWARI': 'REWA',
+    'ROHTAK': 'ROHT',
+    'SONIPAT': 'SONI',
+    'PANIPAT': 'PANI',
+    'KARNAL': 'KARN',
+    'AMBALA': 'AMBA',
+    'JIND': 'JIND',
+    'HISAR': 'HISA',
+    'BHIWANI': 'BHIW',
+}
+
+# Partial-match candidates, precomputed once in the mapping's order
+DEPOT_ABBREVIATION_ITEMS = tuple(DEPOT_ABBREVIATIONS.items())
+
+# Plant descriptions repeat heavily across trucks, so results are cached
+@lru_cache(maxsize=None)
 def get_depot_abbreviation(plant_description):
     """Get 4-letter abbreviation for depot/plant description"""
     if not plant_description:
         return None
     
-    # Common depot abbreviations mapping
-    depot_map = {
-        'DL NASIRPUR TR': 'NASR',
-        'DL OKHLA': 'OKHL',
-        'DL NARELA': 'NARE',
-        'DL MUNDKA': 'MUND',
-        'DL PATPARGANJ': 'PATP',
-        'DL SHAHDARA': 'SHAH',
-        'GGN MANESAR': 'MANE',
-        'GGN SOHNA': 'SOHN',
-        'FBD BALLABGARH': 'BALL',
-        'FBD FARIDABAD': 'FARI',
-        'NDA NOIDA': 'NOID',
-        'NDA GREATER NOIDA': 'GNOI',
-        'GZB GHAZIABAD': 'GHAZ',
-        'DADRI': 'DADR',
-        'PALWAL': 'PALW',
-        'REWARI': 'REWA',
-        'ROHTAK': 'ROHT',
-        'SONIPAT': 'SONI',
-        'PANIPAT': 'PANI',
-        'KARNAL': 'KARN',
-        'AMBALA': 'AMBA',
-        'JIND': 'JIND',
-        'HISAR': 'HISA',
-        'BHIWANI': 'BHIW',
-    }
-    
     plant_upper = plant_description.upper().strip()
     
     # Check for exact match first
-    if plant_upper in depot_map:
-        return depot_map[plant_upper]
+    if plant_upper in DEPOT_ABBREVIATIONS:
+        return DEPOT_ABBREVIATIONS[plant_upper]
     
     # Check for partial match
-    for key, abbr in depot_map.items():
+    for key, abbr in DEPOT_ABBREVIATION_ITEMS:
         if key in plant_upper or plant_upper in key:
             return abbr
     
@@ -87,102 +184,277 @@ def get_depot_abbreviation(plant_description):
     
     return plant_upper[:4].upper() if len(plant_upper) >= 4 else plant_upper.upper()
 
-def categorize_product(product_desc):
-    """Categorize product into PPC, Premium, or OPC based on description"""
-    product_desc = str(product_desc).upper()
+# One regex pass per description: the first alternative finds OPC anywhere in
+# the text and only if there's none the second looks for PREM(IUM), which keeps
+# OPC > Premium > PPC precedence
+PRODUCT_TYPE_PATTERN = re.compile(r'^(?:.*(?P<OPC>OPC)|.*(?P<Premium>PREM))', re.IGNORECASE | re.DOTALL)
+
+def categorize_products(product_descs):
+    """Categorize a column of product descriptions into PPC, Premium, or OPC"""
+    matches = product_descs.astype(str).str.extract(PRODUCT_TYPE_PATTERN)
     
-    if 'OPC' in product_desc:
-        return 'OPC'
-    elif 'PREM' in product_desc or 'PREMIUM' in product_desc:
-        return 'Premium'
-    elif 'PPC' in product_desc:
-        return 'PPC'
-    else:
+    return np.select(
+        [matches['OPC'].notna(), matches['Premium'].notna()],
+        ['OPC', 'Premium'],
         # Default to PPC if unclear
-        return 'PPC'
+        default='PPC'
+    )
+
+def get_column(df, names, default):
+    """Return the first of the alias columns present in df, or a column filled with default"""
+    for name in names:
+        if name in df.columns:
+            return df[name]
+    return pd.Series(default, index=df.index, dtype=object)
+
+def parse_column(values, parse, convert):
+    """Parse a whole column at once
+
+    parse is the vectorized parser (returning NaN/NaT for cells it can't handle);
+    those cells are retried one at a time with the scalar convert, so a bad cell
+    reports the same error message it did when rows were parsed individually.
+    Returns (parsed values, error message per row or '').
+    """
+    parsed = parse(values).copy()
+    errors = pd.Series('', index=values.index, dtype=object)
+    for index in parsed.index[parsed.isna()]:
+        try:
+            parsed[index] = convert(values[index])
+        except Exception as e:
+            errors[index] = str(e)
+    return parsed, errors
+
+def to_numbers(values):
+    """Vectorized numeric parse for parse_column"""
+    return pd.to_numeric(values, errors='coerce')
+
+def to_dates(values):
+    """Vectorized date parse for parse_column"""
+    return pd.to_datetime(values, errors='coerce')
+
+def to_date_strings(values):
+    """Vectorized YYYY-MM-DD formatting for parse_column"""
+    return to_dates(values).dt.strftime('%Y-%m-%d')
+
+def to_date_string(value):
+    """Scalar YYYY-MM-DD formatting for parse_column"""
+    return pd.to_datetime(value).strftime('%Y-%m-%d')
+
+# Cell text (after strip, any case) that means an empty optional field
+EMPTY_TEXT_VALUES = ['nan', 'none', '']
+
+def to_optional_text(values):
+    """Strip a text column, with empty/NaN/None cells as None (stored as NULL)"""
+    texts = values.astype(str).str.strip()
+    return texts.where(~texts.str.lower().isin(EMPTY_TEXT_VALUES), None)
+
+def parse_sales_upload(df):
+    """Parse rows of an original-format sales sheet column by column
+    
+    Returns one record per row with the parsed fields, the first validation
+    error ('' when valid) and any quantity/value error (reported only for rows
+    that aren't duplicates).
+    """
+    # Resolve each field's column once (the first alias present, as the
+    # per-row row.get() chains did) and parse whole columns at a time
+    sale_date_raw = get_column(df, SALES_COLUMN_ALIASES['sale_date'], '')
+    dealer_code_raw = get_column(df, SALES_COLUMN_ALIASES['dealer_code'], 0)
+    dealer_name_raw = get_column(df, SALES_COLUMN_ALIASES['dealer_name'], '')
+    truck_number_raw = get_column(df, SALES_COLUMN_ALIASES['truck_number'], '')
+    invoice_number_raw = get_column(df, SALES_COLUMN_ALIASES['invoice_number'], None)
+    plant_depot_raw = get_column(df, SALES_COLUMN_ALIASES['plant_depot'], '')
+    
+    # First validation error per row ('' when valid), checked in the same
+    # order as before so each row reports the same message
+    errors = pd.Series('', index=df.index, dtype=object)
+    
+    sale_date_missing = sale_date_raw.isna() | sale_date_raw.eq('')
+    errors = errors.mask(sale_date_missing, 'Sale Date is missing or empty')
+    sale_dates, parse_errors = parse_column(sale_date_raw, to_dates, pd.to_datetime)
+    errors = errors.where(errors != '', parse_errors)
+    
+    dealer_code_missing = dealer_code_raw.isna() | dealer_code_raw.eq(0)
+    errors = errors.mask((errors == '') & dealer_code_missing, 'Dealer Code is missing or zero')
+    dealer_codes, parse_errors = parse_column(dealer_code_raw, to_numbers, int)
+    errors = errors.where(errors != '', parse_errors)
+    
+    dealer_names = dealer_name_raw.astype(str).str.strip()
+    dealer_name_missing = dealer_name_raw.isna() | dealer_names.eq('')
+    errors = errors.mask((errors == '') & dealer_name_missing, 'Dealer Name is missing or empty')
+    
+    # Empty truck numbers / plant depots are stored as NULL
+    truck_numbers = to_optional_text(truck_number_raw)
+    plant_depots = to_optional_text(plant_depot_raw)
+    
+    invoice_number_missing = invoice_number_raw.isna() | invoice_number_raw.eq('')
+    invoice_numbers, parse_errors = parse_column(invoice_number_raw.mask(invoice_number_missing, 0), to_numbers, int)
+    invoice_numbers = invoice_numbers.mask(invoice_number_missing)
+    errors = errors.where(errors != '', parse_errors)
+    
+    # Material quantities and purchase values; a bad cell only fails its row
+    # after the duplicate check, as before
+    amounts = pd.DataFrame(index=df.index)
+    amount_errors = pd.Series('', index=df.index, dtype=object)
+    for column in ['ppc_quantity', 'premium_quantity', 'opc_quantity',
+                   'ppc_purchase_value', 'premium_purchase_value', 'opc_purchase_value']:
+        values, parse_errors = parse_column(get_column(df, SALES_COLUMN_ALIASES[column], 0), to_numbers, float)
+        amounts[column] = values.astype('float64')
+        amount_errors = amount_errors.where(amount_errors != '', parse_errors)
+    amounts['total_quantity'] = amounts['ppc_quantity'] + amounts['premium_quantity'] + amounts['opc_quantity']
+    amounts['total_purchase_value'] = amounts['ppc_purchase_value'] + amounts['premium_purchase_value'] + amounts['opc_purchase_value']
+    
+    return pd.DataFrame({
+        'error': errors,
+        'sale_date': sale_dates.dt.strftime('%Y-%m-%d'),
+        'dealer_code': dealer_codes,
+        'dealer_name': dealer_names,
+        'invoice_number': invoice_numbers,
+        'amount_error': amount_errors,
+        'ppc_quantity': amounts['ppc_quantity'],
+        'premium_quantity': amounts['premium_quantity'],
+        'opc_quantity': amounts['opc_quantity'],
+        'total_quantity': amounts['total_quantity'],
+        'ppc_purchase_value': amounts['ppc_purchase_value'],
+        'premium_purchase_value': amounts['premium_purchase_value'],
+        'opc_purchase_value': amounts['opc_purchase_value'],
+        'total_purchase_value': amounts['total_purchase_value'],
+        'truck_number': truck_numbers,
+        'plant_depot': plant_depots,
+    })
+
+def parse_collections_upload(df):
+    """Parse rows of a collections sheet column by column
+    
+    Returns one record per row with the parsed fields and the first error
+    ('' when valid).
+    """
+    # Resolve each field's column once (the first alias present, as the
+    # per-row row.get() chains did) and parse whole columns at a time
+    posting_dates, errors = parse_column(
+        get_column(df, COLLECTIONS_COLUMN_ALIASES['posting_date'], ''), to_date_strings, to_date_string)
+    
+    dealer_codes, parse_errors = parse_column(
+        get_column(df, COLLECTIONS_COLUMN_ALIASES['dealer_code'], 0).fillna(0), to_numbers, int)
+    errors = errors.where(errors != '', parse_errors)
+    
+    amounts, parse_errors = parse_column(get_column(df, COLLECTIONS_COLUMN_ALIASES['amount'], 0), to_numbers, float)
+    errors = errors.where(errors != '', parse_errors)
+    
+    # A blank amount parses to NaN, which SQLite binds as NULL; fail just that
+    # row, with the NOT NULL message its own INSERT used to report, instead of
+    # letting it abort the whole batch
+    errors = errors.mask((errors == '') & amounts.isna(), 'NOT NULL constraint failed: collections_data.amount')
+    
+    # Text fields: stripped, '' when empty
+    text_columns = {}
+    for column in ['dealer_name', 'district_name', 'collection_type', 'payment_reference']:
+        values = get_column(df, COLLECTIONS_COLUMN_ALIASES[column], '')
+        text_columns[column] = values.astype(str).str.strip().where(values.notna(), '')
+    
+    return pd.DataFrame({
+        'error': errors,
+        'posting_date': posting_dates,
+        'dealer_code': dealer_codes,
+        'amount': amounts.astype('float64'),
+        **text_columns,
+    })
 
 def process_new_sales_format(df):
     """Process the new sales file format with product line items"""
     try:
-        db = SalesCollectionsDatabase(DB_PATH)
+        db = get_db()
         cursor = db.conn.cursor()
         
         successful_invoices = 0
         duplicate_invoices = 0
         error_rows = []
         
-        # Group by invoice to aggregate product line items
-        invoice_groups = df.groupby('Invoice Number')
+        # Categorize and parse every product line in one pass; a bad quantity or
+        # amount fails its whole invoice, as before
+        quantities, quantity_errors = parse_column(df['Invoice Quantity'], to_numbers, float)
+        amounts, amount_errors = parse_column(df['Total Amount'], to_numbers, float)
+        df = df.assign(
+            product_type=categorize_products(df['Product Desc.']),
+            quantity=quantities.astype('float64'),
+            amount=amounts.astype('float64'),
+            line_error=quantity_errors.where(quantity_errors != '', amount_errors)
+        )
+        
+        # Sum quantities and amounts per invoice and product type in one groupby
+        totals = df.groupby(['Invoice Number', 'product_type'])[['quantity', 'amount']].sum().unstack(fill_value=0.0)
+        totals = totals.reindex(columns=pd.MultiIndex.from_product([['quantity', 'amount'], ['PPC', 'Premium', 'OPC']]), fill_value=0.0)
+        
+        # Common invoice data comes from each invoice's first line
+        invoices = df.drop_duplicates('Invoice Number').set_index('Invoice Number').loc[totals.index]
+        
+        sale_dates, errors = parse_column(invoices['Invoice Date'], to_date_strings, to_date_string)
+        dealer_codes, parse_errors = parse_column(invoices['Customer Code'], to_numbers, int)
+        errors = errors.where(errors != '', parse_errors)
+        line_errors = df.loc[df['line_error'] != ''].groupby('Invoice Number')['line_error'].first()
+        errors = errors.where(errors != '', line_errors.reindex(totals.index, fill_value=''))
+        
+        plant_descriptions = to_optional_text(get_column(invoices, ['Plant Description'], ''))
+        
+        records = pd.DataFrame({
+            'error': errors,
+            'sale_date': sale_dates,
+            'dealer_code': dealer_codes,
+            'dealer_name': invoices['Customer Name/Sold To'].astype(str).str.strip(),
+            'ppc_quantity': totals['quantity', 'PPC'],
+            'premium_quantity': totals['quantity', 'Premium'],
+            'opc_quantity': totals['quantity', 'OPC'],
+            'ppc_purchase_value': totals['amount', 'PPC'],
+            'premium_purchase_value': totals['amount', 'Premium'],
+            'opc_purchase_value': totals['amount', 'OPC'],
+            'truck_number': invoices['Truck Number'].astype(str).str.strip(),
+            'plant_depot': invoices['Plant/Depot'].astype(str).str.strip(),
+            'plant_description': plant_descriptions,
+        })
+        records['total_quantity'] = records['ppc_quantity'] + records['premium_quantity'] + records['opc_quantity']
+        records['total_purchase_value'] = records['ppc_purchase_value'] + records['premium_purchase_value'] + records['opc_purchase_value']
+        
+        # Aggregated invoices, inserted in one batch after the loop
+        rows = []
+        
+        # Stored invoices are skipped by ON CONFLICT in the insert when sales_data
+        # has its unique invoice key; otherwise prefetch them once
+        existing_invoices = set()
+        if not db.has_sales_invoice_key:
+            cursor.execute('SELECT invoice_number FROM sales_data WHERE invoice_number IS NOT NULL')
+            existing_invoices = {row[0] for row in cursor.fetchall()}
         
-        for invoice_number, invoice_df in invoice_groups:
+        for record in records.itertuples():
+            invoice_number = record.Index
             try:
                 # Check if invoice already exists (duplicate check)
-                cursor.execute('SELECT id FROM sales_data WHERE invoice_number = ?', (int(invoice_number),))
-                if cursor.fetchone():
+                if int(invoice_number) in existing_invoices:
                     duplicate_invoices += 1
                     continue
                 
-                # Get common invoice data from first row
-                first_row = invoice_df.iloc[0]
-                
-                # Extract basic invoice info
-                sale_date = pd.to_datetime(first_row['Invoice Date']).strftime('%Y-%m-%d')
-                dealer_code = int(first_row['Customer Code'])
-                dealer_name = str(first_row['Customer Name/Sold To']).strip()
-                truck_number = str(first_row['Truck Number']).strip()
-                plant_depot = str(first_row['Plant/Depot']).strip()
-                plant_description = str(first_row.get('Plant Description', '')).strip()
-                if plant_description.lower() in ['nan', 'none', '']:
-                    plant_description = None
-                
-                # Initialize quantities and values
-                ppc_quantity = 0.0
-                premium_quantity = 0.0
-                opc_quantity = 0.0
-                ppc_purchase_value = 0.0
-                premium_purchase_value = 0.0
-                opc_purchase_value = 0.0
-                
-                # Aggregate products by type
-                for _, row in invoice_df.iterrows():
-                    product_type = categorize_product(row['Product Desc.'])
-                    quantity = float(row['Invoice Quantity'])
-                    amount = float(row['Total Amount'])
-                    
-                    if product_type == 'PPC':
-                        ppc_quantity += quantity
-                        ppc_purchase_value += amount
-                    elif product_type == 'Premium':
-                        premium_quantity += quantity
-                        premium_purchase_value += amount
-                    elif product_type == 'OPC':
-                        opc_quantity += quantity
-                        opc_purchase_value += amount
-                
-                # Calculate totals
-                total_quantity = ppc_quantity + premium_quantity + opc_quantity
-                total_purchase_value = ppc_purchase_value + premium_purchase_value + opc_purchase_value
+                if record.error:
+                    error_rows.append(f"Invoice {invoice_number}: {record.error}")
+                    continue
                 
-                # Insert aggregated invoice data
-                cursor.execute('''
-                    INSERT INTO sales_data 
-                    (sale_date, dealer_code, dealer_name, invoice_number, 
-                     ppc_quantity, premium_quantity, opc_quantity, total_quantity, 
-                     ppc_purchase_value, premium_purchase_value, opc_purchase_value, total_purchase_value, 
-                     truck_number, plant_depot, plant_description)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (sale_date, dealer_code, dealer_name, invoice_number,
-                      ppc_quantity, premium_quantity, opc_quantity, total_quantity, 
-                      ppc_purchase_value, premium_purchase_value, opc_purchase_value, total_purchase_value,
-                      truck_number, plant_depot, plant_description))
+                # Queue aggregated invoice data
+                rows.append((record.sale_date, int(record.dealer_code), record.dealer_name, int(invoice_number),
+                             record.ppc_quantity, record.premium_quantity, record.opc_quantity, record.total_quantity, 
+                             record.ppc_purchase_value, record.premium_purchase_value, record.opc_purchase_value, record.total_purchase_value,
+                             record.truck_number, record.plant_depot, record.plant_description))
                 
                 successful_invoices += 1
                 
             except Exception as row_error:
                 error_rows.append(f"Invoice {invoice_number}: {str(row_error)}")
         
-        db.conn.commit()
-        db.close()
+        # Insert all aggregated invoices in a single transaction
+        with db.bulk_load():
+            cursor.executemany(INSERT_SALES_SQL, rows)
+            inserted = cursor.rowcount
+        clear_balance_caches()
+        
+        # Invoices skipped by ON CONFLICT were already stored
+        duplicate_invoices += successful_invoices - inserted
+        successful_invoices = inserted
         
         if successful_invoices > 0 or duplicate_invoices > 0:
             message = f"Successfully uploaded {successful_invoices} invoices"
@@ -192,7 +464,7 @@ def process_new_sales_format(df):
                 message += f", {len(error_rows)} errors"
             return jsonify({'success': True, 'message': message, 'errors': error_rows, 'duplicates': duplicate_invoices})
         else:
-            detailed_message = f'No valid invoices found. All {len(invoice_groups)} invoices failed to process.'
+            detailed_message = f'No valid invoices found. All {len(records)} invoices failed to process.'
             if error_rows:
                 detailed_message += f' First error: {error_rows[0] if error_rows else "Unknown error"}'
             return jsonify({'success': False, 'message': detailed_message, 'errors': error_rows})
@@ -216,119 +488,89 @@ def upload_sales():
     
     if file and allowed_file(file.filename):
         try:
-            # Read Excel file
-            df = pd.read_excel(file)
+            # Read only the columns either sales format uses
+            df = read_excel_fast(file, usecols=lambda column: column in SALES_COLUMNS)
             
             # Check if this is the new format (has 'Customer Code' instead of 'Dealer Code')
             if 'Customer Code' in df.columns and 'Invoice Date' in df.columns:
                 return process_new_sales_format(df)
             
             # Process and save to database (original format)
-            db = None
-            try:
-                db = SalesCollectionsDatabase(DB_PATH)
-                cursor = db.conn.cursor()
-                
-                successful_rows = 0
-                duplicate_rows = 0
-                error_rows = []
-                
-                for index, row in df.iterrows():
-                    try:
-                        # Extract data from row
-                        sale_date_raw = row.get('Sale Date', row.get('sale_date', ''))
-                        if pd.isna(sale_date_raw) or sale_date_raw == '':
-                            raise ValueError("Sale Date is missing or empty")
-                        sale_date = pd.to_datetime(sale_date_raw).strftime('%Y-%m-%d')
-                        
-                        dealer_code_raw = row.get('Dealer Code', row.get('dealer_code', 0))
-                        if pd.isna(dealer_code_raw) or dealer_code_raw == 0:
-                            raise ValueError("Dealer Code is missing or zero")
-                        dealer_code = int(dealer_code_raw)
-                        
-                        dealer_name_raw = row.get('Dealer Name', row.get('dealer_name', ''))
-                        if pd.isna(dealer_name_raw) or str(dealer_name_raw).strip() == '':
-                            raise ValueError("Dealer Name is missing or empty")
-                        dealer_name = str(dealer_name_raw).strip()
-                        
-                        # Extract truck number and invoice number
-                        truck_number = str(row.get('Truck Number', row.get('truck_number', row.get('Vehicle Number', '')))).strip()
-                        invoice_number = row.get('Invoice Number', row.get('invoice_number', row.get('Invoice No', None)))
-                        
-                        # Handle empty truck number
-                        if not truck_number or truck_number.lower() in ['nan', 'none', '']:
-                            truck_number = None
+            db = get_db()
+            cursor = db.conn.cursor()
+            
+            successful_rows = 0
+            duplicate_rows = 0
+            error_rows = []
+            
+            # Invoice numbers queued from this file, so repeats within the file are
+            # found without a query. Stored invoices are skipped by ON CONFLICT in
+            # the insert when sales_data has its unique invoice key; otherwise
+            # they are prefetched once here.
+            known_invoices = set()
+            if not db.has_sales_invoice_key:
+                cursor.execute('SELECT invoice_number FROM sales_data WHERE invoice_number IS NOT NULL')
+                known_invoices = {row[0] for row in cursor.fetchall()}
+            
+            # Parse and insert the sheet in slices of UPLOAD_CHUNK_ROWS rows, so the
+            # parsed intermediate columns stay bounded; one transaction for all
+            with db.bulk_load():
+                for start in range(0, len(df), UPLOAD_CHUNK_ROWS):
+                    records = parse_sales_upload(df.iloc[start:start + UPLOAD_CHUNK_ROWS])
+                    rows = []
+                    
+                    # Duplicates depend on which earlier rows were accepted, so the final
+                    # pass walks the parsed values in file order
+                    for record in records.itertuples():
+                        if record.error:
+                            error_rows.append(f"Row {record.Index + 2}: {record.error}")
+                            continue
                         
-                        # Handle invoice number
-                        if pd.isna(invoice_number) or invoice_number == '':
-                            invoice_number = None
-                        else:
-                            invoice_number = int(invoice_number)
+                        invoice_number = None if pd.isna(record.invoice_number) else int(record.invoice_number)
                         
                         # Check for duplicate invoice
-                        if invoice_number:
-                            cursor.execute('SELECT id FROM sales_data WHERE invoice_number = ?', (invoice_number,))
-                            if cursor.fetchone():
-                                duplicate_rows += 1
-                                continue
-                        
-                        # Material quantities
-                        ppc_quantity = float(row.get('PPC Quantity', row.get('ppc_quantity', 0)))
-                        premium_quantity = float(row.get('Premium Quantity', row.get('premium_quantity', 0)))
-                        opc_quantity = float(row.get('OPC Quantity', row.get('opc_quantity', 0)))
-                        total_quantity = ppc_quantity + premium_quantity + opc_quantity
-                        
-                        # Purchase values
-                        ppc_purchase_value = float(row.get('PPC Purchase Value', row.get('ppc_purchase_value', 0)))
-                        premium_purchase_value = float(row.get('Premium Purchase Value', row.get('premium_purchase_value', 0)))
-                        opc_purchase_value = float(row.get('OPC Purchase Value', row.get('opc_purchase_value', 0)))
-                        total_purchase_value = ppc_purchase_value + premium_purchase_value + opc_purchase_value
+                        if invoice_number and invoice_number in known_invoices:
+                            duplicate_rows += 1
+                            continue
                         
-                        # Extract plant/depot information if available
-                        plant_depot = str(row.get('Plant/Depot', row.get('plant_depot', row.get('Source', '')))).strip()
-                        if not plant_depot or plant_depot.lower() in ['nan', 'none', '']:
-                            plant_depot = None
+                        if record.amount_error:
+                            error_rows.append(f"Row {record.Index + 2}: {record.amount_error}")
+                            continue
                         
-                        # Insert sales data
-                        cursor.execute('''
-                            INSERT INTO sales_data 
-                            (sale_date, dealer_code, dealer_name, invoice_number, 
-                             ppc_quantity, premium_quantity, opc_quantity, total_quantity, 
-                             ppc_purchase_value, premium_purchase_value, opc_purchase_value, total_purchase_value, 
-                             truck_number, plant_depot)
-                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                        ''', (sale_date, dealer_code, dealer_name, invoice_number,
-                              ppc_quantity, premium_quantity, opc_quantity, total_quantity, 
-                              ppc_purchase_value, premium_purchase_value, opc_purchase_value, total_purchase_value,
-                              truck_number, plant_depot))
+                        # Queue sales data
+                        rows.append((record.sale_date, int(record.dealer_code), record.dealer_name, invoice_number,
+                                     record.ppc_quantity, record.premium_quantity, record.opc_quantity, record.total_quantity,
+                                     record.ppc_purchase_value, record.premium_purchase_value, record.opc_purchase_value, record.total_purchase_value,
+                                     record.truck_number, record.plant_depot, None))
+                        if invoice_number:
+                            known_invoices.add(invoice_number)
                         
                         successful_rows += 1
-                        
-                    except Exception as row_error:
-                        error_rows.append(f"Row {index + 2}: {str(row_error)}")
-                
-                db.conn.commit()
-                
-                if successful_rows > 0 or duplicate_rows > 0:
-                    message = f"Successfully uploaded {successful_rows} sales records"
-                    if duplicate_rows > 0:
-                        message += f", {duplicate_rows} duplicates skipped"
-                    if error_rows:
-                        message += f", {len(error_rows)} errors"
-                    return jsonify({'success': True, 'message': message, 'errors': error_rows, 'duplicates': duplicate_rows})
-                else:
-                    detailed_message = f'No valid data found in file. All {len(df)} rows failed to process.'
-                    if error_rows:
-                        detailed_message += f' First error: {error_rows[0] if error_rows else "Unknown error"}'
-                    return jsonify({'success': False, 'message': detailed_message, 'errors': error_rows, 'total_rows': len(df), 'columns': list(df.columns)})
                     
-            finally:
-                if db is not None:
-                    try:
-                        db.close()
-                    except:
-                        pass
-                        
+                    cursor.executemany(INSERT_SALES_SQL, rows)
+                    
+                    # Rows skipped by ON CONFLICT were already stored
+                    duplicate_rows += len(rows) - cursor.rowcount
+                    successful_rows -= len(rows) - cursor.rowcount
+            clear_balance_caches()
+            
+            if successful_rows > 0 or duplicate_rows > 0:
+                message = f"Successfully uploaded {successful_rows} sales records"
+                if duplicate_rows > 0:
+                    message += f", {duplicate_rows} duplicates skipped"
+                if error_rows:
+                    message += f", {len(error_rows)} errors"
+                return jsonify({'success': True, 'message': message, 'errors': error_rows, 'duplicates': duplicate_rows})
+            else:
+                detailed_message = f'No valid data found in file. All {len(df)} rows failed to process.'
+                if error_rows:
+                    detailed_message += f' First error: {error_rows[0] if error_rows else "Unknown error"}'
+                # Report the sheet's own header row; df only holds the columns read above
+                file.seek(0)
+                columns = list(read_excel_fast(file, nrows=0).columns)
+                return jsonify({'success': False, 'message': detailed_message, 'errors': error_rows, 'total_rows': len(df), 'columns': columns})
+                
+            
         except Exception as e:
             return jsonify({'success': False, 'message': f'Error processing file: {str(e)}'})
     
@@ -346,84 +588,72 @@ def upload_collections():
     
     if file and allowed_file(file.filename):
         try:
-            # Read Excel file
-            df = pd.read_excel(file)
+            # Read only the columns the collections format uses
+            df = read_excel_fast(file, usecols=lambda column: column in COLLECTIONS_COLUMNS)
             
             # Process and save to database
-            db = None
-            try:
-                db = SalesCollectionsDatabase(DB_PATH)
-                cursor = db.conn.cursor()
-                
-                successful_rows = 0
-                duplicate_rows = 0
-                error_rows = []
-                
-                for index, row in df.iterrows():
-                    try:
-                        # Extract data from row - support multiple column name formats
-                        posting_date = pd.to_datetime(row.get('Posting Date', row.get('posting_date', row.get('Date', '')))).strftime('%Y-%m-%d')
-                        
-                        # Dealer code: try 'Customer', 'customer', 'Dealer Code', 'dealer_code'
-                        dealer_code = row.get('Customer', row.get('customer', row.get('Dealer Code', row.get('dealer_code', 0))))
-                        dealer_code = int(dealer_code) if pd.notna(dealer_code) else 0
-                        
-                        # Dealer name: try 'Name of Customer', 'Name of customer', 'Dealer Name', 'dealer_name'
-                        dealer_name = row.get('Name of Customer', row.get('Name of customer', row.get('Dealer Name', row.get('dealer_name', ''))))
-                        dealer_name = str(dealer_name).strip() if pd.notna(dealer_name) else ''
-                        
-                        amount = float(row.get('Amount', row.get('amount', 0)))
-                        
-                        # Optional fields
-                        district_name = row.get('District Name', row.get('district_name', ''))
-                        district_name = str(district_name).strip() if pd.notna(district_name) else ''
-                        
-                        collection_type = row.get('Collection Type', row.get('collection_type', ''))
-                        collection_type = str(collection_type).strip() if pd.notna(collection_type) else ''
+            db = get_db()
+            cursor = db.conn.cursor()
+            
+            successful_rows = 0
+            duplicate_rows = 0
+            error_rows = []
+            
+            # Duplicate keys already stored (prefetched once) or queued from this
+            # file, so duplicates are found without a SELECT per row
+            cursor.execute('''
+                SELECT posting_date, dealer_code, amount, payment_reference
+                FROM collections_data
+            ''')
+            known_keys = set(cursor.fetchall())
+            
+            # Parse and insert the sheet in slices of UPLOAD_CHUNK_ROWS rows, so the
+            # parsed intermediate columns stay bounded; one transaction for all
+            with db.bulk_load():
+                for start in range(0, len(df), UPLOAD_CHUNK_ROWS):
+                    records = parse_collections_upload(df.iloc[start:start + UPLOAD_CHUNK_ROWS])
+                    rows = []
+                    
+                    # Duplicates depend on which earlier rows were accepted, so the final
+                    # pass walks the parsed values in file order
+                    for record in records.itertuples():
+                        if record.error:
+                            error_rows.append(f"Row {record.Index + 2}: {record.error}")
+                            continue
                         
-                        payment_reference = row.get('Payment Reference', row.get('payment_reference', ''))
-                        payment_reference = str(payment_reference).strip() if pd.notna(payment_reference) else ''
+                        dealer_code = int(record.dealer_code)
                         
                         # Check for duplicate collection (same date, dealer, amount, and payment_reference)
-                        cursor.execute('''
-                            SELECT id FROM collections_data 
-                            WHERE posting_date = ? AND dealer_code = ? AND amount = ? AND payment_reference = ?
-                        ''', (posting_date, dealer_code, amount, payment_reference))
-                        if cursor.fetchone():
+                        key = (record.posting_date, dealer_code, record.amount, record.payment_reference)
+                        if key in known_keys:
                             duplicate_rows += 1
                             continue
                         
-                        # Insert collections data
-                        cursor.execute('''
-                            INSERT INTO collections_data 
-                            (posting_date, dealer_code, dealer_name, amount, district_name, collection_type, payment_reference)
-                            VALUES (?, ?, ?, ?, ?, ?, ?)
-                        ''', (posting_date, dealer_code, dealer_name, amount, district_name, collection_type, payment_reference))
+                        # Queue collections data
+                        rows.append((record.posting_date, dealer_code, record.dealer_name, record.amount,
+                                     record.district_name, record.collection_type, record.payment_reference))
+                        known_keys.add(key)
                         
                         successful_rows += 1
-                        
-                    except Exception as row_error:
-                        error_rows.append(f"Row {index + 2}: {str(row_error)}")
-                
-                db.conn.commit()
-                
-                if successful_rows > 0 or duplicate_rows > 0:
-                    message = f"Successfully uploaded {successful_rows} collections records"
-                    if duplicate_rows > 0:
-                        message += f", {duplicate_rows} duplicates skipped"
-                    if error_rows:
-                        message += f", {len(error_rows)} errors"
-                    return jsonify({'success': True, 'message': message, 'errors': error_rows, 'duplicates': duplicate_rows})
-                else:
-                    return jsonify({'success': False, 'message': 'No valid data found in file', 'errors': error_rows})
                     
-            finally:
-                if db is not None:
-                    try:
-                        db.close()
-                    except:
-                        pass
-                        
+                    cursor.executemany('''
+                        INSERT INTO collections_data 
+                        (posting_date, dealer_code, dealer_name, amount, district_name, collection_type, payment_reference)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ''', rows)
+            clear_balance_caches()
+            
+            if successful_rows > 0 or duplicate_rows > 0:
+                message = f"Successfully uploaded {successful_rows} collections records"
+                if duplicate_rows > 0:
+                    message += f", {duplicate_rows} duplicates skipped"
+                if error_rows:
+                    message += f", {len(error_rows)} errors"
+                return jsonify({'success': True, 'message': message, 'errors': error_rows, 'duplicates': duplicate_rows})
+            else:
+                return jsonify({'success': False, 'message': 'No valid data found in file', 'errors': error_rows})
+                
+            
         except Exception as e:
             return jsonify({'success': False, 'message': f'Error processing file: {str(e)}'})
     
@@ -433,20 +663,19 @@ def upload_collections():
 def get_available_dates():
     """Get available dates from database"""
     try:
-        db = SalesCollectionsDatabase(DB_PATH)
+        db = get_db()
         cursor = db.conn.cursor()
         
-        # Get distinct dates from both sales and collections
-        cursor.execute("SELECT DISTINCT sale_date FROM sales_data ORDER BY sale_date")
-        sales_dates = [row[0] for row in cursor.fetchall()]
-        
-        cursor.execute("SELECT DISTINCT posting_date FROM collections_data ORDER BY posting_date")
-        collection_dates = [row[0] for row in cursor.fetchall()]
-        
-        # Combine and sort all dates
-        all_dates = sorted(list(set(sales_dates + collection_dates)))
+        # Get distinct dates from both sales and collections in one query; UNION
+        # de-duplicates and sorts off the idx_sale_date / idx_posting_date indexes
+        cursor.execute('''
+            SELECT sale_date FROM sales_data
+            UNION
+            SELECT posting_date FROM collections_data
+            ORDER BY 1
+        ''')
+        all_dates = [row[0] for row in cursor.fetchall()]
         
-        db.close()
         return jsonify({'success': True, 'dates': all_dates})
         
     except Exception as e:
@@ -456,19 +685,17 @@ def get_available_dates():
 def get_available_months():
     """Get available months from database for month-wise reports"""
     try:
-        db = SalesCollectionsDatabase(DB_PATH)
+        db = get_db()
         cursor = db.conn.cursor()
         
-        # Get distinct months from sales data
-        cursor.execute("SELECT DISTINCT strftime('%Y-%m', sale_date) as month_year FROM sales_data ORDER BY month_year")
-        sales_months = [row[0] for row in cursor.fetchall()]
-        
-        # Get distinct months from collections data
-        cursor.execute("SELECT DISTINCT strftime('%Y-%m', posting_date) as month_year FROM collections_data ORDER BY month_year")
-        collection_months = [row[0] for row in cursor.fetchall()]
-        
-        # Combine and sort all months
-        all_months = sorted(list(set(sales_months + collection_months)))
+        # Get distinct months from sales and collections data in one query
+        cursor.execute('''
+            SELECT sale_month as month_year FROM sales_data
+            UNION
+            SELECT posting_month FROM collections_data
+            ORDER BY month_year
+        ''')
+        all_months = [row[0] for row in cursor.fetchall()]
         
         # Format months for display
         formatted_months = []
@@ -481,13 +708,13 @@ def get_available_months():
                 except:
                     pass
         
-        db.close()
         return jsonify({'success': True, 'months': formatted_months, 'raw_months': all_months})
         
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
 
 # Helper functions for report generation
+@lru_cache(maxsize=256)
 def get_previous_month(month_year):
     """Get previous month in YYYY-MM format"""
     try:
@@ -500,89 +727,146 @@ def get_previous_month(month_year):
     except:
         return None
 
+# Days in each month of a non-leap year, for month_end_str
+_LAST_DAY = (31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+def split_month(month_year):
+    """(year, month) of a YYYY-MM month; raises ValueError for an invalid month"""
+    year, month = int(month_year[:4]), int(month_year[5:7])
+    if month_year[4:5] != '-' or not 1 <= month <= 12:
+        raise ValueError(f"invalid month '{month_year}'")
+    return year, month
+
+def prev_month_str(month_year):
+    """Month before a YYYY-MM month, as YYYY-MM (plain string arithmetic, no strptime)"""
+    year, month = split_month(month_year)
+    if month == 1:
+        return f'{year - 1:04d}-12'
+    return f'{year:04d}-{month - 1:02d}'
+
+def month_end_str(month_year):
+    """Last day of a YYYY-MM month, as YYYY-MM-DD"""
+    year, month = split_month(month_year)
+    last_day = _LAST_DAY[month - 1]
+    if month == 2 and year % 4 == 0 and (year % 100 != 0 or year % 400 == 0):
+        last_day = 29
+    return f'{year:04d}-{month:02d}-{last_day:02d}'
+
+@lru_cache(maxsize=1024)
+def month_start_of(date_str):
+    """First day (YYYY-MM-DD) of the month of a YYYY-MM-DD date; raises ValueError
+    for an invalid date like strptime does"""
+    return datetime.strptime(date_str, '%Y-%m-%d').strftime('%Y-%m-01')
+
+# Each month's opening needs the previous month's closing, which needs that
+# month's opening, and so on back. Closings are stored in monthly_dealer_balances,
+# shared by every worker process, so each month is only walked once; anything
+# that writes sales, collections or balance data calls clear_balance_caches().
+# Nothing is memoized in-process, where other workers' writes couldn't reach it.
 def calculate_month_closing_balances(month_year):
-    """Calculate closing balances for all dealers for a specific month"""
+    """Calculate closing balances for all dealers for a specific month
+    
+    Returns {dealer_code: (dealer_name, closing_balance)}.
+    """
     try:
-        db = SalesCollectionsDatabase(DB_PATH)
+        db = get_db()
         cursor = db.conn.cursor()
         
-        # Get opening balances for the month
-        opening_balances_map = get_opening_balances_with_auto_calculation(month_year)
-        
-        # Get total sales for the month
+        # Use the stored month-end balances when this month was already calculated
         cursor.execute('''
-            SELECT dealer_code, dealer_name, SUM(total_purchase_value) as total_sales
-            FROM sales_data 
-            WHERE strftime('%Y-%m', sale_date) = ?
-            GROUP BY dealer_code, dealer_name
+            SELECT dealer_code, dealer_name, closing
+            FROM monthly_dealer_balances
+            WHERE month_year = ?
         ''', (month_year,))
+        stored_balances = cursor.fetchall()
+        if stored_balances:
+            return {row[0]: (row[1], row[2]) for row in stored_balances}
         
-        sales_data = {f"{row[0]}_{row[1]}": row[2] for row in cursor.fetchall()}
-        
-        # Get total collections for the month
-        cursor.execute('''
-            SELECT dealer_code, dealer_name, SUM(amount) as total_collections
-            FROM collections_data 
-            WHERE strftime('%Y-%m', posting_date) = ?
-            GROUP BY dealer_code, dealer_name
-        ''', (month_year,))
+        # Note the database version before reading the month's data, so the
+        # closings are not stored if another connection (e.g. an upload in the
+        # other gunicorn worker) commits changes while they are calculated
+        data_version = cursor.execute("PRAGMA data_version").fetchone()[0]
         
-        collections_data = {f"{row[0]}_{row[1]}": row[2] for row in cursor.fetchall()}
+        # Get opening balances for the month
+        opening_balances_map = get_opening_balances_with_auto_calculation(month_year)
         
-        # Get credit notes for the month (reduces balance)
-        credits_data = {}
-        try:
-            cursor.execute('''
-                SELECT dealer_code, dealer_name, SUM(credit_discount) as total_credit
-                FROM credit_discounts 
-                WHERE month_year = ?
-                GROUP BY dealer_code, dealer_name
-            ''', (month_year,))
-            credits_data = {f"{row[0]}_{row[1]}": row[2] for row in cursor.fetchall()}
-        except:
-            pass
+        # Total sales, collections, credit notes and debit notes for the month in
+        # one grouped query, one row per dealer_code/dealer_name (the credit and
+        # debit note tables are optional)
+        movements = ['''
+            SELECT dealer_code, dealer_name, total_purchase_value AS sales, 0 AS collections, 0 AS credits, 0 AS debits
+            FROM sales_data WHERE sale_month = ?
+            UNION ALL
+            SELECT dealer_code, dealer_name, 0, amount, 0, 0
+            FROM collections_data WHERE posting_month = ?
+        ''']
+        params = [month_year, month_year]
+        if db.has_credit_discounts:
+            movements.append('''
+            SELECT dealer_code, dealer_name, 0, 0, credit_discount, 0
+            FROM credit_discounts WHERE month_year = ?
+        ''')
+            params.append(month_year)
+        if db.has_debit_notes:
+            movements.append('''
+            SELECT dealer_code, dealer_name, 0, 0, 0, debit_amount
+            FROM debit_notes WHERE month_year = ?
+        ''')
+            params.append(month_year)
+        cursor.execute(f'''
+            SELECT dealer_code, dealer_name, SUM(sales), SUM(collections), SUM(credits), SUM(debits)
+            FROM ({'UNION ALL'.join(movements)})
+            GROUP BY dealer_code, dealer_name
+        ''', params)
         
-        # Get debit notes for the month (increases balance)
-        debits_data = {}
-        try:
-            cursor.execute('''
-                SELECT dealer_code, dealer_name, SUM(debit_amount) as total_debit
-                FROM debit_notes 
-                WHERE month_year = ?
-                GROUP BY dealer_code, dealer_name
-            ''', (month_year,))
-            debits_data = {f"{row[0]}_{row[1]}": row[2] for row in cursor.fetchall()}
-        except:
-            pass
+        month_totals = {(row[0], row[1]): row[2:] for row in cursor.fetchall()}
         
         # Calculate closing balances = opening + sales - collections - credits + debits
         closing_balances = {}
-        for dealer_key, opening_balance in opening_balances_map.items():
-            sales = sales_data.get(dealer_key, 0)
-            collections = collections_data.get(dealer_key, 0)
-            credits = credits_data.get(dealer_key, 0)
-            debits = debits_data.get(dealer_key, 0)
-            closing = opening_balance + sales - collections - credits + debits
-            closing_balances[dealer_key] = round(closing, 2)
-        
-        db.close()
+        month_rows = []
+        for dealer_code, (dealer_name, opening_balance) in opening_balances_map.items():
+            sales, collections, credits, debits = month_totals.get((dealer_code, dealer_name), (0, 0, 0, 0))
+            closing = round(opening_balance + sales - collections - credits + debits, 2)
+            closing_balances[dealer_code] = (dealer_name, closing)
+            month_rows.append((month_year, dealer_code, dealer_name, opening_balance, sales, collections,
+                               credits, debits, closing))
+        
+        # Storing the month is only an optimization: if the write fails (e.g. the
+        # database is locked) or the data changed since it was read, the balances
+        # are still returned, and the month is simply calculated again next time.
+        # The version is checked under the write lock so no commit can slip in
+        # between the check and the store.
+        if db.conn.in_transaction:
+            return closing_balances
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            if cursor.execute("PRAGMA data_version").fetchone()[0] == data_version:
+                cursor.executemany('''
+                    INSERT OR REPLACE INTO monthly_dealer_balances
+                    (month_year, dealer_code, dealer_name, opening, sales, collections, credits, debits, closing)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', month_rows)
+            db.conn.commit()
+        except sqlite3.Error as e:
+            db.conn.rollback()
+            print(f"Warning: closing balances for {month_year} not stored: {e}")
+        
         return closing_balances
         
     except Exception as e:
         return {}
 
 def get_opening_balances_with_auto_calculation(month_year):
-    """Get opening balances with auto-calculation from previous month's closing balances"""
+    """Get opening balances with auto-calculation from previous month's closing balances
+    
+    Returns {dealer_code: (dealer_name, opening_balance)}.
+    """
     try:
-        from dateutil.relativedelta import relativedelta
-        
-        db = SalesCollectionsDatabase(DB_PATH)
+        db = get_db()
         cursor = db.conn.cursor()
         
         # Calculate previous month
-        current_month_dt = datetime.strptime(month_year + '-01', '%Y-%m-%d')
-        prev_month_dt = current_month_dt - relativedelta(months=1)
-        prev_month_year = prev_month_dt.strftime('%Y-%m')
+        prev_month_year = prev_month_str(month_year)
         
         # First, get manual opening balances for this month
         cursor.execute('''
@@ -594,136 +878,112 @@ def get_opening_balances_with_auto_calculation(month_year):
         manual_balances = {}
         has_manual_balances = False
         for row in cursor.fetchall():
-            key = f"{row[0]}_{row[1]}"
+            key = (row[0], row[1])
             manual_balances[key] = round(row[2], 2)
             has_manual_balances = True
         
-        # Get all dealers who have transactions in this month OR previous month
+        # All dealers who have transactions in this month OR previous month
         # Group by dealer_code only to avoid duplicates from name variations
-        cursor.execute('''
+        # (one pass over each table, matching both months at once)
+        dealers_sql = '''
             SELECT dealer_code, MAX(dealer_name) as dealer_name FROM (
-                SELECT dealer_code, dealer_name FROM sales_data WHERE strftime('%Y-%m', sale_date) = ?
-                UNION
-                SELECT dealer_code, dealer_name FROM collections_data WHERE strftime('%Y-%m', posting_date) = ?
+                SELECT dealer_code, dealer_name FROM sales_data WHERE sale_month IN (?, ?)
                 UNION
-                SELECT dealer_code, dealer_name FROM sales_data WHERE strftime('%Y-%m', sale_date) = ?
-                UNION
-                SELECT dealer_code, dealer_name FROM collections_data WHERE strftime('%Y-%m', posting_date) = ?
+                SELECT dealer_code, dealer_name FROM collections_data WHERE posting_month IN (?, ?)
                 UNION
                 SELECT dealer_code, dealer_name FROM opening_balances WHERE month_year = ?
             )
             GROUP BY dealer_code
-        ''', (month_year, month_year, prev_month_year, prev_month_year, prev_month_year))
-        
-        all_dealers = cursor.fetchall()
+        '''
+        dealers_params = [month_year, prev_month_year, month_year, prev_month_year, prev_month_year]
         
         # For dealers without manual opening balances, calculate from previous month's closing
         result_balances = {}
         
         # If no manual balances for current month, calculate previous month's closing for all dealers
         if not has_manual_balances:
-            # Get previous month's opening balances (use dealer_code only)
-            cursor.execute('''
-                SELECT dealer_code, MAX(opening_balance) as opening_balance 
-                FROM opening_balances 
-                WHERE month_year = ?
-                GROUP BY dealer_code
-            ''', (prev_month_year,))
-            
-            prev_opening = {}
-            for row in cursor.fetchall():
-                prev_opening[str(row[0])] = row[1] or 0
-            
-            # Get previous month's sales (group by dealer_code only)
-            cursor.execute('''
-                SELECT dealer_code, SUM(total_purchase_value) as total_sales
-                FROM sales_data 
-                WHERE strftime('%Y-%m', sale_date) = ?
-                GROUP BY dealer_code
-            ''', (prev_month_year,))
-            
-            prev_sales = {}
-            for row in cursor.fetchall():
-                prev_sales[str(row[0])] = row[1] or 0
-            
-            # Get previous month's collections (group by dealer_code only)
-            cursor.execute('''
-                SELECT dealer_code, SUM(amount) as total_collections
-                FROM collections_data 
-                WHERE strftime('%Y-%m', posting_date) = ?
-                GROUP BY dealer_code
-            ''', (prev_month_year,))
-            
-            prev_collections = {}
-            for row in cursor.fetchall():
-                prev_collections[str(row[0])] = row[1] or 0
-            
-            # Get previous month's credit notes (reduces balance, group by dealer_code only)
-            prev_credits = {}
-            try:
-                cursor.execute('''
-                    SELECT dealer_code, SUM(credit_discount) as total_credit
-                    FROM credit_discounts 
-                    WHERE month_year = ?
-                    GROUP BY dealer_code
-                ''', (prev_month_year,))
-                for row in cursor.fetchall():
-                    prev_credits[str(row[0])] = row[1] or 0
-            except:
-                pass
-            
-            # Get previous month's debit notes (increases balance, group by dealer_code only)
-            prev_debits = {}
-            try:
-                cursor.execute('''
-                    SELECT dealer_code, SUM(debit_amount) as total_debit
-                    FROM debit_notes 
-                    WHERE month_year = ?
-                    GROUP BY dealer_code
-                ''', (prev_month_year,))
-                for row in cursor.fetchall():
-                    prev_debits[str(row[0])] = row[1] or 0
-            except:
-                pass
+            # Previous month's opening, sales, collections, credit notes and debit
+            # notes per dealer_code, joined to the dealers and combined in one query:
+            # closing = opening + sales - collections - credits + debits
+            totals = {
+                'prev_opening': '''
+                SELECT dealer_code, MAX(opening_balance) AS total
+                FROM opening_balances WHERE month_year = ? GROUP BY dealer_code''',
+                'prev_sales': '''
+                SELECT dealer_code, SUM(total_purchase_value) AS total
+                FROM sales_data WHERE sale_month = ? GROUP BY dealer_code''',
+                'prev_collections': '''
+                SELECT dealer_code, SUM(amount) AS total
+                FROM collections_data WHERE posting_month = ? GROUP BY dealer_code''',
+                'prev_credits': '''
+                SELECT dealer_code, SUM(credit_discount) AS total
+                FROM credit_discounts WHERE month_year = ? GROUP BY dealer_code''',
+                'prev_debits': '''
+                SELECT dealer_code, SUM(debit_amount) AS total
+                FROM debit_notes WHERE month_year = ? GROUP BY dealer_code''',
+            }
+            if not db.has_credit_discounts:
+                totals['prev_credits'] = 'SELECT NULL AS dealer_code, NULL AS total WHERE 0'
+            if not db.has_debit_notes:
+                totals['prev_debits'] = 'SELECT NULL AS dealer_code, NULL AS total WHERE 0'
+            ctes = ',\n'.join(f'{name} AS ({sql})' for name, sql in totals.items())
+            params = dealers_params + [prev_month_year] * sum('?' in sql for sql in totals.values())
             
-            # Calculate previous month closing = opening + sales - collections - credits + debits
-            for dealer_code, dealer_name in all_dealers:
-                key = f"{dealer_code}_{dealer_name}"
-                dealer_code_str = str(dealer_code)
-                opening = prev_opening.get(dealer_code_str, 0)
-                sales = prev_sales.get(dealer_code_str, 0)
-                collections = prev_collections.get(dealer_code_str, 0)
-                credits = prev_credits.get(dealer_code_str, 0)
-                debits = prev_debits.get(dealer_code_str, 0)
-                closing = opening + sales - collections - credits + debits
-                result_balances[key] = round(closing, 2)
+            cursor.execute(f'''
+                WITH dealers AS ({dealers_sql}),
+                {ctes}
+                SELECT d.dealer_code, d.dealer_name,
+                       COALESCE(o.total, 0) + COALESCE(s.total, 0) - COALESCE(c.total, 0)
+                       - COALESCE(cr.total, 0) + COALESCE(dn.total, 0)
+                FROM dealers d
+                LEFT JOIN prev_opening o ON o.dealer_code = d.dealer_code
+                LEFT JOIN prev_sales s ON s.dealer_code = d.dealer_code
+                LEFT JOIN prev_collections c ON c.dealer_code = d.dealer_code
+                LEFT JOIN prev_credits cr ON cr.dealer_code = d.dealer_code
+                LEFT JOIN prev_debits dn ON dn.dealer_code = d.dealer_code
+                ORDER BY d.dealer_code
+            ''', params)
+            
+            for dealer_code, dealer_name, closing in cursor.fetchall():
+                result_balances[dealer_code] = (dealer_name, round(closing, 2))
         else:
             # Use manual balances and calculate for missing dealers
+            cursor.execute(dealers_sql, dealers_params)
+            dealers = cursor.fetchall()
+            
+            # Only walk back through the previous months' closings when some dealer
+            # has no manual opening balance
             previous_month = get_previous_month(month_year)
-            if previous_month:
+            if previous_month and any(dealer not in manual_balances for dealer in dealers):
                 previous_closing = calculate_month_closing_balances(previous_month)
             else:
                 previous_closing = {}
             
-            for dealer_code, dealer_name in all_dealers:
-                key = f"{dealer_code}_{dealer_name}"
+            for dealer_code, dealer_name in dealers:
+                key = (dealer_code, dealer_name)
+                previous_name, previous_balance = previous_closing.get(dealer_code, (None, 0))
                 
                 if key in manual_balances:
                     # Use manual opening balance
-                    result_balances[key] = round(manual_balances[key], 2)
-                elif key in previous_closing:
+                    result_balances[dealer_code] = (dealer_name, round(manual_balances[key], 2))
+                elif previous_name == dealer_name:
                     # Use previous month's closing balance
-                    result_balances[key] = round(previous_closing.get(key, 0), 2)
+                    result_balances[dealer_code] = (dealer_name, round(previous_balance, 2))
                 else:
                     # Default to 0
-                    result_balances[key] = 0.0
+                    result_balances[dealer_code] = (dealer_name, 0.0)
         
-        db.close()
         return result_balances
         
     except Exception as e:
         return {}
 
+def clear_balance_caches():
+    """Forget the stored month closing balances after the underlying data changed"""
+    db = get_db()
+    db.clear_monthly_dealer_balances()
+    db.conn.commit()
+
 @app.route('/get_report', methods=['POST'])
 def get_report():
     """Generate report for selected date"""
@@ -734,199 +994,128 @@ def get_report():
         if not selected_date:
             return jsonify({'success': False, 'message': 'Date is required'})
         
-        db = SalesCollectionsDatabase(DB_PATH)
-        cursor = db.conn.cursor()
-        
         # Extract month-year for opening balances
         month_year = selected_date[:7]  # YYYY-MM format
         
-        # Get sales data for the selected date, grouped by dealer_code
-        cursor.execute('''
-            SELECT dealer_code, MAX(dealer_name) as dealer_name, 
-                   SUM(ppc_quantity) as ppc_quantity, 
-                   SUM(premium_quantity) as premium_quantity, 
-                   SUM(opc_quantity) as opc_quantity, 
-                   SUM(total_quantity) as total_quantity, 
-                   SUM(ppc_purchase_value) as ppc_purchase_value, 
-                   SUM(premium_purchase_value) as premium_purchase_value, 
-                   SUM(opc_purchase_value) as opc_purchase_value, 
-                   SUM(total_purchase_value) as total_purchase_value
+        # Calculate month start date for cumulative sales (1st day of selected month)
+        month_start = month_start_of(selected_date)
+        dates = {'day': selected_date, 'month_start': month_start}
+        
+        # The month-to-date sales and collections and the month's credit and debit
+        # notes don't depend on each other, so they run on query_pool while this
+        # thread works out the opening balances
+        
+        # Sales from 1st of month to selected date per dealer_code, with the selected
+        # date's own name, sums and grand total alongside, in one scan of the month
+        day_sums = ',\n'.join(f'SUM(CASE WHEN sale_date = :day THEN {column} END)' for column in REPORT_SALES_COLUMNS)
+        month_sums = ',\n'.join(f'SUM({column})' for column in REPORT_SALES_COLUMNS)
+        sales_query = query_pool.submit(fetch_all, f'''
+            SELECT dealer_code, MAX(dealer_name) AS dealer_name, COUNT(CASE WHEN sale_date = :day THEN 1 END),
+                   MAX(CASE WHEN sale_date = :day THEN dealer_name END),
+                   {day_sums},
+                   {month_sums},
+                   SUM(SUM(CASE WHEN sale_date = :day THEN total_purchase_value END)) OVER ()
             FROM sales_data 
-            WHERE sale_date = ?
+            WHERE sale_date >= :month_start AND sale_date <= :day
             GROUP BY dealer_code
             ORDER BY dealer_name
-        ''', (selected_date,))
-        
-        sales_results = cursor.fetchall()
-        sales = []
-        total_sales = 0
-        
-        for row in sales_results:
-            sale_data = {
-                'dealer_code': row[0],
-                'dealer_name': row[1],
-                'ppc_quantity': row[2] or 0,
-                'premium_quantity': row[3] or 0,
-                'opc_quantity': row[4] or 0,
-                'total_quantity': row[5] or 0,
-                'ppc_purchase_value': row[6] or 0,
-                'premium_purchase_value': row[7] or 0,
-                'opc_purchase_value': row[8] or 0,
-                'total_purchase_value': row[9] or 0
-            }
-            sales.append(sale_data)
-            total_sales += sale_data['total_purchase_value']
-        
-        # Get collections data for the selected date, grouped by dealer_code
-        cursor.execute('''
-            SELECT dealer_code, MAX(dealer_name) as dealer_name, SUM(amount) as amount
+        ''', dates)
+        
+        # Collections from 1st of month to selected date per dealer_code, with the
+        # selected date's own name, amount and grand total alongside
+        collections_query = query_pool.submit(fetch_all, '''
+            SELECT dealer_code, MAX(dealer_name) AS dealer_name, COUNT(CASE WHEN posting_date = :day THEN 1 END),
+                   MAX(CASE WHEN posting_date = :day THEN dealer_name END),
+                   SUM(CASE WHEN posting_date = :day THEN amount END), SUM(amount),
+                   SUM(SUM(CASE WHEN posting_date = :day THEN amount END)) OVER ()
             FROM collections_data 
-            WHERE posting_date = ?
+            WHERE posting_date >= :month_start AND posting_date <= :day
             GROUP BY dealer_code
             ORDER BY dealer_name
-        ''', (selected_date,))
-        
-        collections_results = cursor.fetchall()
-        collections = []
-        total_collections = 0
+        ''', dates)
         
-        for row in collections_results:
-            collection_data = {
-                'dealer_code': row[0],
-                'dealer_name': row[1],
-                'amount': row[2] or 0
-            }
-            collections.append(collection_data)
-            total_collections += collection_data['amount']
-        
-        # Calculate month start date for cumulative sales (1st day of selected month)
-        date_obj = datetime.strptime(selected_date, '%Y-%m-%d')
-        month_start = date_obj.replace(day=1).strftime('%Y-%m-%d')
+        # Credit and debit notes for the month (cumulative); the tables are optional
+        db = get_db()
+        credit_notes_query = debit_notes_query = None
+        if db.has_credit_discounts:
+            credit_notes_query = query_pool.submit(fetch_all, '''
+                SELECT dealer_code, credit_discount
+                FROM credit_discounts
+                WHERE month_year = ?
+            ''', (month_year,))
+        if db.has_debit_notes:
+            debit_notes_query = query_pool.submit(fetch_all, '''
+                SELECT dealer_code, debit_amount
+                FROM debit_notes
+                WHERE month_year = ?
+            ''', (month_year,))
         
-        # Get cumulative sales from 1st of month to selected date
-        cursor.execute('''
-            SELECT dealer_code, dealer_name, 
-                   SUM(ppc_quantity) as ppc_quantity, 
-                   SUM(premium_quantity) as premium_quantity, 
-                   SUM(opc_quantity) as opc_quantity, 
-                   SUM(total_quantity) as total_quantity,
-                   SUM(ppc_purchase_value) as ppc_purchase_value,
-                   SUM(premium_purchase_value) as premium_purchase_value,
-                   SUM(opc_purchase_value) as opc_purchase_value,
-                   SUM(total_purchase_value) as total_purchase_value
-            FROM sales_data 
-            WHERE sale_date >= ? AND sale_date <= ?
-            GROUP BY dealer_code, dealer_name
-            ORDER BY dealer_name
-        ''', (month_start, selected_date))
+        # Get opening balances with auto-calculation
+        opening_balances_map = get_opening_balances_with_auto_calculation(month_year)
         
-        cumulative_sales_results = cursor.fetchall()
+        # The last column is the selected date's grand total, repeated on every row
         cumulative_sales = []
+        sales = []
+        total_sales = 0
+        column_count = len(REPORT_SALES_COLUMNS)
+        for row in sales_query.result():
+            dealer_code, dealer_name, day_rows, day_name = row[:4]
+            day_values = [value or 0 for value in row[4:4 + column_count]]
+            month_values = [value or 0 for value in row[4 + column_count:-1]]
+            total_sales = row[-1] or 0
+            cumulative_sales.append({'dealer_code': dealer_code, 'dealer_name': dealer_name,
+                                     **dict(zip(REPORT_SALES_COLUMNS, month_values))})
+            if day_rows:
+                sales.append({'dealer_code': dealer_code, 'dealer_name': day_name,
+                              **dict(zip(REPORT_SALES_COLUMNS, day_values))})
+        sales.sort(key=lambda sale: sale['dealer_name'])
         
-        for row in cumulative_sales_results:
-            cumulative_sales.append({
-                'dealer_code': row[0],
-                'dealer_name': row[1],
-                'ppc_quantity': row[2] or 0,
-                'premium_quantity': row[3] or 0,
-                'opc_quantity': row[4] or 0,
-                'total_quantity': row[5] or 0,
-                'ppc_purchase_value': row[6] or 0,
-                'premium_purchase_value': row[7] or 0,
-                'opc_purchase_value': row[8] or 0,
-                'total_purchase_value': row[9] or 0
-            })
-        
-        # Get cumulative collections from 1st of month to selected date
-        cursor.execute('''
-            SELECT dealer_code, dealer_name, SUM(amount) as total_amount
-            FROM collections_data 
-            WHERE posting_date >= ? AND posting_date <= ?
-            GROUP BY dealer_code, dealer_name
-            ORDER BY dealer_name
-        ''', (month_start, selected_date))
-        
-        cumulative_collections_results = cursor.fetchall()
         cumulative_collections = []
-        
-        for row in cumulative_collections_results:
+        collections = []
+        total_collections = 0
+        for dealer_code, dealer_name, day_rows, day_name, day_amount, month_amount, day_total in collections_query.result():
+            total_collections = day_total or 0
             cumulative_collections.append({
-                'dealer_code': row[0],
-                'dealer_name': row[1],
-                'total_amount': row[2] or 0
+                'dealer_code': dealer_code,
+                'dealer_name': dealer_name,
+                'total_amount': month_amount or 0
             })
-        
-        # Get opening balances with auto-calculation
-        opening_balances_map = get_opening_balances_with_auto_calculation(month_year)
-        opening_balances = []
+            if day_rows:
+                collections.append({'dealer_code': dealer_code, 'dealer_name': day_name,
+                                    'amount': day_amount or 0})
+        collections.sort(key=lambda collection: collection['dealer_name'])
         
         # Get all unique dealers from current month AND previous month
-        # Use dealer_code as primary key to avoid duplicates from name variations
+        # Use dealer_code as primary key to avoid duplicates from name variations;
+        # the first name seen for a code is kept
         dealers_dict = {}
-        for sale in sales + cumulative_sales:
-            dealer_code = str(sale['dealer_code'])
-            if dealer_code not in dealers_dict:
-                dealers_dict[dealer_code] = sale['dealer_name']
-        for collection in collections + cumulative_collections:
-            dealer_code = str(collection['dealer_code'])
-            if dealer_code not in dealers_dict:
-                dealers_dict[dealer_code] = collection['dealer_name']
+        for rows in (sales, cumulative_sales, collections, cumulative_collections):
+            for row in rows:
+                dealers_dict.setdefault(row['dealer_code'], row['dealer_name'])
         
         # Also include dealers from opening_balances_map (includes previous month dealers)
-        for key in opening_balances_map.keys():
-            parts = key.split('_', 1)
-            if len(parts) == 2:
-                dealer_code = str(parts[0])
-                if dealer_code not in dealers_dict:
-                    dealers_dict[dealer_code] = parts[1]
-        
-        # For each dealer_code, try all possible name variants to find opening balance
-        for dealer_code, primary_name in dealers_dict.items():
-            # Try to find opening balance with any name variant for this dealer_code
-            opening_balance = 0
-            found = False
-            for key in opening_balances_map.keys():
-                if key.startswith(f"{dealer_code}_"):
-                    opening_balance = opening_balances_map[key]
-                    found = True
-                    break
-            
-            if not found:
-                opening_balance = opening_balances_map.get(f"{dealer_code}_{primary_name}", 0)
-            
-            opening_balances.append({
+        for dealer_code, (name, balance) in opening_balances_map.items():
+            dealers_dict.setdefault(dealer_code, name)
+        
+        # Opening balance for each dealer_code, whichever name variant it was stored under
+        opening_balances = [
+            {
                 'dealer_code': dealer_code,
                 'dealer_name': primary_name,
-                'opening_balance': round(opening_balance, 2)
-            })
+                'opening_balance': round(opening_balances_map.get(dealer_code, (None, 0))[1], 2)
+            }
+            for dealer_code, primary_name in dealers_dict.items()
+        ]
         
-        # Get credit notes for the month (cumulative)
         credit_notes = {}
-        try:
-            cursor.execute('''
-                SELECT dealer_code, credit_discount
-                FROM credit_discounts
-                WHERE month_year = ?
-            ''', (month_year,))
-            for row in cursor.fetchall():
-                credit_notes[str(row[0])] = row[1] or 0
-        except:
-            pass
+        if credit_notes_query:
+            for row in credit_notes_query.result():
+                credit_notes[row[0]] = row[1] or 0
         
-        # Get debit notes for the month (cumulative)
         debit_notes = {}
-        try:
-            cursor.execute('''
-                SELECT dealer_code, debit_amount
-                FROM debit_notes
-                WHERE month_year = ?
-            ''', (month_year,))
-            for row in cursor.fetchall():
-                debit_notes[str(row[0])] = row[1] or 0
-        except:
-            pass
-        
-        db.close()
+        if debit_notes_query:
+            for row in debit_notes_query.result():
+                debit_notes[row[0]] = row[1] or 0
         
         return jsonify({
             'success': True,
@@ -946,13 +1135,30 @@ def get_report():
         return jsonify({'success': False, 'message': str(e)})
 
 # Import WhatsApp message generator functions
-from whatsapp_message_generator import generate_whatsapp_message, get_dealer_billing_data
+from whatsapp_message_generator import generate_whatsapp_message, get_dealer_billing_data, format_date_indian
 
 @app.route('/whatsapp_generator')
 def whatsapp_generator():
     """WhatsApp message generator page"""
     return render_template('whatsapp_generator.html')
 
+# Lookups behind the WhatsApp generator's dealer and truck pickers, kept as
+# constants so the connection's statement cache reuses their prepared plans
+DEALERS_FOR_DATE_SQL = '''
+    SELECT DISTINCT dealer_code, dealer_name, COUNT(*) as invoice_count
+    FROM sales_data 
+    WHERE sale_date = ?
+    GROUP BY dealer_code, dealer_name
+    ORDER BY dealer_name
+'''
+
+TRUCK_NUMBERS_SQL = '''
+    SELECT invoice_number, truck_number
+    FROM sales_data 
+    WHERE dealer_code = ? AND sale_date = ?
+    ORDER BY invoice_number
+'''
+
 @app.route('/get_dealers_for_date', methods=['POST'])
 def get_dealers_for_date():
     """Get list of dealers who had billing on a specific date"""
@@ -963,27 +1169,14 @@ def get_dealers_for_date():
         if not selected_date:
             return jsonify({'success': False, 'message': 'Date is required'})
         
-        db = SalesCollectionsDatabase(DB_PATH)
+        db = get_db()
         cursor = db.conn.cursor()
         
         # Get dealers who had sales on the selected date
-        cursor.execute('''
-            SELECT DISTINCT dealer_code, dealer_name, COUNT(*) as invoice_count
-            FROM sales_data 
-            WHERE sale_date = ?
-            GROUP BY dealer_code, dealer_name
-            ORDER BY dealer_name
-        ''', (selected_date,))
-        
-        dealers = []
-        for row in cursor.fetchall():
-            dealers.append({
-                'dealer_code': row[0],
-                'dealer_name': row[1],
-                'invoice_count': row[2]
-            })
-        
-        db.close()
+        dealers = [
+            {'dealer_code': dealer_code, 'dealer_name': dealer_name, 'invoice_count': invoice_count}
+            for dealer_code, dealer_name, invoice_count in cursor.execute(DEALERS_FOR_DATE_SQL, (selected_date,))
+        ]
         
         return jsonify({
             'success': True,
@@ -1006,25 +1199,13 @@ def get_truck_numbers_api():
             return jsonify({'success': False, 'message': 'Missing dealer_code or billing_date'})
         
         # Get truck numbers from database
-        db = SalesCollectionsDatabase(DB_PATH)
+        db = get_db()
         cursor = db.conn.cursor()
         
-        cursor.execute('''
-            SELECT invoice_number, truck_number
-            FROM sales_data 
-            WHERE dealer_code = ? AND sale_date = ?
-            ORDER BY invoice_number
-        ''', (int(dealer_code), billing_date))
-        
-        results = cursor.fetchall()
-        db.close()
-        
-        truck_numbers = []
-        for invoice_number, truck_number in results:
-            truck_numbers.append({
-                'invoice_number': invoice_number,
-                'truck_number': truck_number if truck_number else ''
-            })
+        truck_numbers = [
+            {'invoice_number': invoice_number, 'truck_number': truck_number if truck_number else ''}
+            for invoice_number, truck_number in cursor.execute(TRUCK_NUMBERS_SQL, (int(dealer_code), billing_date))
+        ]
         
         return jsonify({'success': True, 'truck_numbers': truck_numbers})
         
@@ -1096,47 +1277,49 @@ def process_ageing_report():
         if missing_columns:
             return jsonify({'success': False, 'message': f'Missing required columns: {", ".join(missing_columns)}'})
         
-        # Process each customer and calculate payment due today
-        reminders = []
-        
-        for index, row in df.iterrows():
-            try:
-                customer_code = str(row['Customer'])
-                customer_name = str(row['Cust.Name'])
-                outstanding_amt = float(row['Outstanding Amt.']) if pd.notna(row['Outstanding Amt.']) else 0.0
-                spl_gl_balance = float(row['SPL GL "Y" Balance']) if pd.notna(row['SPL GL "Y" Balance']) else 0.0
-                t1 = float(row['T1']) if pd.notna(row['T1']) else 0.0
-                
-                # Calculate total outstanding and payment due today
-                total_outstanding = outstanding_amt + spl_gl_balance
-                payment_due_today = outstanding_amt + spl_gl_balance - t1
-                
-                # Round to ceil of nearest 10
-                import math
-                total_outstanding_rounded = math.ceil(total_outstanding / 10) * 10
-                payment_due_today_rounded = math.ceil(payment_due_today / 10) * 10
-                
-                # Only include customers with payment due today > 0
-                if payment_due_today > 0.01:  # Small threshold to avoid floating point issues
-                    # Generate WhatsApp message
-                    message = f"""*PAYMENT REMINDER*
+        # Amounts as floats, with empty cells as 0; rows with a value that isn't a
+        # number are skipped
+        amounts = {}
+        valid = pd.Series(True, index=df.index)
+        for key, column in [('outstanding_amt', 'Outstanding Amt.'), ('spl_gl_balance', 'SPL GL "Y" Balance'), ('t1', 'T1')]:
+            values = pd.to_numeric(df[column], errors='coerce')
+            valid &= values.notna() | df[column].isna()
+            amounts[key] = values.fillna(0.0).astype('float64')
+        
+        # Calculate total outstanding and payment due today for every customer
+        total_outstanding = amounts['outstanding_amt'] + amounts['spl_gl_balance']
+        payment_due_today = amounts['outstanding_amt'] + amounts['spl_gl_balance'] - amounts['t1']
+        valid &= np.isfinite(total_outstanding) & np.isfinite(payment_due_today)
+        
+        # Only include customers with payment due today > 0
+        due = valid & (payment_due_today > 0.01)  # Small threshold to avoid floating point issues
+        
+        # Round to ceil of nearest 10
+        total_outstanding_rounded = (np.ceil(total_outstanding[due] / 10) * 10).astype('int64')
+        payment_due_today_rounded = (np.ceil(payment_due_today[due] / 10) * 10).astype('int64')
+        
+        # Generate WhatsApp messages
+        reminders = [
+            {
+                'customer_code': customer_code,
+                'customer_name': customer_name,
+                'outstanding_amt': outstanding_amt,
+                'spl_gl_balance': spl_gl_balance,
+                't1': t1,
+                'total_outstanding': total,
+                'payment_due_today': payment_due,
+                'message': f"""*PAYMENT REMINDER*
 
-Total Outstanding: Rs. {total_outstanding_rounded:,.0f}
-*Payment Due Today: Rs. {payment_due_today_rounded:,.0f}*"""
-                    
-                    reminders.append({
-                        'customer_code': customer_code,
-                        'customer_name': customer_name,
-                        'outstanding_amt': outstanding_amt,
-                        'spl_gl_balance': spl_gl_balance,
-                        't1': t1,
-                        'total_outstanding': total_outstanding,
-                        'payment_due_today': payment_due_today,
-                        'message': message
-                    })
-            except Exception as e:
-                # Skip rows with errors
-                continue
+Total Outstanding: Rs. {total_rounded:,.0f}
+*Payment Due Today: Rs. {payment_due_rounded:,.0f}*"""
+            }
+            for customer_code, customer_name, outstanding_amt, spl_gl_balance, t1, total, payment_due,
+                total_rounded, payment_due_rounded in zip(
+                df['Customer'][due].astype(str), df['Cust.Name'][due].astype(str),
+                amounts['outstanding_amt'][due].tolist(), amounts['spl_gl_balance'][due].tolist(),
+                amounts['t1'][due].tolist(), total_outstanding[due].tolist(), payment_due_today[due].tolist(),
+                total_outstanding_rounded.tolist(), payment_due_today_rounded.tolist())
+        ]
         
         # Sort by payment due today (descending)
         reminders.sort(key=lambda x: x['payment_due_today'], reverse=True)
@@ -1163,7 +1346,7 @@ def get_dealers_for_unloading_date():
         if not selected_date:
             return jsonify({'success': False, 'message': 'Date is required'})
         
-        db = SalesCollectionsDatabase(DB_PATH)
+        db = get_db()
         cursor = db.conn.cursor()
         
         # Get dealers who had unloading on the selected date, grouped by dealer_code
@@ -1192,8 +1375,6 @@ def get_dealers_for_unloading_date():
                 'total_opc': row[6] or 0
             })
         
-        db.close()
-        
         return jsonify({
             'success': True,
             'dealers': dealers,
@@ -1203,6 +1384,34 @@ def get_dealers_for_unloading_date():
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
 
+# One truck's block in the unloading message; {bags} is the optional bag
+# breakdown line (with its leading newline) and the trailing newline leaves a
+# blank line before the next block
+UNLOADING_TRUCK_FMT = "🚛 Truck: *{truck}*\n   📍 Point: {point}{bags}\n   📊 Total: *{total} bags*\n"
+
+# Product order of every (ppc, premium, opc) triple in the message
+PRODUCT_NAMES = ('PPC', 'Premium', 'OPC')
+
+def bag_parts(bags):
+    """'Name: count' for each non-zero product of a (ppc, premium, opc) bag triple"""
+    return [f"{name}: {count}" for name, count in zip(PRODUCT_NAMES, bags) if count]
+
+def balance_bag_parts(bags):
+    """Like bag_parts, with the count unsigned and marked Advance (positive) or Pending"""
+    return [f"{name}: {abs(count)} {'Advance' if count > 0 else 'Pending'}"
+            for name, count in zip(PRODUCT_NAMES, bags) if count]
+
+def format_truck_block(record, bags):
+    """Format one (truck_number, unloading_point, ...) row with its
+    (ppc, premium, opc, total) bag counts as an UNLOADING_TRUCK_FMT block"""
+    parts = [f"{name}: {count}" for name, count in zip(PRODUCT_NAMES, bags) if count > 0]
+    return UNLOADING_TRUCK_FMT.format(
+        truck=record[0],
+        point=record[1] or '-',
+        bags=f"\n   🎒 {', '.join(parts)}" if parts else '',
+        total=bags[3]
+    )
+
 @app.route('/generate_unloading_whatsapp_message', methods=['POST'])
 def generate_unloading_whatsapp_message():
     """Generate WhatsApp message for unloading details of a dealer on a specific date"""
@@ -1214,22 +1423,15 @@ def generate_unloading_whatsapp_message():
         if not dealer_code or not unloading_date:
             return jsonify({'success': False, 'message': 'Dealer code and date are required'})
         
-        db = SalesCollectionsDatabase(DB_PATH)
+        db = get_db()
         cursor = db.conn.cursor()
         
-        # Get dealer name
-        cursor.execute('''
-            SELECT DISTINCT unloading_dealer 
-            FROM vehicle_unloading 
-            WHERE dealer_code = ? AND unloading_date = ?
-        ''', (dealer_code, unloading_date))
-        dealer_row = cursor.fetchone()
-        dealer_name = dealer_row[0] if dealer_row else 'Unknown Dealer'
-        
-        # Get all unloading records for this dealer on this date
+        # Get all unloading records for this dealer on this date, each carrying the
+        # dealer name of the first record entered
         cursor.execute('''
             SELECT truck_number, unloading_point, 
-                   ppc_unloaded, premium_unloaded, opc_unloaded, unloaded_quantity
+                   ppc_unloaded, premium_unloaded, opc_unloaded, unloaded_quantity,
+                   FIRST_VALUE(unloading_dealer) OVER (ORDER BY id)
             FROM vehicle_unloading 
             WHERE dealer_code = ? AND unloading_date = ?
             ORDER BY truck_number
@@ -1238,9 +1440,10 @@ def generate_unloading_whatsapp_message():
         unloading_records = cursor.fetchall()
         
         if not unloading_records:
-            db.close()
             return jsonify({'success': False, 'message': 'No unloading records found for this dealer on this date'})
         
+        dealer_name = unloading_records[0][6]
+        
         # Get billing for this dealer on this date
         cursor.execute('''
             SELECT truck_number, invoice_number, 
@@ -1255,174 +1458,72 @@ def generate_unloading_whatsapp_message():
         # Get opening balance for this dealer on this date
         opening = get_dealer_opening_balance(cursor, dealer_name, unloading_date, is_other_dealer=False, dealer_code=dealer_code)
         
-        # Calculate total billed today
-        total_ppc_billed = 0
-        total_premium_billed = 0
-        total_opc_billed = 0
+        # Quantities as (rows x [ppc, premium, opc, total]) arrays with NULL as 0;
+        # a column sum over axis 0 adds the rows in order, like the running totals did
+        billed = np.nan_to_num(np.array([record[2:6] for record in billing_records], dtype=np.float64).reshape(-1, 4))
+        unloaded = np.nan_to_num(np.array([record[2:6] for record in unloading_records], dtype=np.float64).reshape(-1, 4))
         
-        for record in billing_records:
-            total_ppc_billed += record[2] or 0
-            total_premium_billed += record[3] or 0
-            total_opc_billed += record[4] or 0
+        # Calculate total billed and unloaded today
+        total_ppc_billed, total_premium_billed, total_opc_billed = billed[:, :3].sum(axis=0).tolist()
+        total_ppc_unloaded, total_premium_unloaded, total_opc_unloaded = unloaded[:, :3].sum(axis=0).tolist()
         
-        # Calculate total unloaded today
-        total_ppc_unloaded = 0
-        total_premium_unloaded = 0
-        total_opc_unloaded = 0
-        
-        for record in unloading_records:
-            total_ppc_unloaded += record[2] or 0
-            total_premium_unloaded += record[3] or 0
-            total_opc_unloaded += record[4] or 0
+        # Every truck's quantities in bags (1 MT = 20 bags), rounded half to even like round()
+        unloaded_bags = np.rint(unloaded * 20).astype(np.int64).tolist()
         
         # Calculate closing balance (opening + billed - unloaded)
         closing_ppc = opening['ppc'] + total_ppc_billed - total_ppc_unloaded
         closing_premium = opening['premium'] + total_premium_billed - total_premium_unloaded
         closing_opc = opening['opc'] + total_opc_billed - total_opc_unloaded
         
-        db.close()
-        
         # Format date for display
-        from datetime import datetime
         date_obj = datetime.strptime(unloading_date, '%Y-%m-%d')
-        formatted_date = date_obj.strftime('%d-%m-%Y')
-        
-        # Build WhatsApp message
-        message_lines = []
-        message_lines.append(f"*{dealer_name}*")
-        message_lines.append(f"📅 Date: {formatted_date}")
-        message_lines.append("")
-        
-        # Unloading section
-        message_lines.append("*📦 Today's Unloading:*")
-        message_lines.append("─" * 25)
-        
-        for record in unloading_records:
-            truck_number = record[0]
-            unloading_point = record[1] or '-'
-            ppc = record[2] or 0
-            premium = record[3] or 0
-            opc = record[4] or 0
-            total_qty = record[5] or 0
-            
-            # Convert to bags
-            ppc_bags = round(ppc * 20)
-            premium_bags = round(premium * 20)
-            opc_bags = round(opc * 20)
-            total_bags = round(total_qty * 20)
-            
-            message_lines.append(f"🚛 Truck: *{truck_number}*")
-            message_lines.append(f"   📍 Point: {unloading_point}")
-            
-            # Show bags breakdown
-            bag_parts = []
-            if ppc_bags > 0:
-                bag_parts.append(f"PPC: {ppc_bags}")
-            if premium_bags > 0:
-                bag_parts.append(f"Premium: {premium_bags}")
-            if opc_bags > 0:
-                bag_parts.append(f"OPC: {opc_bags}")
-            
-            if bag_parts:
-                message_lines.append(f"   🎒 {', '.join(bag_parts)}")
-            message_lines.append(f"   📊 Total: *{total_bags} bags*")
-            message_lines.append("")
+        formatted_date = format_date_indian(date_obj)
+        
+        # Build WhatsApp message: header, one block per truck, then the totals
+        message_lines = [f"*{dealer_name}*", f"📅 Date: {formatted_date}", "",
+                         "*📦 Today's Unloading:*", "─" * 25]
+        message_lines += [format_truck_block(record, bags) for record, bags in zip(unloading_records, unloaded_bags)]
         
         # Total unloading summary
         total_unloaded_bags = round((total_ppc_unloaded + total_premium_unloaded + total_opc_unloaded) * 20)
-        message_lines.append(f"*Total Unloaded: {total_unloaded_bags} bags*")
-        message_lines.append("")
-        
-        # Material Balance section
-        message_lines.append("─" * 25)
-        message_lines.append("*📊 Material Balance:*")
-        message_lines.append("")
-        
-        # Opening balance (in bags) - show even if negative
-        opening_ppc_bags = round(opening['ppc'] * 20)
-        opening_premium_bags = round(opening['premium'] * 20)
-        opening_opc_bags = round(opening['opc'] * 20)
-        
-        message_lines.append("*Opening Balance:*")
-        balance_parts = []
-        if opening_ppc_bags != 0:
-            status = "Advance" if opening_ppc_bags > 0 else "Pending"
-            balance_parts.append(f"PPC: {abs(opening_ppc_bags)} {status}")
-        if opening_premium_bags != 0:
-            status = "Advance" if opening_premium_bags > 0 else "Pending"
-            balance_parts.append(f"Premium: {abs(opening_premium_bags)} {status}")
-        if opening_opc_bags != 0:
-            status = "Advance" if opening_opc_bags > 0 else "Pending"
-            balance_parts.append(f"OPC: {abs(opening_opc_bags)} {status}")
-        
-        if balance_parts:
-            message_lines.append(f"  {', '.join(balance_parts)} bags")
-        else:
-            message_lines.append("  No opening balance")
-        
-        message_lines.append("")
-        
-        # Today's billing (in bags) - show total only in material balance
-        billed_ppc_bags = round(total_ppc_billed * 20)
-        billed_premium_bags = round(total_premium_billed * 20)
-        billed_opc_bags = round(total_opc_billed * 20)
-        
-        message_lines.append("*Today's Billing (+):*")
-        billing_parts = []
-        if billed_ppc_bags != 0:
-            billing_parts.append(f"PPC: {billed_ppc_bags}")
-        if billed_premium_bags != 0:
-            billing_parts.append(f"Premium: {billed_premium_bags}")
-        if billed_opc_bags != 0:
-            billing_parts.append(f"OPC: {billed_opc_bags}")
-        
-        if billing_parts:
-            message_lines.append(f"  {', '.join(billing_parts)} bags")
-        else:
-            message_lines.append("  No billing today")
-        
-        message_lines.append("")
-        
-        # Today's unloading (in bags)
-        unloaded_ppc_bags = round(total_ppc_unloaded * 20)
-        unloaded_premium_bags = round(total_premium_unloaded * 20)
-        unloaded_opc_bags = round(total_opc_unloaded * 20)
-        
-        message_lines.append("*Today's Unloading (-):*")
-        unloading_parts = []
-        if unloaded_ppc_bags != 0:
-            unloading_parts.append(f"PPC: {unloaded_ppc_bags}")
-        if unloaded_premium_bags != 0:
-            unloading_parts.append(f"Premium: {unloaded_premium_bags}")
-        if unloaded_opc_bags != 0:
-            unloading_parts.append(f"OPC: {unloaded_opc_bags}")
-        
+        message_lines += [f"*Total Unloaded: {total_unloaded_bags} bags*", ""]
+        
+        # Bag counts (1 MT = 20 bags) for the material balance, converted in one
+        # pass and rounded half to even like round(); opening and closing are
+        # shown even if negative
+        opening_bags, billed_bags, unloaded_total_bags, closing_bags = np.rint(np.array([
+            (opening['ppc'], opening['premium'], opening['opc']),
+            (total_ppc_billed, total_premium_billed, total_opc_billed),
+            (total_ppc_unloaded, total_premium_unloaded, total_opc_unloaded),
+            (closing_ppc, closing_premium, closing_opc),
+        ], dtype=np.float64) * 20).astype(np.int64).tolist()
+        
+        # Each line lists only the non-zero products
+        balance_parts = balance_bag_parts(opening_bags)
+        billing_parts = bag_parts(billed_bags)
+        unloading_parts = bag_parts(unloaded_total_bags)
+        closing_parts = balance_bag_parts(closing_bags)
+        
+        # Material Balance section; today's unloading has no line when nothing was unloaded
+        message_lines += [
+            "─" * 25,
+            "*📊 Material Balance:*",
+            "",
+            "*Opening Balance:*",
+            f"  {', '.join(balance_parts)} bags" if balance_parts else "  No opening balance",
+            "",
+            "*Today's Billing (+):*",
+            f"  {', '.join(billing_parts)} bags" if billing_parts else "  No billing today",
+            "",
+            "*Today's Unloading (-):*",
+        ]
         if unloading_parts:
             message_lines.append(f"  {', '.join(unloading_parts)} bags")
-        
-        message_lines.append("")
-        
-        # Closing balance (in bags)
-        closing_ppc_bags = round(closing_ppc * 20)
-        closing_premium_bags = round(closing_premium * 20)
-        closing_opc_bags = round(closing_opc * 20)
-        
-        message_lines.append("*Closing Balance:*")
-        closing_parts = []
-        if closing_ppc_bags != 0:
-            status = "Advance" if closing_ppc_bags > 0 else "Pending"
-            closing_parts.append(f"PPC: {abs(closing_ppc_bags)} {status}")
-        if closing_premium_bags != 0:
-            status = "Advance" if closing_premium_bags > 0 else "Pending"
-            closing_parts.append(f"Premium: {abs(closing_premium_bags)} {status}")
-        if closing_opc_bags != 0:
-            status = "Advance" if closing_opc_bags > 0 else "Pending"
-            closing_parts.append(f"OPC: {abs(closing_opc_bags)} {status}")
-        
-        if closing_parts:
-            message_lines.append(f"  {', '.join(closing_parts)} bags")
-        else:
-            message_lines.append("  No pending balance")
+        message_lines += [
+            "",
+            "*Closing Balance:*",
+            f"  {', '.join(closing_parts)} bags" if closing_parts else "  No pending balance",
+        ]
         
         message = '\n'.join(message_lines)
         
@@ -1448,14 +1549,30 @@ def dealer_balance():
     """Dealer material balance report page"""
     return render_template('dealer_balance.html')
 
+def find_material_opening(cursor, month_year, dealer_name, dealer_code):
+    """Manual (ppc, premium, opc) opening of a regular dealer for a month, or None
+    
+    The dealer_code entry wins; without one, a dealer_name entry is used only if
+    it is the sole entry with that name. Both are looked up in one query, the
+    code match (at most one, month_year + dealer_code is unique) sorting first.
+    """
+    code = str(dealer_code) if dealer_code else None
+    cursor.execute('''
+        SELECT ppc_qty, premium_qty, opc_qty, dealer_code = ?
+        FROM opening_material_balance
+        WHERE month_year = ? AND (dealer_code = ? OR dealer_name = ?)
+        ORDER BY 4 DESC
+    ''', (code, month_year, code, dealer_name))
+    rows = cursor.fetchall()
+    if rows and (rows[0][3] or len(rows) == 1):
+        return rows[0][:3]
+    return None
+
 def get_dealer_opening_balance(cursor, dealer_name, before_date, is_other_dealer=False, dealer_code=None):
     """Calculate opening balance for a dealer using manual opening balance + cumulative transactions
     
     If no manual opening balance exists for the current month, it calculates from previous month's closing.
     """
-    from datetime import datetime
-    from dateutil.relativedelta import relativedelta
-    
     # Get the month of the selected date
     month_year = before_date[:7]  # Extract YYYY-MM from date
     month_start = month_year + '-01'  # First day of the month
@@ -1475,25 +1592,8 @@ def get_dealer_opening_balance(cursor, dealer_name, before_date, is_other_dealer
             ''', (month_year, dealer_name))
             row = cursor.fetchone()
         else:
-            # For regular dealers, first try to match by dealer_code (most accurate)
-            if dealer_code:
-                cursor.execute('''
-                    SELECT ppc_qty, premium_qty, opc_qty
-                    FROM opening_material_balance
-                    WHERE month_year = ? AND dealer_code = ?
-                ''', (month_year, str(dealer_code)))
-                row = cursor.fetchone()
-            
-            # If no match by dealer_code, try by name (only if exactly one match)
-            if not row:
-                cursor.execute('''
-                    SELECT ppc_qty, premium_qty, opc_qty
-                    FROM opening_material_balance
-                    WHERE month_year = ? AND dealer_name = ?
-                ''', (month_year, dealer_name))
-                rows = cursor.fetchall()
-                if len(rows) == 1:
-                    row = rows[0]
+            # For regular dealers, match by dealer_code (most accurate), else by name
+            row = find_material_opening(cursor, month_year, dealer_name, dealer_code)
         
         if row:
             manual_opening = {
@@ -1510,11 +1610,9 @@ def get_dealer_opening_balance(cursor, dealer_name, before_date, is_other_dealer
     if not has_manual_opening:
         try:
             # Calculate previous month
-            current_month = datetime.strptime(month_year + '-01', '%Y-%m-%d')
-            prev_month = current_month - relativedelta(months=1)
-            prev_month_year = prev_month.strftime('%Y-%m')
+            prev_month_year = prev_month_str(month_year)
             prev_month_start = prev_month_year + '-01'
-            prev_month_end = current_month.strftime('%Y-%m-%d')  # First day of current month
+            prev_month_end = month_start  # First day of current month
             
             # Get previous month's opening balance (manual)
             prev_opening = {'ppc': 0, 'premium': 0, 'opc': 0}
@@ -1526,23 +1624,7 @@ def get_dealer_opening_balance(cursor, dealer_name, before_date, is_other_dealer
                 ''', (prev_month_year, dealer_name))
                 prev_row = cursor.fetchone()
             else:
-                prev_row = None
-                if dealer_code:
-                    cursor.execute('''
-                        SELECT ppc_qty, premium_qty, opc_qty
-                        FROM opening_material_balance
-                        WHERE month_year = ? AND dealer_code = ?
-                    ''', (prev_month_year, str(dealer_code)))
-                    prev_row = cursor.fetchone()
-                if not prev_row:
-                    cursor.execute('''
-                        SELECT ppc_qty, premium_qty, opc_qty
-                        FROM opening_material_balance
-                        WHERE month_year = ? AND dealer_name = ?
-                    ''', (prev_month_year, dealer_name))
-                    prev_rows = cursor.fetchall()
-                    if len(prev_rows) == 1:
-                        prev_row = prev_rows[0]
+                prev_row = find_material_opening(cursor, prev_month_year, dealer_name, dealer_code)
             
             if prev_row:
                 prev_opening = {
@@ -1551,54 +1633,36 @@ def get_dealer_opening_balance(cursor, dealer_name, before_date, is_other_dealer
                     'opc': prev_row[2] or 0
                 }
             
-            # Get previous month's billed
-            if not is_other_dealer:
-                if dealer_code:
-                    cursor.execute('''
-                        SELECT COALESCE(SUM(ppc_quantity), 0), 
-                               COALESCE(SUM(premium_quantity), 0), 
-                               COALESCE(SUM(opc_quantity), 0)
-                        FROM sales_data 
-                        WHERE dealer_code = ? AND sale_date >= ? AND sale_date < ?
-                    ''', (dealer_code, prev_month_start, prev_month_end))
-                else:
-                    cursor.execute('''
-                        SELECT COALESCE(SUM(ppc_quantity), 0), 
-                               COALESCE(SUM(premium_quantity), 0), 
-                               COALESCE(SUM(opc_quantity), 0)
-                        FROM sales_data 
-                        WHERE dealer_name = ? AND sale_date >= ? AND sale_date < ?
-                    ''', (dealer_name, prev_month_start, prev_month_end))
+            # Get previous month's billed and unloaded in one statement: both
+            # aggregates are single rows, so joining them gives one row of six
+            if is_other_dealer:
+                billed_table, billed_key, billed_value = 'other_dealers_billing', 'dealer_name', dealer_name
+            elif dealer_code:
+                billed_table, billed_key, billed_value = 'sales_data', 'dealer_code', dealer_code
             else:
-                cursor.execute('''
+                billed_table, billed_key, billed_value = 'sales_data', 'dealer_name', dealer_name
+            if dealer_code and not is_other_dealer:
+                unloaded_key, unloaded_value = 'dealer_code', dealer_code
+            else:
+                unloaded_key, unloaded_value = 'unloading_dealer', dealer_name
+            cursor.execute(f'''
+                SELECT * FROM (
                     SELECT COALESCE(SUM(ppc_quantity), 0), 
                            COALESCE(SUM(premium_quantity), 0), 
                            COALESCE(SUM(opc_quantity), 0)
-                    FROM other_dealers_billing 
-                    WHERE dealer_name = ? AND sale_date >= ? AND sale_date < ?
-                ''', (dealer_name, prev_month_start, prev_month_end))
-            
-            prev_billed = cursor.fetchone()
-            
-            # Get previous month's unloaded
-            if dealer_code and not is_other_dealer:
-                cursor.execute('''
-                    SELECT COALESCE(SUM(ppc_unloaded), 0), 
-                           COALESCE(SUM(premium_unloaded), 0), 
-                           COALESCE(SUM(opc_unloaded), 0)
-                    FROM vehicle_unloading 
-                    WHERE dealer_code = ? AND unloading_date >= ? AND unloading_date < ?
-                ''', (dealer_code, prev_month_start, prev_month_end))
-            else:
-                cursor.execute('''
+                    FROM {billed_table} 
+                    WHERE {billed_key} = ? AND sale_date >= ? AND sale_date < ?
+                ), (
                     SELECT COALESCE(SUM(ppc_unloaded), 0), 
                            COALESCE(SUM(premium_unloaded), 0), 
                            COALESCE(SUM(opc_unloaded), 0)
                     FROM vehicle_unloading 
-                    WHERE unloading_dealer = ? AND unloading_date >= ? AND unloading_date < ?
-                ''', (dealer_name, prev_month_start, prev_month_end))
+                    WHERE {unloaded_key} = ? AND unloading_date >= ? AND unloading_date < ?
+                )
+            ''', (billed_value, prev_month_start, prev_month_end, unloaded_value, prev_month_start, prev_month_end))
             
-            prev_unloaded = cursor.fetchone()
+            prev_totals = cursor.fetchone()
+            prev_billed, prev_unloaded = prev_totals[:3], prev_totals[3:]
             
             # Previous month closing = opening + billed - unloaded
             manual_opening = {
@@ -1678,6 +1742,113 @@ def get_dealer_opening_balance(cursor, dealer_name, before_date, is_other_dealer
         'total': ppc + premium + opc
     }
 
+def get_dealer_opening_balances_bulk(cursor, dealers, before_date):
+    """Calculate opening balances for many dealers at once, by the same rules
+    as get_dealer_opening_balance
+    
+    dealers maps each dealer key (dealer_code for regular dealers, dealer_name
+    for "Other" dealers) to its {'dealer_name', 'is_other'} info, as
+    get_dealer_balance collects them. Each table is read with one grouped query
+    for all dealers instead of several queries per dealer.
+    Returns {dealer_key: {'ppc', 'premium', 'opc', 'total'}}.
+    """
+    month_year = before_date[:7]
+    month_start = month_year + '-01'
+    prev_month_year = prev_month_str(month_year)
+    dates = {'prev_month_start': prev_month_year + '-01', 'month_start': month_start, 'before_date': before_date}
+    
+    # Manual opening balances for this and the previous month, by code and by name
+    material_by_code = {}
+    material_by_name = {}
+    has_material_table = True
+    try:
+        cursor.execute('''
+            SELECT month_year, dealer_code, dealer_name, ppc_qty, premium_qty, opc_qty
+            FROM opening_material_balance
+            WHERE month_year IN (?, ?)
+            ORDER BY month_year, dealer_code
+        ''', (month_year, prev_month_year))
+        for row in cursor.fetchall():
+            quantities = (row[3] or 0, row[4] or 0, row[5] or 0)
+            material_by_code[(row[0], str(row[1]))] = quantities
+            material_by_name.setdefault((row[0], row[2]), []).append(quantities)
+    except Exception as e:
+        # Table might not exist yet
+        has_material_table = False
+    
+    def material_opening(month, dealer_key, dealer_name, is_other):
+        """Manual opening for one dealer: "Other" dealers by name, regular dealers
+        by code or else by name when exactly one row has it"""
+        named = material_by_name.get((month, dealer_name), [])
+        if is_other:
+            return named[0] if named else None
+        opening = material_by_code.get((month, dealer_key))
+        if not opening and len(named) == 1:
+            opening = named[0]
+        return opening
+    
+    # Previous month's ppc/premium/opc and this month's ppc/premium/opc/total
+    # before before_date, per dealer_code (sales, unloading) or per name
+    # (other-dealer billing, other-dealer unloading)
+    def month_totals(table, key_column, date_column, columns):
+        previous = [f'SUM(CASE WHEN {date_column} < :month_start THEN {column} END)' for column in columns[:3]]
+        current = [f'SUM(CASE WHEN {date_column} >= :month_start THEN {column} END)' for column in columns]
+        cursor.execute(f'''
+            SELECT {key_column}, {', '.join(previous + current)}
+            FROM {table}
+            WHERE {date_column} >= :prev_month_start AND {date_column} < :before_date
+            GROUP BY {key_column}
+        ''', dates)
+        # Empty and zero sums both become 0, as in the per-dealer arithmetic
+        return {str(row[0]): (tuple(value or 0 for value in row[1:4]), tuple(value or 0 for value in row[4:]))
+                for row in cursor.fetchall()}
+    
+    sales_columns = ['ppc_quantity', 'premium_quantity', 'opc_quantity', 'total_quantity']
+    unloading_columns = ['ppc_unloaded', 'premium_unloaded', 'opc_unloaded', 'unloaded_quantity']
+    billed_by_code = month_totals('sales_data', 'dealer_code', 'sale_date', sales_columns)
+    unloaded_by_code = month_totals('vehicle_unloading', 'dealer_code', 'unloading_date', unloading_columns)
+    unloaded_by_name = month_totals('vehicle_unloading', 'unloading_dealer', 'unloading_date', unloading_columns)
+    billed_by_name = {}
+    if any(info['is_other'] for info in dealers.values()):
+        billed_by_name = month_totals('other_dealers_billing', 'dealer_name', 'sale_date', sales_columns)
+    
+    no_totals = ((0, 0, 0), (0, 0, 0, 0))
+    openings = {}
+    for dealer_key, info in dealers.items():
+        dealer_name, is_other = info['dealer_name'], info['is_other']
+        if is_other:
+            billed = billed_by_name.get(dealer_name, no_totals)
+            unloaded = unloaded_by_name.get(dealer_name, no_totals)
+        else:
+            billed = billed_by_code.get(dealer_key, no_totals)
+            unloaded = unloaded_by_code.get(dealer_key, no_totals)
+        
+        # Manual opening for the month, else previous month's closing
+        # (previous month's manual opening + billed - unloaded)
+        opening = (0, 0, 0)
+        if has_material_table:
+            opening = material_opening(month_year, dealer_key, dealer_name, is_other)
+            if not opening:
+                prev_opening = material_opening(prev_month_year, dealer_key, dealer_name, is_other) or (0, 0, 0)
+                opening = tuple(prev_opening[i] + billed[0][i] - unloaded[0][i] for i in range(3))
+        
+        # Opening balance = Manual opening + Billed since month start - Unloaded since month start
+        ppc = opening[0] + billed[1][0] - unloaded[1][0]
+        premium = opening[1] + billed[1][1] - unloaded[1][1]
+        opc = opening[2] + billed[1][2] - unloaded[1][2]
+        openings[dealer_key] = {
+            'ppc': ppc,
+            'premium': premium,
+            'opc': opc,
+            'total': ppc + premium + opc
+        }
+    
+    return openings
+
+# Held while get_dealer_balance works out and saves a month's material closings,
+# so concurrent requests don't all recompute and insert the same month
+material_autosave_lock = threading.Lock()
+
 @app.route('/get_dealer_balance', methods=['POST'])
 def get_dealer_balance():
     """Get dealer-wise billed vs unloaded quantities for a date with opening balance"""
@@ -1688,7 +1859,7 @@ def get_dealer_balance():
         if not selected_date:
             return jsonify({'success': False, 'message': 'Date is required'})
         
-        db = SalesCollectionsDatabase(DB_PATH)
+        db = get_db()
         cursor = db.conn.cursor()
         
         month_year = selected_date[:7]  # Extract YYYY-MM
@@ -1698,12 +1869,9 @@ def get_dealer_balance():
         all_dealers = {}  # {dealer_code: {'dealer_name': name, 'is_other': False}}
         
         # Calculate previous month for fallback
-        from dateutil.relativedelta import relativedelta
-        current_month_dt = datetime.strptime(month_year + '-01', '%Y-%m-%d')
-        prev_month_dt = current_month_dt - relativedelta(months=1)
-        prev_month_year = prev_month_dt.strftime('%Y-%m')
+        prev_month_year = prev_month_str(month_year)
         prev_month_start = prev_month_year + '-01'
-        prev_month_end = current_month_dt.strftime('%Y-%m-%d')
+        prev_month_end = month_start
         
         # 1. Get dealers from opening_material_balance for this month
         has_current_month_opening = False
@@ -1743,6 +1911,219 @@ def get_dealer_balance():
             ''', (prev_month_year,))
             prev_month_entries = cursor.fetchall()
             
+            if not prev_month_entries:
+                # Only one request works these out at a time; one that waited on the
+                # lock finds the entries the first one saved and uses them instead
+                with material_autosave_lock:
+                    cursor.execute('''
+                        SELECT dealer_code, dealer_name, dealer_type
+                        FROM opening_material_balance
+                        WHERE month_year = ?
+                    ''', (prev_month_year,))
+                    prev_month_entries = cursor.fetchall()
+                    if not prev_month_entries:
+                        # No previous month entries - need to calculate and save them
+                        print(f"INFO: No {prev_month_year} dealer entries found. Calculating and saving closing balances...")
+                        
+                        # Get previous month dates
+                        prev_prev_month_year = prev_month_str(prev_month_year)
+                        prev_month_start_date = prev_month_start
+                        prev_month_end_date = month_end_str(prev_month_year)
+                        
+                        # Get all dealers that had transactions in previous month OR had opening balance
+                        # Use dealer_name as key for "Other" type dealers, dealer_code for regular dealers
+                        dealers_to_process = {}
+                        
+                        # Get dealers from month before previous month's opening, keeping their
+                        # stored quantities (the first entry per code, and per name for "Other")
+                        prev_prev_opening_by_code = {}
+                        prev_prev_opening_by_other_name = {}
+                        cursor.execute('''
+                            SELECT dealer_code, dealer_name, dealer_type, ppc_qty, premium_qty, opc_qty
+                            FROM opening_material_balance
+                            WHERE month_year = ?
+                            ORDER BY id
+                        ''', (prev_prev_month_year,))
+                        for row in cursor.fetchall():
+                            dealer_code = str(row[0])
+                            dealer_name = row[1]
+                            dealer_type = row[2]
+                            prev_prev_opening_by_code.setdefault(dealer_code, row[3:])
+                            if dealer_type == 'Other':
+                                prev_prev_opening_by_other_name.setdefault(dealer_name, row[3:])
+                            # For "Other" type dealers, use dealer_name as key
+                            if dealer_type == 'Other':
+                                dealer_key = dealer_name
+                            else:
+                                dealer_key = dealer_code
+                            dealers_to_process[dealer_key] = {
+                                'dealer_code': dealer_code,
+                                'dealer_name': dealer_name,
+                                'dealer_type': dealer_type
+                            }
+                        
+                        # Get dealers from previous month sales (these are regular dealers, not Other)
+                        cursor.execute('''
+                            SELECT DISTINCT dealer_code, dealer_name
+                            FROM sales_data
+                            WHERE sale_date >= ? AND sale_date <= ?
+                        ''', (prev_month_start_date, prev_month_end_date))
+                        for row in cursor.fetchall():
+                            dealer_code = str(row[0])
+                            dealer_name = row[1]
+                            # Regular dealers use dealer_code as key
+                            if dealer_code not in dealers_to_process:
+                                dealers_to_process[dealer_code] = {
+                                    'dealer_code': dealer_code,
+                                    'dealer_name': dealer_name,
+                                    'dealer_type': 'Active'
+                                }
+                        
+                        # Get dealers from previous month unloading (regular dealers only)
+                        cursor.execute('''
+                            SELECT DISTINCT dealer_code, unloading_dealer
+                            FROM vehicle_unloading
+                            WHERE unloading_date >= ? AND unloading_date <= ?
+                            AND is_other_dealer = 0
+                        ''', (prev_month_start_date, prev_month_end_date))
+                        for row in cursor.fetchall():
+                            dealer_code = str(row[0])
+                            dealer_name = row[1]
+                            # Regular dealers use dealer_code as key
+                            if dealer_code not in dealers_to_process:
+                                dealers_to_process[dealer_code] = {
+                                    'dealer_code': dealer_code,
+                                    'dealer_name': dealer_name,
+                                    'dealer_type': 'Active'
+                                }
+                        
+                        # Get "Other" dealers from previous month unloading
+                        cursor.execute('''
+                            SELECT DISTINCT unloading_dealer
+                            FROM vehicle_unloading
+                            WHERE unloading_date >= ? AND unloading_date <= ?
+                            AND is_other_dealer = 1
+                        ''', (prev_month_start_date, prev_month_end_date))
+                        for row in cursor.fetchall():
+                            dealer_name = row[0]
+                            if dealer_name not in dealers_to_process:
+                                dealers_to_process[dealer_name] = {
+                                    'dealer_code': None,
+                                    'dealer_name': dealer_name,
+                                    'dealer_type': 'Other'
+                                }
+                        
+                        # Number the newly found "Other" dealers with the lowest unused
+                        # codes, like the admin page's 1, 2, ...; a shared code would
+                        # collide on UNIQUE(month_year, dealer_code)
+                        used_codes = {info['dealer_code'] for info in dealers_to_process.values()}
+                        next_other_code = 1
+                        for dealer_info in dealers_to_process.values():
+                            if dealer_info['dealer_code'] is None:
+                                while str(next_other_code) in used_codes:
+                                    next_other_code += 1
+                                dealer_info['dealer_code'] = str(next_other_code)
+                                used_codes.add(dealer_info['dealer_code'])
+                        
+                        # Calculate closing balance for each dealer
+                        # IMPORTANT: opening_material_balance stores CLOSING balances
+                        # Entry with month_year='2025-11' contains OCTOBER 31 closing (manually added as Nov opening)
+                        # We need to calculate NOVEMBER closing first, then use it as DECEMBER opening
+                        dealers_to_save = []
+                        
+                        # Get previous-previous month dates for November transactions
+                        prev_prev_month_start = prev_prev_month_year + '-01'
+                        prev_prev_month_end = month_end_str(prev_prev_month_year)
+                        
+                        # November billing and unloading for every dealer, one grouped query each:
+                        # regular dealers by dealer_code, "Other" dealers by name
+                        def prev_prev_month_totals(sql):
+                            cursor.execute(sql, (prev_prev_month_start, prev_prev_month_end))
+                            return {str(row[0]): tuple(value or 0 for value in row[1:]) for row in cursor.fetchall()
+                                    if row[0] is not None}
+                        
+                        billed_by_code = prev_prev_month_totals('''
+                            SELECT dealer_code, SUM(ppc_quantity), SUM(premium_quantity), SUM(opc_quantity)
+                            FROM sales_data
+                            WHERE sale_date >= ? AND sale_date <= ?
+                            GROUP BY dealer_code
+                        ''')
+                        billed_by_other_name = prev_prev_month_totals('''
+                            SELECT dealer_name, SUM(ppc_quantity), SUM(premium_quantity), SUM(opc_quantity)
+                            FROM other_dealers_billing
+                            WHERE sale_date >= ? AND sale_date <= ?
+                            GROUP BY dealer_name
+                        ''')
+                        unloaded_by_code = prev_prev_month_totals('''
+                            SELECT dealer_code, SUM(ppc_unloaded), SUM(premium_unloaded), SUM(opc_unloaded)
+                            FROM vehicle_unloading
+                            WHERE unloading_date >= ? AND unloading_date <= ?
+                            GROUP BY dealer_code
+                        ''')
+                        unloaded_by_other_name = prev_prev_month_totals('''
+                            SELECT unloading_dealer, SUM(ppc_unloaded), SUM(premium_unloaded), SUM(opc_unloaded)
+                            FROM vehicle_unloading
+                            WHERE is_other_dealer = 1 AND unloading_date >= ? AND unloading_date <= ?
+                            GROUP BY unloading_dealer
+                        ''')
+                        
+                        for dealer_key, dealer_info in dealers_to_process.items():
+                            dealer_code = dealer_info['dealer_code']
+                            dealer_name = dealer_info['dealer_name']
+                            dealer_type = dealer_info['dealer_type']
+                            is_other = dealer_type == 'Other'
+                            
+                            # October closing (stored in Nov entry) - this is November opening - and
+                            # November billing and unloading
+                            if is_other:
+                                oct_closing_row = prev_prev_opening_by_other_name.get(dealer_name)
+                                nov_billed = billed_by_other_name.get(dealer_name, (0, 0, 0))
+                                nov_unloaded = unloaded_by_other_name.get(dealer_name, (0, 0, 0))
+                            else:
+                                oct_closing_row = prev_prev_opening_by_code.get(dealer_code)
+                                nov_billed = billed_by_code.get(dealer_code, (0, 0, 0))
+                                nov_unloaded = unloaded_by_code.get(dealer_code, (0, 0, 0))
+                            nov_opening_ppc = oct_closing_row[0] if oct_closing_row else 0
+                            nov_opening_premium = oct_closing_row[1] if oct_closing_row else 0
+                            nov_opening_opc = oct_closing_row[2] if oct_closing_row else 0
+                            
+                            # Calculate November closing = October closing + November billing - November unloading
+                            nov_closing_ppc = nov_opening_ppc + (nov_billed[0] or 0) - (nov_unloaded[0] or 0)
+                            nov_closing_premium = nov_opening_premium + (nov_billed[1] or 0) - (nov_unloaded[1] or 0)
+                            nov_closing_opc = nov_opening_opc + (nov_billed[2] or 0) - (nov_unloaded[2] or 0)
+                            
+                            # Save PREVIOUS MONTH's closing (November closing) - allow negative balances for inactive/other dealers
+                            total_nov_closing = nov_closing_ppc + nov_closing_premium + nov_closing_opc
+                            if abs(total_nov_closing) > 0.01:  # Save if non-zero (positive or negative)
+                                dealers_to_save.append((
+                                    dealer_code,
+                                    dealer_name,
+                                    dealer_type,
+                                    nov_closing_ppc,
+                                    nov_closing_premium,
+                                    nov_closing_opc
+                                ))
+                                # Add to all_dealers for current processing
+                                all_dealers[dealer_key] = {
+                                    'dealer_name': dealer_name,
+                                    'is_other': is_other
+                                }
+                        
+                        # Save to opening_material_balance
+                        if dealers_to_save:
+                            print(f"INFO: Saving {len(dealers_to_save)} dealers to opening_material_balance for {prev_month_year}")
+                            # One prepared statement for every dealer, committed together
+                            # (or rolled back together if any row fails); rows already
+                            # stored for the month are never overwritten
+                            with db.conn:
+                                cursor.executemany('''
+                                    INSERT INTO opening_material_balance
+                                    (month_year, dealer_code, dealer_name, dealer_type, ppc_qty, premium_qty, opc_qty)
+                                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                                    ON CONFLICT(month_year, dealer_code) DO NOTHING
+                                ''', [(prev_month_year,) + dealer for dealer in dealers_to_save])
+                            print(f"INFO: Successfully saved {len(dealers_to_save)} dealers for {prev_month_year}")
+            
             if prev_month_entries:
                 # Use previous month's entries directly
                 for row in prev_month_entries:
@@ -1758,195 +2139,6 @@ def get_dealer_balance():
                             'dealer_name': dealer_name,
                             'is_other': is_other
                         }
-            else:
-                # No previous month entries - need to calculate and save them
-                print(f"INFO: No {prev_month_year} dealer entries found. Calculating and saving closing balances...")
-                
-                from dateutil.relativedelta import relativedelta
-                from calendar import monthrange
-                
-                # Get previous month dates
-                prev_month_dt = datetime.strptime(month_start, '%Y-%m-%d') - relativedelta(months=1)
-                prev_prev_month_dt = prev_month_dt - relativedelta(months=1)
-                prev_prev_month_year = prev_prev_month_dt.strftime('%Y-%m')
-                prev_month_start_date = prev_month_dt.replace(day=1).strftime('%Y-%m-%d')
-                last_day = monthrange(prev_month_dt.year, prev_month_dt.month)[1]
-                prev_month_end_date = prev_month_dt.replace(day=last_day).strftime('%Y-%m-%d')
-                
-                # Get all dealers that had transactions in previous month OR had opening balance
-                # Use dealer_name as key for "Other" type dealers, dealer_code for regular dealers
-                dealers_to_process = {}
-                
-                # Get dealers from month before previous month's opening
-                cursor.execute('''
-                    SELECT dealer_code, dealer_name, dealer_type
-                    FROM opening_material_balance
-                    WHERE month_year = ?
-                ''', (prev_prev_month_year,))
-                for row in cursor.fetchall():
-                    dealer_code = str(row[0])
-                    dealer_name = row[1]
-                    dealer_type = row[2]
-                    # For "Other" type dealers, use dealer_name as key
-                    if dealer_type == 'Other':
-                        dealer_key = dealer_name
-                    else:
-                        dealer_key = dealer_code
-                    dealers_to_process[dealer_key] = {
-                        'dealer_code': dealer_code,
-                        'dealer_name': dealer_name,
-                        'dealer_type': dealer_type
-                    }
-                
-                # Get dealers from previous month sales (these are regular dealers, not Other)
-                cursor.execute('''
-                    SELECT DISTINCT dealer_code, dealer_name
-                    FROM sales_data
-                    WHERE sale_date >= ? AND sale_date <= ?
-                ''', (prev_month_start_date, prev_month_end_date))
-                for row in cursor.fetchall():
-                    dealer_code = str(row[0])
-                    dealer_name = row[1]
-                    # Regular dealers use dealer_code as key
-                    if dealer_code not in dealers_to_process:
-                        dealers_to_process[dealer_code] = {
-                            'dealer_code': dealer_code,
-                            'dealer_name': dealer_name,
-                            'dealer_type': 'Active'
-                        }
-                
-                # Get dealers from previous month unloading (regular dealers only)
-                cursor.execute('''
-                    SELECT DISTINCT dealer_code, unloading_dealer
-                    FROM vehicle_unloading
-                    WHERE unloading_date >= ? AND unloading_date <= ?
-                    AND is_other_dealer = 0
-                ''', (prev_month_start_date, prev_month_end_date))
-                for row in cursor.fetchall():
-                    dealer_code = str(row[0])
-                    dealer_name = row[1]
-                    # Regular dealers use dealer_code as key
-                    if dealer_code not in dealers_to_process:
-                        dealers_to_process[dealer_code] = {
-                            'dealer_code': dealer_code,
-                            'dealer_name': dealer_name,
-                            'dealer_type': 'Active'
-                        }
-                
-                # Get "Other" dealers from previous month unloading
-                cursor.execute('''
-                    SELECT DISTINCT unloading_dealer
-                    FROM vehicle_unloading
-                    WHERE unloading_date >= ? AND unloading_date <= ?
-                    AND is_other_dealer = 1
-                ''', (prev_month_start_date, prev_month_end_date))
-                for row in cursor.fetchall():
-                    dealer_name = row[0]
-                    if dealer_name not in dealers_to_process:
-                        dealers_to_process[dealer_name] = {
-                            'dealer_code': '1',
-                            'dealer_name': dealer_name,
-                            'dealer_type': 'Other'
-                        }
-                
-                # Calculate closing balance for each dealer
-                # IMPORTANT: opening_material_balance stores CLOSING balances
-                # Entry with month_year='2025-11' contains OCTOBER 31 closing (manually added as Nov opening)
-                # We need to calculate NOVEMBER closing first, then use it as DECEMBER opening
-                dealers_to_save = []
-                
-                # Get previous-previous month dates for November transactions
-                prev_prev_month_start = prev_prev_month_dt.replace(day=1).strftime('%Y-%m-%d')
-                last_day_prev_prev = monthrange(prev_prev_month_dt.year, prev_prev_month_dt.month)[1]
-                prev_prev_month_end = prev_prev_month_dt.replace(day=last_day_prev_prev).strftime('%Y-%m-%d')
-                
-                for dealer_key, dealer_info in dealers_to_process.items():
-                    dealer_code = dealer_info['dealer_code']
-                    dealer_name = dealer_info['dealer_name']
-                    dealer_type = dealer_info['dealer_type']
-                    is_other = dealer_type == 'Other'
-                    
-                    # Get October closing (stored in Nov entry) - this is November opening
-                    if is_other:
-                        cursor.execute('''
-                            SELECT ppc_qty, premium_qty, opc_qty
-                            FROM opening_material_balance
-                            WHERE month_year = ? AND dealer_name = ? AND dealer_type = 'Other'
-                        ''', (prev_prev_month_year, dealer_name))
-                    else:
-                        cursor.execute('''
-                            SELECT ppc_qty, premium_qty, opc_qty
-                            FROM opening_material_balance
-                            WHERE month_year = ? AND dealer_code = ?
-                        ''', (prev_prev_month_year, dealer_code))
-                    oct_closing_row = cursor.fetchone()
-                    nov_opening_ppc = oct_closing_row[0] if oct_closing_row else 0
-                    nov_opening_premium = oct_closing_row[1] if oct_closing_row else 0
-                    nov_opening_opc = oct_closing_row[2] if oct_closing_row else 0
-                    
-                    # Get November billing (all November transactions)
-                    if is_other:
-                        cursor.execute('''
-                            SELECT COALESCE(SUM(ppc_quantity), 0), COALESCE(SUM(premium_quantity), 0), COALESCE(SUM(opc_quantity), 0)
-                            FROM other_dealers_billing
-                            WHERE dealer_name = ? AND sale_date >= ? AND sale_date <= ?
-                        ''', (dealer_name, prev_prev_month_start, prev_prev_month_end))
-                    else:
-                        cursor.execute('''
-                            SELECT COALESCE(SUM(ppc_quantity), 0), COALESCE(SUM(premium_quantity), 0), COALESCE(SUM(opc_quantity), 0)
-                            FROM sales_data
-                            WHERE dealer_code = ? AND sale_date >= ? AND sale_date <= ?
-                        ''', (dealer_code, prev_prev_month_start, prev_prev_month_end))
-                    nov_billed = cursor.fetchone()
-                    
-                    # Get November unloading (all November transactions)
-                    if is_other:
-                        cursor.execute('''
-                            SELECT COALESCE(SUM(ppc_unloaded), 0), COALESCE(SUM(premium_unloaded), 0), COALESCE(SUM(opc_unloaded), 0)
-                            FROM vehicle_unloading
-                            WHERE unloading_dealer = ? AND is_other_dealer = 1 AND unloading_date >= ? AND unloading_date <= ?
-                        ''', (dealer_name, prev_prev_month_start, prev_prev_month_end))
-                    else:
-                        cursor.execute('''
-                            SELECT COALESCE(SUM(ppc_unloaded), 0), COALESCE(SUM(premium_unloaded), 0), COALESCE(SUM(opc_unloaded), 0)
-                            FROM vehicle_unloading
-                            WHERE dealer_code = ? AND unloading_date >= ? AND unloading_date <= ?
-                        ''', (dealer_code, prev_prev_month_start, prev_prev_month_end))
-                    nov_unloaded = cursor.fetchone()
-                    
-                    # Calculate November closing = October closing + November billing - November unloading
-                    nov_closing_ppc = nov_opening_ppc + (nov_billed[0] or 0) - (nov_unloaded[0] or 0)
-                    nov_closing_premium = nov_opening_premium + (nov_billed[1] or 0) - (nov_unloaded[1] or 0)
-                    nov_closing_opc = nov_opening_opc + (nov_billed[2] or 0) - (nov_unloaded[2] or 0)
-                    
-                    # Save PREVIOUS MONTH's closing (November closing) - allow negative balances for inactive/other dealers
-                    total_nov_closing = nov_closing_ppc + nov_closing_premium + nov_closing_opc
-                    if abs(total_nov_closing) > 0.01:  # Save if non-zero (positive or negative)
-                        dealers_to_save.append((
-                            dealer_code,
-                            dealer_name,
-                            dealer_type,
-                            nov_closing_ppc,
-                            nov_closing_premium,
-                            nov_closing_opc
-                        ))
-                        # Add to all_dealers for current processing
-                        all_dealers[dealer_key] = {
-                            'dealer_name': dealer_name,
-                            'is_other': is_other
-                        }
-                
-                # Save to opening_material_balance
-                if dealers_to_save:
-                    print(f"INFO: Saving {len(dealers_to_save)} dealers to opening_material_balance for {prev_month_year}")
-                    for dealer_code, dealer_name, dealer_type, ppc, premium, opc in dealers_to_save:
-                        cursor.execute('''
-                            INSERT INTO opening_material_balance
-                            (month_year, dealer_code, dealer_name, dealer_type, ppc_qty, premium_qty, opc_qty)
-                            VALUES (?, ?, ?, ?, ?, ?, ?)
-                        ''', (prev_month_year, dealer_code, dealer_name, dealer_type, ppc, premium, opc))
-                    db.conn.commit()
-                    print(f"INFO: Successfully saved {len(dealers_to_save)} dealers for {prev_month_year}")
             
             # Also get dealers who had activity in previous month (sales or unloading)
             try:
@@ -2142,13 +2334,16 @@ def get_dealer_balance():
         }
         has_other_dealers = False
         
+        # Opening balances for every dealer, read in a few grouped queries
+        openings = get_dealer_opening_balances_bulk(cursor, all_dealers, selected_date)
+        
         # Process all dealers
         for dealer_code, dealer_info in all_dealers.items():
             dealer_name = dealer_info['dealer_name']
             is_other = dealer_info['is_other']
             
             # Get opening balance
-            opening = get_dealer_opening_balance(cursor, dealer_name, selected_date, is_other_dealer=is_other, dealer_code=dealer_code)
+            opening = openings[dealer_code]
             
             # Get today's billed
             if is_other:
@@ -2329,7 +2524,6 @@ def get_dealer_balance():
         opening_balance_vehicles = {}
         has_current_month_pending = False
         try:
-            from datetime import timedelta
             selected_dt = datetime.strptime(selected_date, '%Y-%m-%d')
             prev_date = (selected_dt - timedelta(days=1)).strftime('%Y-%m-%d')
             
@@ -2565,7 +2759,7 @@ def get_dealer_balance():
                 continue
             
             # Get dealer name
-            cursor.execute('SELECT dealer_name FROM sales_data WHERE dealer_code = ? LIMIT 1', (dealer_code,))
+            cursor.execute('SELECT dealer_name FROM sales_data WHERE dealer_code = ? ORDER BY id LIMIT 1', (dealer_code,))
             dn_row = cursor.fetchone()
             dealer_name = dn_row[0] if dn_row else f'Dealer {dealer_code}'
             
@@ -2611,6 +2805,7 @@ def get_dealer_balance():
             SELECT DISTINCT truck_number
             FROM vehicle_unloading
             WHERE unloading_date = ?
+            ORDER BY truck_number
         ''', (selected_date,))
         
         for row in cursor.fetchall():
@@ -2674,8 +2869,6 @@ def get_dealer_balance():
         
         # Old logic removed - we now use daily_vehicle_pending above
         
-        db.close()
-        
         # Sort by dealer name
         dealers.sort(key=lambda x: x['dealer_name'])
         
@@ -2714,7 +2907,7 @@ def get_dealer_balance():
 def get_all_dealers():
     """Get all unique dealers from the database - one entry per dealer_code"""
     try:
-        db = SalesCollectionsDatabase(DB_PATH)
+        db = get_db()
         cursor = db.conn.cursor()
         
         # Group by dealer_code and pick the shortest dealer_name (without suffix like "(8632)")
@@ -2748,7 +2941,6 @@ def get_all_dealers():
                 'dealer_name': display_name
             })
         
-        db.close()
         return jsonify({'success': True, 'dealers': dealers})
         
     except Exception as e:
@@ -2764,7 +2956,7 @@ def get_vehicles_for_date():
         if not selected_date:
             return jsonify({'success': False, 'message': 'Date is required'})
         
-        db = SalesCollectionsDatabase(DB_PATH)
+        db = get_db()
         cursor = db.conn.cursor()
         
         # Get all vehicles (invoices) for the selected date
@@ -2787,6 +2979,7 @@ def get_vehicles_for_date():
                    unloaded_quantity, notes
             FROM vehicle_unloading 
             WHERE unloading_date = ?
+            ORDER BY id
         ''', (selected_date,))
         
         unloading_data = cursor.fetchall()
@@ -2834,8 +3027,6 @@ def get_vehicles_for_date():
                 'unloading_details': unloading_map.get(key, [])
             })
         
-        db.close()
-        
         return jsonify({
             'success': True,
             'vehicles': vehicles,
@@ -2857,10 +3048,10 @@ def get_consolidated_vehicles():
         
         from datetime import datetime
         selected_dt = datetime.strptime(selected_date, '%Y-%m-%d')
-        month_start = selected_dt.replace(day=1).strftime('%Y-%m-%d')
+        month_start = month_start_of(selected_date)
         month_year = selected_dt.strftime('%Y-%m')
         
-        db = SalesCollectionsDatabase(DB_PATH)
+        db = get_db()
         cursor = db.conn.cursor()
         
         # Get all invoices for the selected date grouped by truck
@@ -3021,6 +3212,7 @@ def get_consolidated_vehicles():
                    notes, dealer_code, is_other_dealer, unloading_date, plant_depot
             FROM vehicle_unloading 
             WHERE unloading_date = ?
+            ORDER BY id
         ''', (selected_date,))
         
         unloading_data = cursor.fetchall()
@@ -4193,7 +4385,7 @@ def get_consolidated_vehicles():
                 dealer_code = row[2]
                 
                 # Look up dealer name
-                cursor.execute('SELECT dealer_name FROM sales_data WHERE dealer_code = ? LIMIT 1', (dealer_code,))
+                cursor.execute('SELECT dealer_name FROM sales_data WHERE dealer_code = ? ORDER BY id LIMIT 1', (dealer_code,))
                 dealer_row = cursor.fetchone()
                 dealer_name = dealer_row[0] if dealer_row else f'Dealer {dealer_code}'
                 
@@ -4820,8 +5012,6 @@ def get_consolidated_vehicles():
         except Exception as e:
             pass
         
-        db.close()
-        
         # Sort by: 1) Pending first, Complete last  2) Opening/Previous before Today  3) Truck number
         def sort_key(x):
             # Completed vehicles go to bottom (remaining_total <= 0.01)
@@ -4874,7 +5064,7 @@ def save_other_dealer_billing():
         if total_quantity <= 0:
             return jsonify({'success': False, 'message': 'Total quantity must be greater than 0'})
         
-        db = SalesCollectionsDatabase(DB_PATH)
+        db = get_db()
         cursor = db.conn.cursor()
         
         cursor.execute('''
@@ -4888,7 +5078,6 @@ def save_other_dealer_billing():
               ppc_value, premium_value, opc_value, total_value))
         
         db.conn.commit()
-        db.close()
         
         return jsonify({
             'success': True,
@@ -4923,7 +5112,7 @@ def save_vehicle_unloading():
         # Calculate total unloaded quantity for this entry
         total_unloaded = ppc_unloaded + premium_unloaded + opc_unloaded
         
-        db = SalesCollectionsDatabase(DB_PATH)
+        db = get_db()
         cursor = db.conn.cursor()
         
         # Get total billed quantity for this truck (from sales_data and other_dealers_billing)
@@ -4974,21 +5163,18 @@ def save_vehicle_unloading():
         # Validate: new unloading + already unloaded should not exceed total billed
         # Check by product type
         if (already_unloaded_ppc + ppc_unloaded) > (total_billed_ppc + 0.01):
-            db.close()
             return jsonify({
                 'success': False, 
                 'message': f'PPC unloading ({already_unloaded_ppc + ppc_unloaded:.2f} MT) exceeds total billed PPC ({total_billed_ppc:.2f} MT) for this vehicle'
             })
         
         if (already_unloaded_premium + premium_unloaded) > (total_billed_premium + 0.01):
-            db.close()
             return jsonify({
                 'success': False, 
                 'message': f'Premium unloading ({already_unloaded_premium + premium_unloaded:.2f} MT) exceeds total billed Premium ({total_billed_premium:.2f} MT) for this vehicle'
             })
         
         if (already_unloaded_opc + opc_unloaded) > (total_billed_opc + 0.01):
-            db.close()
             return jsonify({
                 'success': False, 
                 'message': f'OPC unloading ({already_unloaded_opc + opc_unloaded:.2f} MT) exceeds total billed OPC ({total_billed_opc:.2f} MT) for this vehicle'
@@ -4996,7 +5182,6 @@ def save_vehicle_unloading():
         
         # Check total
         if (already_unloaded_total + total_unloaded) > (total_billed + 0.01):
-            db.close()
             return jsonify({
                 'success': False, 
                 'message': f'Total unloading ({already_unloaded_total + total_unloaded:.2f} MT) exceeds total billed ({total_billed:.2f} MT) for this vehicle'
@@ -5012,7 +5197,6 @@ def save_vehicle_unloading():
               unloading_point, ppc_unloaded, premium_unloaded, opc_unloaded, total_unloaded, notes, is_other_dealer))
         
         db.conn.commit()
-        db.close()
         
         return jsonify({
             'success': True,
@@ -5026,12 +5210,11 @@ def save_vehicle_unloading():
 def delete_unloading(unloading_id):
     """Delete a specific unloading record"""
     try:
-        db = SalesCollectionsDatabase(DB_PATH)
+        db = get_db()
         cursor = db.conn.cursor()
         
         cursor.execute('DELETE FROM vehicle_unloading WHERE id = ?', (unloading_id,))
         db.conn.commit()
-        db.close()
         
         return jsonify({'success': True, 'message': 'Unloading record deleted'})
         
@@ -5049,7 +5232,7 @@ def opening_material_balance():
 def get_dealers_list():
     """Get list of all dealers - one entry per dealer_code"""
     try:
-        db = SalesCollectionsDatabase(DB_PATH)
+        db = get_db()
         cursor = db.conn.cursor()
         
         # Group by dealer_code and pick the shortest dealer_name (without suffix like "(8632)")
@@ -5083,7 +5266,6 @@ def get_dealers_list():
                 'dealer_name': display_name
             })
         
-        db.close()
         return jsonify({'dealers': dealers})
         
     except Exception as e:
@@ -5096,7 +5278,7 @@ def get_opening_material_balance():
         data = request.get_json()
         month_year = data.get('month_year', '')
         
-        db = SalesCollectionsDatabase(DB_PATH)
+        db = get_db()
         cursor = db.conn.cursor()
         
         # Get pending vehicles
@@ -5139,8 +5321,6 @@ def get_opening_material_balance():
                 'dealer_type': row[6] or 'Active'
             })
         
-        db.close()
-        
         return jsonify({
             'pending_vehicles': pending_vehicles,
             'dealer_balances': dealer_balances
@@ -5158,7 +5338,7 @@ def save_opening_material_balance():
         pending_vehicles = data.get('pending_vehicles', [])
         dealer_balances = data.get('dealer_balances', [])
         
-        db = SalesCollectionsDatabase(DB_PATH)
+        db = get_db()
         cursor = db.conn.cursor()
         
         # Create tables if they don't exist
@@ -5226,7 +5406,6 @@ def save_opening_material_balance():
                   balance.get('premium_qty', 0), balance.get('opc_qty', 0)))
         
         db.conn.commit()
-        db.close()
         
         return jsonify({'success': True, 'message': 'Data saved successfully'})
         
@@ -5245,8 +5424,7 @@ def api_unloading_query():
         data = request.get_json()
         query_type = data.get('query_type')
         
-        db = sqlite3.connect(DB_PATH)
-        cursor = db.cursor()
+        cursor = get_db().conn.cursor()
         
         # Build query based on type
         base_query = '''
@@ -5299,7 +5477,7 @@ def api_unloading_query():
                 base_query += ' AND unloading_date <= ?'
                 params.append(to_date)
         
-        base_query += ' ORDER BY unloading_date DESC, truck_number'
+        base_query += ' ORDER BY unloading_date DESC, truck_number, id'
         
         cursor.execute(base_query, params)
         rows = cursor.fetchall()
@@ -5335,8 +5513,6 @@ def api_unloading_query():
                 'is_other_dealer': bool(row[10]) if row[10] is not None else False
             })
         
-        db.close()
-        
         return jsonify({
             'success': True,
             'records': records,
@@ -5356,9 +5532,6 @@ def api_unloading_query():
 def api_dealer_summary_report():
     """API endpoint for generating dealer summary report with opening balance, daily billing/unloading, and closing balance"""
     try:
-        from dateutil.relativedelta import relativedelta
-        from datetime import datetime, timedelta
-        
         data = request.get_json()
         dealer_code = data.get('dealer_code')
         from_date = data.get('from_date')
@@ -5367,8 +5540,7 @@ def api_dealer_summary_report():
         if not dealer_code or not from_date or not to_date:
             return jsonify({'success': False, 'error': 'Dealer code, from_date, and to_date are required'})
         
-        db = sqlite3.connect(DB_PATH)
-        cursor = db.cursor()
+        cursor = get_db().conn.cursor()
         
         # Get dealer name
         cursor.execute('SELECT dealer_name FROM dealers WHERE dealer_code = ?', (dealer_code,))
@@ -5496,6 +5668,7 @@ def api_dealer_summary_report():
                 SELECT truck_number, ppc_quantity, premium_quantity, opc_quantity, total_quantity
                 FROM sales_data
                 WHERE dealer_code = ? AND sale_date = ?
+                ORDER BY id
             ''', (dealer_code, date_str))
             billing_rows = cursor.fetchall()
             
@@ -5526,6 +5699,7 @@ def api_dealer_summary_report():
                 SELECT truck_number, unloading_point, ppc_unloaded, premium_unloaded, opc_unloaded, unloaded_quantity
                 FROM vehicle_unloading
                 WHERE dealer_code = ? AND unloading_date = ?
+                ORDER BY id
             ''', (dealer_code, date_str))
             unloading_rows = cursor.fetchall()
             
@@ -5569,8 +5743,6 @@ def api_dealer_summary_report():
             
             current_date += timedelta(days=1)
         
-        db.close()
-        
         return jsonify({
             'success': True,
             'dealer_code': dealer_code,
@@ -5606,15 +5778,13 @@ def dealer_financial_balance():
 def get_dealer_financial_balance():
     """Get dealer financial balance data for a month"""
     try:
-        from dateutil.relativedelta import relativedelta
-        
         data = request.get_json()
         month_year = data.get('month_year', '')
         
         if not month_year:
             return jsonify({'success': False, 'error': 'Month year is required'})
         
-        db = SalesCollectionsDatabase(DB_PATH)
+        db = get_db()
         cursor = db.conn.cursor()
         
         # Get month start and end dates
@@ -5627,20 +5797,13 @@ def get_dealer_financial_balance():
             next_month_start = f'{year}-{month + 1:02d}-01'
         
         # Calculate previous month
-        current_month_dt = datetime.strptime(month_year + '-01', '%Y-%m-%d')
-        prev_month_dt = current_month_dt - relativedelta(months=1)
-        prev_month_year = prev_month_dt.strftime('%Y-%m')
+        prev_month_year = prev_month_str(month_year)
         prev_month_start = prev_month_year + '-01'
         
-        # Get all dealers from current month AND previous month
+        # Get all dealers from current month AND previous month (the two months
+        # are adjacent, so one date range per table covers both)
         cursor.execute('''
             SELECT DISTINCT dealer_code, dealer_name FROM (
-                SELECT dealer_code, dealer_name FROM sales_data
-                WHERE sale_date >= ? AND sale_date < ?
-                UNION
-                SELECT dealer_code, dealer_name FROM collections_data
-                WHERE posting_date >= ? AND posting_date < ?
-                UNION
                 SELECT dealer_code, dealer_name FROM sales_data
                 WHERE sale_date >= ? AND sale_date < ?
                 UNION
@@ -5651,12 +5814,11 @@ def get_dealer_financial_balance():
                 WHERE month_year = ?
             )
             ORDER BY dealer_name
-        ''', (month_start, next_month_start, month_start, next_month_start,
-              prev_month_start, month_start, prev_month_start, month_start, prev_month_year))
+        ''', (prev_month_start, next_month_start, prev_month_start, next_month_start, prev_month_year))
         
         dealers_map = {}
         for row in cursor.fetchall():
-            dealer_code = str(row[0])
+            dealer_code = row[0]
             dealers_map[dealer_code] = {
                 'dealer_code': dealer_code,
                 'dealer_name': row[1],
@@ -5677,7 +5839,7 @@ def get_dealer_financial_balance():
         ''', (month_start, next_month_start))
         
         for row in cursor.fetchall():
-            dealer_code = str(row[0])
+            dealer_code = row[0]
             if dealer_code in dealers_map:
                 dealers_map[dealer_code]['purchase_value'] = row[1] or 0
         
@@ -5690,7 +5852,7 @@ def get_dealer_financial_balance():
         ''', (month_start, next_month_start))
         
         for row in cursor.fetchall():
-            dealer_code = str(row[0])
+            dealer_code = row[0]
             if dealer_code in dealers_map:
                 dealers_map[dealer_code]['collection'] = row[1] or 0
         
@@ -5702,7 +5864,7 @@ def get_dealer_financial_balance():
             WHERE month_year = ?
         ''', (month_year,))
         for row in cursor.fetchall():
-            manual_opening[str(row[0])] = row[1] or 0
+            manual_opening[row[0]] = row[1] or 0
         
         # Always calculate previous month's closing for dealers without manual opening
         # Get previous month's opening balances
@@ -5714,7 +5876,7 @@ def get_dealer_financial_balance():
         
         prev_opening = {}
         for row in cursor.fetchall():
-            prev_opening[str(row[0])] = row[1] or 0
+            prev_opening[row[0]] = row[1] or 0
         
         # Get previous month's sales
         cursor.execute('''
@@ -5726,7 +5888,7 @@ def get_dealer_financial_balance():
         
         prev_sales = {}
         for row in cursor.fetchall():
-            prev_sales[str(row[0])] = row[1] or 0
+            prev_sales[row[0]] = row[1] or 0
         
         # Get previous month's collections
         cursor.execute('''
@@ -5738,11 +5900,11 @@ def get_dealer_financial_balance():
         
         prev_collections = {}
         for row in cursor.fetchall():
-            prev_collections[str(row[0])] = row[1] or 0
+            prev_collections[row[0]] = row[1] or 0
         
-        # Get previous month's credit notes
+        # Get previous month's credit notes (the note tables are optional)
         prev_credits = {}
-        try:
+        if db.has_credit_discounts:
             cursor.execute('''
                 SELECT dealer_code, SUM(credit_discount)
                 FROM credit_discounts
@@ -5750,13 +5912,11 @@ def get_dealer_financial_balance():
                 GROUP BY dealer_code
             ''', (prev_month_year,))
             for row in cursor.fetchall():
-                prev_credits[str(row[0])] = row[1] or 0
-        except:
-            pass
+                prev_credits[row[0]] = row[1] or 0
         
         # Get previous month's debit notes
         prev_debits = {}
-        try:
+        if db.has_debit_notes:
             cursor.execute('''
                 SELECT dealer_code, SUM(debit_amount)
                 FROM debit_notes
@@ -5764,9 +5924,7 @@ def get_dealer_financial_balance():
                 GROUP BY dealer_code
             ''', (prev_month_year,))
             for row in cursor.fetchall():
-                prev_debits[str(row[0])] = row[1] or 0
-        except:
-            pass
+                prev_debits[row[0]] = row[1] or 0
         
         # Set opening balance: use manual if exists, otherwise calculate from previous month
         for dealer_code in dealers_map:
@@ -5790,7 +5948,7 @@ def get_dealer_financial_balance():
         ''', (month_year,))
         
         for row in cursor.fetchall():
-            dealer_code = str(row[0])
+            dealer_code = row[0]
             if dealer_code in dealers_map:
                 dealers_map[dealer_code]['credit_note'] = row[1] or 0
                 dealers_map[dealer_code]['gst_hold'] = row[2] or 0
@@ -5803,12 +5961,10 @@ def get_dealer_financial_balance():
         ''', (month_year,))
         
         for row in cursor.fetchall():
-            dealer_code = str(row[0])
+            dealer_code = row[0]
             if dealer_code in dealers_map:
                 dealers_map[dealer_code]['debit_note'] = row[1] or 0
         
-        db.close()
-        
         # Convert to list and sort by dealer name
         dealers = sorted(dealers_map.values(), key=lambda x: x['dealer_name'])
         
@@ -5831,7 +5987,7 @@ def save_dealer_financial_balance():
         if not month_year:
             return jsonify({'success': False, 'error': 'Month year is required'})
         
-        db = SalesCollectionsDatabase(DB_PATH)
+        db = get_db()
         cursor = db.conn.cursor()
         
         for dealer in dealers:
@@ -5867,7 +6023,7 @@ def save_dealer_financial_balance():
             ''', (dealer_code, dealer_name, debit_note, month_year, debit_note, dealer_name))
         
         db.conn.commit()
-        db.close()
+        clear_balance_caches()
         
         return jsonify({'success': True, 'message': f'Saved data for {len(dealers)} dealers'})
         
@@ -6195,9 +6351,7 @@ def upload_dealer_statement():
             
             # Get existing values from database for comparison
             # Use the same logic as financial balance page to get opening balance
-            from dateutil.relativedelta import relativedelta
-            
-            db = SalesCollectionsDatabase(DB_PATH)
+            db = get_db()
             cursor = db.conn.cursor()
             
             # Calculate opening balance the same way as financial balance page
@@ -6208,9 +6362,7 @@ def upload_dealer_statement():
             else:
                 next_month_start = f'{year}-{month + 1:02d}-01'
             
-            current_month_dt = datetime.strptime(month_year + '-01', '%Y-%m-%d')
-            prev_month_dt = current_month_dt - relativedelta(months=1)
-            prev_month_year = prev_month_dt.strftime('%Y-%m')
+            prev_month_year = prev_month_str(month_year)
             prev_month_start = prev_month_year + '-01'
             
             # Check if manual opening balance exists for this month
@@ -6272,8 +6424,6 @@ def upload_dealer_statement():
             existing_drn = cursor.fetchone()
             existing_drn_value = existing_drn[0] if existing_drn else 0
             
-            db.close()
-            
             # Clean up temp file
             os.remove(filepath)
             
@@ -6332,7 +6482,7 @@ def save_statement_data():
         if not dealer_code or not month_year:
             return jsonify({'success': False, 'message': 'Dealer code and month_year are required'})
         
-        db = SalesCollectionsDatabase(DB_PATH)
+        db = get_db()
         cursor = db.conn.cursor()
         
         # Update credit note and GST hold if provided
@@ -6363,7 +6513,7 @@ def save_statement_data():
             ''', (dealer_code, dealer_name, opening_balance, month_year, opening_balance, dealer_name))
         
         db.conn.commit()
-        db.close()
+        clear_balance_caches()
         
         return jsonify({'success': True, 'message': 'Statement data saved successfully'})
         
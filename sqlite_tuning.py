@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+"""
+SQLite connection tuning shared by the maintenance scripts
+"""
+
+# WAL journal with relaxed fsync, in-memory temp tables, ~200MB page cache
+# and 256MB of memory-mapped I/O
+TUNING_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-200000',
+    'PRAGMA mmap_size=268435456',
+)
+
+# Prepared-statement cache size for sqlite3.connect(); the scripts keep their SQL
+# in module-level constants so repeated executes hit this cache
+CACHED_STATEMENTS = 256
+
+def tune(conn):
+    """Apply the bulk-write PRAGMAs to a freshly opened connection"""
+    for pragma in TUNING_PRAGMAS:
+        conn.execute(pragma)
+    return conn
@@ -41,11 +41,15 @@ fi
 # Create backup directory if it doesn't exist
 mkdir -p "$BACKUP_DIR"
 
+# The databases run in WAL mode, so recent writes may still be in the -wal
+# file next to the .db; copies are taken with sqlite3's .backup, which
+# includes them, instead of copying the .db file alone
+
 # Backup existing local database if it exists
 if [ -f "$LOCAL_DB_PATH" ]; then
     BACKUP_NAME="webapp_sales_collections_$(date +%Y%m%d_%H%M%S).db"
     echo -e "${YELLOW}Backing up existing local database...${NC}"
-    cp "$LOCAL_DB_PATH" "${BACKUP_DIR}/${BACKUP_NAME}"
+    sqlite3 "$LOCAL_DB_PATH" ".backup '${BACKUP_DIR}/${BACKUP_NAME}'"
     echo -e "${GREEN}Backup saved to: ${BACKUP_DIR}/${BACKUP_NAME}${NC}"
 fi
 
@@ -54,9 +58,24 @@ echo -e "${YELLOW}Fetching database from AWS server...${NC}"
 echo "Host: $AWS_HOST"
 echo "Remote path: $REMOTE_DB_PATH"
 
-scp -i "${SSH_KEY/#\~/$HOME}" "${AWS_USER}@${AWS_HOST}:${REMOTE_DB_PATH}" "$LOCAL_DB_PATH"
+# Snapshot the live database on the server, then copy the snapshot
+REMOTE_SNAPSHOT="/tmp/webapp_sales_collections_sync_$$.db"
+ssh -i "${SSH_KEY/#\~/$HOME}" "${AWS_USER}@${AWS_HOST}" \
+    "sqlite3 '${REMOTE_DB_PATH}' \".backup '${REMOTE_SNAPSHOT}'\"" &&
+scp -i "${SSH_KEY/#\~/$HOME}" "${AWS_USER}@${AWS_HOST}:${REMOTE_SNAPSHOT}" "${LOCAL_DB_PATH}.sync"
+SYNC_STATUS=$?
+ssh -i "${SSH_KEY/#\~/$HOME}" "${AWS_USER}@${AWS_HOST}" "rm -f '${REMOTE_SNAPSHOT}'"
+
+# Replace the local database, dropping its old WAL files so they aren't
+# replayed into the fetched copy
+if [ $SYNC_STATUS -eq 0 ]; then
+    rm -f "${LOCAL_DB_PATH}-wal" "${LOCAL_DB_PATH}-shm"
+    mv "${LOCAL_DB_PATH}.sync" "$LOCAL_DB_PATH"
+else
+    rm -f "${LOCAL_DB_PATH}.sync"
+fi
 
-if [ $? -eq 0 ]; then
+if [ $SYNC_STATUS -eq 0 ]; then
     echo -e "${GREEN}========================================${NC}"
     echo -e "${GREEN}  Database synced successfully!${NC}"
     echo -e "${GREEN}========================================${NC}"
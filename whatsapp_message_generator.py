@@ -5,7 +5,9 @@ Generates formatted WhatsApp messages with billing details for dealers
 """
 
 import sqlite3
-from datetime import datetime, timedelta
+from calendar import monthrange
+from datetime import date, datetime, timedelta
+from functools import lru_cache
 import sys
 import os
 
@@ -25,25 +27,69 @@ BANK_HOLIDAYS = [
     # Add more holidays as needed
 ]
 
+_BANK_HOLIDAY_DATES = frozenset(date.fromisoformat(d) for d in BANK_HOLIDAYS)
+
+# (year, month) -> bitmask of working days, bit N set when day N is a working day
+_month_mask_cache = {}
+
+def _working_day_mask(year, month):
+    """Get the working-day bitmask for a month, computing it once per month"""
+    mask = _month_mask_cache.get((year, month))
+    if mask is None:
+        mask = 0
+        for day in range(1, monthrange(year, month)[1] + 1):
+            current = date(year, month, day)
+            # Skip weekends (Saturday=5, Sunday=6) and bank holidays
+            if current.weekday() < 5 and current not in _BANK_HOLIDAY_DATES:
+                mask |= 1 << day
+        _month_mask_cache[(year, month)] = mask
+    return mask
+
+@lru_cache(maxsize=4096)
+def is_working_day(day):
+    """Check if a date is a working day (not a weekend or bank holiday)"""
+    return bool(_working_day_mask(day.year, day.month) >> day.day & 1)
+
+def _count_working_days(start, end):
+    """Count working days after start, up to and including end"""
+    count = 0
+    current = start + timedelta(days=1)
+    while current <= end:
+        if (current.year, current.month) == (end.year, end.month):
+            last_day = end.day
+        else:
+            last_day = monthrange(current.year, current.month)[1]
+        # Bits current.day..last_day of this month's working-day mask
+        span = ((1 << (last_day + 1)) - 1) ^ ((1 << current.day) - 1)
+        count += bin(_working_day_mask(current.year, current.month) & span).count('1')
+        current = date(current.year, current.month, last_day) + timedelta(days=1)
+    return count
+
 def calculate_due_date(billing_date, working_days=4):
     """Calculate due date excluding weekends and bank holidays"""
-    current_date = datetime.strptime(billing_date, '%Y-%m-%d')
+    current_date = datetime.strptime(billing_date, '%Y-%m-%d').date()
     days_added = 0
     
+    if working_days > 0:
+        # Jump whole weeks first (at most 5 working days each), leaving at least
+        # one working day for the walk below so it always stops on a working day
+        full_weeks = (working_days - 1) // 5
+        if full_weeks:
+            jump_date = current_date + timedelta(weeks=full_weeks)
+            days_added = _count_working_days(current_date, jump_date)
+            current_date = jump_date
+    
     while days_added < working_days:
         current_date += timedelta(days=1)
         
-        # Skip weekends (Saturday=5, Sunday=6)
-        if current_date.weekday() >= 5:
-            continue
-            
-        # Skip bank holidays
-        if current_date.strftime('%Y-%m-%d') in BANK_HOLIDAYS:
-            continue
-            
-        days_added += 1
+        if is_working_day(current_date):
+            days_added += 1
     
-    return current_date.strftime('%Y-%m-%d')
+    return current_date.isoformat()
+
+def format_date_indian(date_obj, sep='-'):
+    """Format a date as DD-MM-YYYY (or with another separator) without strftime"""
+    return f"{date_obj.day:02d}{sep}{date_obj.month:02d}{sep}{date_obj.year}"
 
 def get_dealer_billing_data(dealer_code, billing_date):
     """Get individual invoice data for a specific dealer on a specific date"""
@@ -85,32 +131,16 @@ def get_dealer_billing_data(dealer_code, billing_date):
             }
             
             # Add material details
-            if ppc_qty > 0:
-                ppc_bags = int(ppc_qty * 20)
-                ppc_price_per_bag = ppc_val / ppc_bags if ppc_bags > 0 else 0
-                invoice['materials'].append({
-                    'type': 'PPC',
-                    'bags': ppc_bags,
-                    'price_per_bag': ppc_price_per_bag
-                })
-            
-            if premium_qty > 0:
-                premium_bags = int(premium_qty * 20)
-                premium_price_per_bag = premium_val / premium_bags if premium_bags > 0 else 0
-                invoice['materials'].append({
-                    'type': 'Premium',
-                    'bags': premium_bags,
-                    'price_per_bag': premium_price_per_bag
-                })
-            
-            if opc_qty > 0:
-                opc_bags = int(opc_qty * 20)
-                opc_price_per_bag = opc_val / opc_bags if opc_bags > 0 else 0
-                invoice['materials'].append({
-                    'type': 'OPC',
-                    'bags': opc_bags,
-                    'price_per_bag': opc_price_per_bag
-                })
+            for material_type, qty, value in (('PPC', ppc_qty, ppc_val),
+                                              ('Premium', premium_qty, premium_val),
+                                              ('OPC', opc_qty, opc_val)):
+                if qty > 0:
+                    bags = int(qty * 20)
+                    invoice['materials'].append({
+                        'type': material_type,
+                        'bags': bags,
+                        'price_per_bag': value / bags if bags > 0 else 0
+                    })
             
             invoices.append(invoice)
         
@@ -143,8 +173,8 @@ def generate_whatsapp_message(dealer_code, billing_date, truck_numbers=None, cus
         due_date = calculate_due_date(billing_date)
     
     # Format dates for display
-    billing_date_formatted = datetime.strptime(billing_date, '%Y-%m-%d').strftime('%d/%m/%Y')
-    due_date_formatted = datetime.strptime(due_date, '%Y-%m-%d').strftime('%d/%m/%Y')
+    billing_date_formatted = format_date_indian(datetime.strptime(billing_date, '%Y-%m-%d'), '/')
+    due_date_formatted = format_date_indian(datetime.strptime(due_date, '%Y-%m-%d'), '/')
     
     # Build the message
     message = f"""*Billing Date:* {billing_date_formatted}